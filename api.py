@@ -29,7 +29,7 @@ import urllib.parse
 
 from flask import abort, request
 from oauth_dropins.webutil import flask_util, util
-from oauth_dropins.webutil.util import json_dumps, json_loads
+from oauth_dropins.webutil.util import json_loads
 from werkzeug.exceptions import BadRequest
 
 import app
@@ -60,6 +60,8 @@ MAX_PATH_LEN = len(PATH_DEFAULTS) + 1
 
 @app.app.route('/<path:path>', methods=('GET', 'HEAD'))
 @flask_util.cached(app.cache, app.RESPONSE_CACHE_TIME)
+@app.coalesce
+@app.compress
 def api(path):
   """Handles an API GET.
 
@@ -127,30 +129,33 @@ def api(path):
 
   # get activities (etc)
   try:
-    if len(args) >= 2 and args[1] == '@blocks':
-      try:
-        response = {'items': src.get_blocklist()}
-      except source.RateLimited as e:
-        if not e.partial:
-          return abort(429, str(e))
-        response = {'items': e.partial}
-    else:
-      response = src.get_activities_response(*args, **get_kwargs())
+    with app.timed('fetch'):
+      if len(args) >= 2 and args[1] == '@blocks':
+        try:
+          response = {'items': src.get_blocklist()}
+        except source.RateLimited as e:
+          if not e.partial:
+            return abort(429, str(e))
+          response = {'items': e.partial}
+      else:
+        response = src.get_activities_response(*args, **get_kwargs())
   except (NotImplementedError, ValueError) as e:
     return abort(400, str(e))
     # other exceptions are handled by webutil.flask_util.handle_exception(),
     # which uses interpret_http_exception(), etc.
 
-  logger.info(f'Got activities: {json_dumps(response, indent=2)}')
+  app.log_payload('Got activities', response)
 
   # fetch actor if necessary
   actor = response.get('actor')
   if not actor and request.args.get('format') == 'atom':
     # atom needs actor
-    actor = src.get_actor(user_id) if src else {}
-    logger.info(f'Got actor: {json_dumps(actor, indent=2)}')
+    with app.timed('fetch'):
+      actor = src.get_actor(user_id) if src else {}
+    app.log_payload('Got actor', actor)
 
-  return app.make_response(response, actor=actor, url=src.BASE_URL)
+  return app.make_response(response, actor=actor, url=src.BASE_URL,
+                           stream=app.cache_skipped())
 
 
 def get_kwargs():
@@ -1,13 +1,33 @@
 """Serves the the front page, discovery files, and OAuth flows.
 """
+import collections
+from concurrent import futures
+import contextlib
+import contextvars
+import copy
 import datetime
 import functools
+import gzip
 import importlib
 import logging
+import random
+import threading
+import time
 import urllib.parse
 from xml.etree import ElementTree
 
-from flask import abort, Flask, redirect, render_template, request
+from flask import (
+  abort,
+  Flask,
+  g,
+  has_app_context,
+  has_request_context,
+  redirect,
+  render_template,
+  request,
+  Response,
+  stream_with_context,
+)
 from flask_caching import Cache
 import flask_gae_static
 from google.cloud import ndb
@@ -113,12 +133,31 @@ FORMATS = {
   'rss': rss.CONTENT_TYPE,
   'xml': 'application/xml',
 }
+BATCH_CONTENT_TYPE = 'application/x-ndjson'
 XML_TEMPLATE = """\
 <?xml version="1.0" encoding="UTF-8"?>
 <response>%s</response>
 """
 
 RESPONSE_CACHE_TIME = datetime.timedelta(minutes=10)
+# how long to keep upstream /url bodies around for conditional GETs
+UPSTREAM_CACHE_TIME = datetime.timedelta(days=1)
+UPSTREAM_CACHE_MAX_SIZE = 1000 * 1000  # bytes
+# how long coalesced requests wait for the first one before giving up and
+# handling the request themselves
+COALESCE_TIMEOUT = datetime.timedelta(minutes=1)
+# fraction of requests whose input and output payloads we log. override per
+# request with the log_payloads=true|false query param.
+PAYLOAD_LOG_SAMPLE_RATE = .01
+PAYLOAD_LOG_MAX_CHARS = 10000
+# number of recently logged payloads to keep in memory, in recent_payloads
+PAYLOAD_BUFFER_SIZE = 50
+# /url/batch limits
+BATCH_MAX_ITEMS = 100
+BATCH_MAX_WORKERS = 8
+# responses smaller than this aren't worth gzipping
+GZIP_MIN_SIZE = 1024  # bytes
+GZIP_LEVEL = 6
 
 
 app = Flask(__name__, static_folder=None)
@@ -139,6 +178,287 @@ app.wsgi_app = flask_util.ndb_context_middleware(
 cache = Cache(app)
 
 
+class Timer(object):
+  """Times the phases of a single request, eg fetch, parse, convert, render.
+
+  Attributes:
+    start: float, :func:`time.perf_counter` when the request started
+    phases: dict mapping str phase name to float total seconds, in the order
+      they first happened
+    upstream: :class:`source.UpstreamStats`, outbound HTTP requests
+  """
+  def __init__(self):
+    self.start = time.perf_counter()
+    self.phases = {}
+    self.upstream = source.UpstreamStats()
+    self._lock = threading.Lock()
+
+  def add(self, phase, seconds):
+    """Adds time to a phase. Thread safe."""
+    with self._lock:
+      self.phases[phase] = self.phases.get(phase, 0) + seconds
+
+  def server_timing(self):
+    """Returns a Server-Timing header value.
+
+    https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Server-Timing
+    """
+    metrics = [f'{phase};dur={seconds * 1000:.1f}'
+               for phase, seconds in self.phases.items()]
+    if self.upstream.requests:
+      metrics.append(
+        f'upstream;dur={self.upstream.seconds * 1000:.1f};'
+        f'desc="{self.upstream.requests} requests, {self.upstream.bytes} bytes"')
+    metrics.append(f'total;dur={(time.perf_counter() - self.start) * 1000:.1f}')
+    return ', '.join(metrics)
+
+  def to_json(self):
+    """Returns a JSON-compatible dict of this request's timings, in ms."""
+    return {
+      'total_ms': round((time.perf_counter() - self.start) * 1000, 1),
+      'phases_ms': {phase: round(seconds * 1000, 1)
+                    for phase, seconds in self.phases.items()},
+      'upstream': {
+        'requests': self.upstream.requests,
+        'errors': self.upstream.errors,
+        'bytes': self.upstream.bytes,
+        'ms': round(self.upstream.seconds * 1000, 1),
+      },
+    }
+
+
+@contextlib.contextmanager
+def timed(phase):
+  """Context manager and decorator that times a phase of the current request.
+
+  Does nothing outside of a request. Works in :func:`source.concurrent_map`
+  worker threads too.
+
+  Args:
+    phase: str, eg ``fetch`` or ``render``
+  """
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    timer = g.get('timer') if has_app_context() else None
+    if timer:
+      timer.add(phase, time.perf_counter() - start)
+
+
+@app.before_request
+def start_timer():
+  g.timer = Timer()
+  source.upstream_stats.set(g.timer.upstream)
+
+
+@app.after_request
+def finish_timer(resp):
+  """Adds the Server-Timing header and logs the request's timings."""
+  source.upstream_stats.set(None)
+  timer = g.pop('timer', None)
+  if timer:
+    resp.headers['Server-Timing'] = timer.server_timing()
+    log_timing(timer, resp.status_code)
+  return resp
+
+
+def log_timing(timer, status):
+  """Logs the current request's timings.
+
+  Args:
+    timer: :class:`Timer`
+    status: int, HTTP response status code
+  """
+  logged = {
+    'method': request.method,
+    'path': request.path,
+    'status': status,
+    **timer.to_json(),
+  }
+  logger.info(f'Request timing: {json_dumps(logged)}')
+
+
+@app.before_request
+def start_render_cache():
+  """Caches :func:`microformats2.render_content` output for this request.
+
+  Lets renders of the same object with the same flags be shared across the
+  whole request, not just inside a single object. Streamed responses render
+  after the request ends, so they only get
+  :func:`microformats2.object_to_json`'s own per-object cache.
+  """
+  microformats2.render_cache.set({})
+
+
+@app.teardown_request
+def clear_render_cache(exc=None):
+  microformats2.render_cache.set(None)
+
+
+# recently logged payloads, for debugging. deque of dicts with time, path,
+# label, and payload keys; see log_payload.
+recent_payloads = collections.deque(maxlen=PAYLOAD_BUFFER_SIZE)
+
+
+def should_log_payloads():
+  """Returns True if we should log payloads for the current request.
+
+  Obeys the ``log_payloads`` query param if it's ``true`` or ``false``.
+  Otherwise samples :const:`PAYLOAD_LOG_SAMPLE_RATE` of requests, once per
+  request.
+  """
+  if has_request_context():
+    override = request.args.get('log_payloads', '').lower()
+    if override in ('true', 'false'):
+      return override == 'true'
+
+  if not has_app_context():
+    return random.random() < PAYLOAD_LOG_SAMPLE_RATE
+
+  if 'log_payloads' not in g:
+    g.log_payloads = random.random() < PAYLOAD_LOG_SAMPLE_RATE
+  return g.log_payloads
+
+
+def log_payload(label, payload):
+  """Logs a payload, eg fetched input or converted output, if we're sampling.
+
+  Payloads are serialized lazily, only if :func:`should_log_payloads`, and
+  truncated to :const:`PAYLOAD_LOG_MAX_CHARS`. Logged payloads are also kept in
+  :data:`recent_payloads`.
+
+  Args:
+    label: str, eg ``Got mf2``
+    payload: str, JSON-compatible value, or callable that returns either
+  """
+  if not should_log_payloads():
+    return
+
+  if callable(payload):
+    payload = payload()
+  text = payload if isinstance(payload, str) else json_dumps(payload)
+  if len(text) > PAYLOAD_LOG_MAX_CHARS:
+    text = f'{text[:PAYLOAD_LOG_MAX_CHARS]}... ({len(text)} chars total)'
+
+  logger.info(f'{label}: {text}')
+  recent_payloads.append({
+    'time': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    'path': request.full_path if has_request_context() else None,
+    'label': label,
+    'payload': text,
+  })
+
+
+class Flight(object):
+  """A request that's in progress, along with other requests waiting on it.
+
+  Attributes:
+    done: :class:`threading.Event`, set when the first request finishes
+    response: tuple, (bytes body, int status, list of header tuples) snapshot
+      of the first request's response, or None if it raised an exception
+    waiters: int, number of other requests waiting on this one
+  """
+  def __init__(self):
+    self.done = threading.Event()
+    self.response = None
+    self.waiters = 0
+
+
+flights = {}  # maps str request key to Flight
+flights_lock = threading.Lock()
+
+
+def cache_skipped():
+  """Returns True if :func:`flask_util.cached` won't cache this request.
+
+  Mirrors its ``unless`` check: a ``cache=false`` query param or any cookies.
+  """
+  return bool(request.args.get('cache', '').lower() == 'false' or
+              request.cookies)
+
+
+def coalesce(fn):
+  """Flask view decorator that coalesces identical concurrent requests.
+
+  The first request for a given method, path, and query runs the view. Other
+  identical requests that arrive while it's running wait for it and return a
+  copy of its response instead of running the view themselves.
+
+  Goes below :func:`flask_util.cached`, so that only cache misses are coalesced.
+  Requests that skip the cache, ie with a ``cache=false`` query param or
+  cookies, aren't coalesced. If the first request raises an exception, or
+  doesn't finish within :const:`COALESCE_TIMEOUT`, waiting requests run the
+  view themselves.
+  """
+  @functools.wraps(fn)
+  def wrapper(*args, **kwargs):
+    if cache_skipped():
+      return fn(*args, **kwargs)
+
+    key = f'{request.method} {request.full_path}'
+    with flights_lock:
+      flight = flights.get(key)
+      leader = flight is None
+      if leader:
+        flight = flights[key] = Flight()
+      else:
+        flight.waiters += 1
+
+    if not leader:
+      if (flight.done.wait(COALESCE_TIMEOUT.total_seconds())
+          and flight.response is not None):
+        data, status, headers = flight.response
+        return Response(data, status=status, headers=headers)
+      return fn(*args, **kwargs)
+
+    try:
+      # snapshot the response now, since after_request handlers may modify it
+      resp = app.make_response(fn(*args, **kwargs))
+      flight.response = (resp.get_data(), resp.status_code,
+                         list(resp.headers.items()))
+      return resp
+    finally:
+      with flights_lock:
+        del flights[key]
+      if flight.waiters:
+        logger.info(f'Coalesced {flight.waiters} other requests for {key}')
+      flight.done.set()
+
+  return wrapper
+
+
+def compress(fn):
+  """Flask view decorator that gzips successful responses.
+
+  Goes below :func:`flask_util.cached`, so that responses are cached compressed
+  and served to clients that accept gzip as is. :func:`decompress` undoes it for
+  clients that don't.
+  """
+  @functools.wraps(fn)
+  def wrapper(*args, **kwargs):
+    resp = app.make_response(fn(*args, **kwargs))
+    if (resp.status_code == 200 and not resp.direct_passthrough
+        and not resp.is_streamed and 'Content-Encoding' not in resp.headers
+        and resp.content_length and resp.content_length >= GZIP_MIN_SIZE):
+      resp.set_data(gzip.compress(resp.get_data(), GZIP_LEVEL))
+      resp.headers['Content-Encoding'] = 'gzip'
+      resp.vary.add('Accept-Encoding')
+    return resp
+
+  return wrapper
+
+
+@app.after_request
+def decompress(resp):
+  """Decompresses responses from :func:`compress` if the client can't gunzip."""
+  if (resp.headers.get('Content-Encoding') == 'gzip' and not resp.is_streamed
+      and not request.accept_encodings['gzip']):
+    resp.set_data(gzip.decompress(resp.get_data()))
+    del resp.headers['Content-Encoding']
+  return resp
+
+
 @app.route('/')
 def front_page():
   """Renders and serves the front page."""
@@ -192,11 +512,19 @@ def demo():
 
 @app.route('/url', methods=('GET', 'HEAD'))
 @flask_util.cached(cache, RESPONSE_CACHE_TIME, http_5xx=True)
+@coalesce
+@compress
 def url():
   """Handles URL requests from the interactive demo form on the front page.
 
   Responses are cached for 10m. You can skip the cache by including a cache=false
-  query param. Background: https://github.com/snarfed/bridgy/issues/665
+  query param, in which case the response is streamed. Background:
+  https://github.com/snarfed/bridgy/issues/665
+
+  The converted AS1 is also cached for 10m, keyed on just the input URL and
+  format, so that requesting multiple output formats only fetches and parses
+  the input once; see :func:`fetch_as1`. Upstream fetches are revalidated with
+  conditional GETs; see :func:`fetch_upstream`.
   """
   input = request.values['input']
   if input not in INPUTS:
@@ -207,97 +535,328 @@ def url():
   if orig_url.startswith('https://rss-bridge.netlib.re/'):
     return 'Sorry, rss-bridge.netlib.re is down right now.', 502
 
+  try:
+    converted = fetch_as1(orig_url, input,
+                          use_cache=request.values.get('cache', '').lower() != 'false')
+  except HTTPException as e:
+    if e.code // 100 != 5:
+      raise
+    # do this manually so that 504s for timeouts get cached
+    return flask_util.handle_exception(e)
+
+  return make_response(
+    source.Source.make_activities_base_response(converted['activities']),
+    url=converted['url'], actor=converted['actor'], title=converted['title'],
+    hfeed=converted['hfeed'], stream=cache_skipped())
+
+
+@app.route('/url/batch', methods=('POST',))
+def url_batch():
+  """Converts multiple URLs at once and streams the results as NDJSON.
+
+  The request body should be a JSON list of objects with ``url`` and ``input``
+  keys, at most :const:`BATCH_MAX_ITEMS` of them. Query params other than
+  ``url`` and ``input``, eg ``output``, apply to all of them, like with /url.
+
+  Inputs are fetched and converted concurrently, up to
+  :const:`BATCH_MAX_WORKERS` at a time, and each result is written as soon as
+  it's done, so results may be in a different order than the request body.
+  Each is a JSON object on its own line with ``url``, ``input``, and
+  ``status`` (HTTP status code) fields, and either ``body`` (the converted
+  output) or ``error``.
+
+  Since the conversions happen while the response streams, there's no
+  Server-Timing header. The timings are logged once the stream finishes.
+  """
+  format = request.values.get('format') or request.values.get('output') or 'json'
+  if format not in FORMATS:
+    raise BadRequest(f'Invalid format: {format}, expected one of {FORMATS!r}')
+
+  items = request.get_json(silent=True)
+  if (not isinstance(items, list) or
+      not all(isinstance(item, dict) for item in items)):
+    raise BadRequest('Expected JSON list of objects with url and input')
+  elif len(items) > BATCH_MAX_ITEMS:
+    raise BadRequest(f'Got {len(items)} items, max is {BATCH_MAX_ITEMS}')
+
+  use_cache = request.values.get('cache', '').lower() != 'false'
+  query = {name: val for name, val in request.args.items()
+           if name not in ('url', 'input')}
+
+  def convert(item):
+    orig_url = item.get('url')
+    input = item.get('input')
+    result = {'url': orig_url, 'input': input}
+    try:
+      if not orig_url or not isinstance(orig_url, str):
+        raise BadRequest('Missing url')
+      elif input not in INPUTS:
+        raise BadRequest(f'Invalid input: {input}, expected one of {INPUTS!r}')
+
+      converted = fetch_as1(orig_url, input, use_cache=use_cache)
+      # the equivalent /url request, for feeds' self links
+      request_url = request.host_url + 'url?' + urllib.parse.urlencode(
+        {'url': orig_url, 'input': input, **query})
+      body, headers = make_response(
+        source.Source.make_activities_base_response(converted['activities']),
+        url=converted['url'], actor=converted['actor'],
+        title=converted['title'], hfeed=converted['hfeed'],
+        request_url=request_url)
+      result.update({
+        'status': 200,
+        'content_type': headers.get('Content-Type'),
+        'body': body,
+      })
+    except HTTPException as e:
+      result.update({'status': e.code, 'error': e.description})
+    except Exception as e:
+      logger.warning(f'Converting {orig_url} failed', exc_info=True)
+      result.update({'status': 500, 'error': str(e)})
+
+    return json_dumps(result) + '\n'
+
+  # the items are converted after finish_timer runs, so we log this ourselves
+  timer = g.pop('timer')
+
+  def generate():
+    # stream_with_context runs this in a new app context, so restore the timer,
+    # upstream stats, and render cache, and copy them into the worker threads
+    # like source.concurrent_map does.
+    g.timer = timer
+    source.upstream_stats.set(timer.upstream)
+    microformats2.render_cache.set({})
+    try:
+      with futures.ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS) as executor:
+        running = [executor.submit(contextvars.copy_context().run, convert, item)
+                   for item in items]
+        for future in futures.as_completed(running):
+          yield future.result()
+    finally:
+      source.upstream_stats.set(None)
+      microformats2.render_cache.set(None)
+      log_timing(timer, 200)
+
+  return Response(stream_with_context(generate()), mimetype=BATCH_CONTENT_TYPE)
+
+
+def fetch_as1(orig_url, input, use_cache=True):
+  """Fetches a URL and converts it to AS1.
+
+  The converted AS1 is cached for 10m, keyed on the input URL and format.
+
+  Args:
+    orig_url: str
+    input: str, one of :const:`INPUTS`
+    use_cache: bool, whether to look in the cache first
+
+  Returns:
+    dict, from :func:`convert_to_as1`
+
+  Raises:
+    :class:`werkzeug.exceptions.HTTPException` if fetching or converting fails
+  """
   fragment = urllib.parse.urlparse(orig_url).fragment
   if fragment and input != 'html':
       raise BadRequest('URL fragments only supported with input=html.')
 
+  cache_key = f'AS1 {input} {orig_url}'
+  if use_cache:
+    converted = cache.get(cache_key)
+    if converted is not None:
+      return converted
+
   headers = {}
   if input == 'as2':
     headers['Accept'] = as2.CONTENT_TYPE
 
   try:
-    resp = util.requests_get(orig_url, headers=headers, gateway=True)
+    with timed('fetch'):
+      resp = fetch_upstream(orig_url, headers)
   except ValueError as e:
     raise BadRequest(f'Invalid url: {e}')
-  except HTTPException as e:
-    # do this manually so that 504s for timeouts get cached
-    return flask_util.handle_exception(e)
 
+  converted = convert_to_as1(resp, input, fragment)
+  log_payload('Converted to AS1', converted['activities'])
+  cache.set(cache_key, converted, timeout=RESPONSE_CACHE_TIME.total_seconds())
+  return converted
+
+
+def convert_to_as1(resp, input, fragment=None):
+  """Parses a fetched /url input and converts it to AS1.
+
+  Args:
+    resp: :class:`requests.Response`
+    input: str, one of :const:`INPUTS`
+    fragment: str, optional URL fragment, only supported for ``html`` input
+
+  Returns:
+    dict with ``activities``, ``actor``, ``title``, ``hfeed``, and ``url``
+    (the final URL after redirects) keys
+
+  Raises:
+    :class:`werkzeug.exceptions.BadRequest` if the input can't be parsed
+  """
   final_url = resp.url
 
-  # decode data
-  if input in ('activitystreams', 'as1', 'as2', 'mf2-json', 'json-mf2', 'jsonfeed'):
-    try:
-      body_json = resp.json()
-      body_items = (body_json if isinstance(body_json, list)
-                    else body_json.get('items') or [body_json])
-    except (TypeError, ValueError):
-      raise BadRequest(f'Could not decode {final_url} as JSON')
-
-  mf2 = None
-  if input == 'html':
-    mf2 = util.parse_mf2(resp, id=fragment)
-    if id and not mf2:
-      raise BadRequest(f'Got fragment {fragment} but no element found with that id.')
-  elif input in ('mf2-json', 'json-mf2'):
-    mf2 = body_json
-    if not hasattr(mf2, 'get'):
-      raise BadRequest(
-        f'Expected microformats2 JSON input to be dict, got {mf2.__class__.__name__}')
-    mf2.setdefault('rels', {})  # mf2util expects rels
-
-  actor = None
-  title = None
-  hfeed = None
-  if mf2:
-    logger.info(f'Got mf2: {json_dumps(mf2, indent=2)}')
+  with timed('parse'):
+    # decode data
+    if input in ('activitystreams', 'as1', 'as2', 'mf2-json', 'json-mf2', 'jsonfeed'):
+      try:
+        body_json = resp.json()
+        body_items = (body_json if isinstance(body_json, list)
+                      else body_json.get('items') or [body_json])
+      except (TypeError, ValueError):
+        raise BadRequest(f'Could not decode {final_url} as JSON')
+
+    mf2 = None
+    if input == 'html':
+      mf2 = microformats2.parse_mf2(resp, id=fragment)
+      if id and not mf2:
+        raise BadRequest(f'Got fragment {fragment} but no element found with that id.')
+    elif input in ('mf2-json', 'json-mf2'):
+      mf2 = body_json
+      if not hasattr(mf2, 'get'):
+        raise BadRequest(
+          f'Expected microformats2 JSON input to be dict, got {mf2.__class__.__name__}')
+      mf2.setdefault('rels', {})  # mf2util expects rels
+
+    actor = None
+    title = None
+    hfeed = None
+
     def fetch_mf2_func(url):
       if util.domain_or_parent_in(urllib.parse.urlparse(url).netloc, SILO_DOMAINS):
         return {'items': [{'type': ['h-card'], 'properties': {'url': [url]}}]}
       return util.fetch_mf2(url, gateway=True)
 
-    try:
-      actor = microformats2.find_author(mf2, fetch_mf2_func=fetch_mf2_func)
-      title = microformats2.get_title(mf2)
-      hfeed = mf2util.find_first_entry(mf2, ['h-feed'])
-    except (KeyError, ValueError) as e:
-      raise BadRequest(f'Could not parse {final_url} as {input}: {e}')
+    if mf2:
+      log_payload('Got mf2', mf2)
 
-  try:
-    if input in ('as1', 'activitystreams'):
-      activities = body_items
-    elif input == 'as2':
-      activities = [as2.to_as1(obj) for obj in body_items]
-    elif input == 'atom':
-      try:
-        activities = atom.atom_to_activities(resp.text)
-      except ElementTree.ParseError as e:
-        raise BadRequest(f'Could not parse {final_url} as XML: {e}')
-      except ValueError as e:
-        raise BadRequest(f'Could not parse {final_url} as Atom: {e}')
-    elif input == 'html':
-      activities = microformats2.html_to_activities(resp, url=final_url,
-                                                    id=fragment, actor=actor)
-    elif input in ('mf2-json', 'json-mf2'):
-      activities = [microformats2.json_to_object(item, actor=actor)
-                    for item in mf2.get('items', [])]
-    elif input == 'jsonfeed':
-      activities, actor = jsonfeed.jsonfeed_to_activities(body_json)
-    elif input == 'rss':
+    # html is converted below, in a single pass that also finds these
+    if mf2 and input != 'html':
       try:
-        activities = rss.to_activities(resp.text)
-      except ElementTree.ParseError as e:
-        raise BadRequest(f'Could not parse {final_url} as XML: {e}')
-      except ValueError as e:
-        raise BadRequest(f'Could not parse {final_url} as Atom: {e}')
-  except ValueError as e:
-    logger.warning('parsing input failed', exc_info=True)
-    return abort(400, f'Could not parse {final_url} as {input}: {str(e)}')
+        actor = microformats2.find_author(mf2, fetch_mf2_func=fetch_mf2_func)
+        title = microformats2.get_title(mf2)
+        hfeed = mf2util.find_first_entry(mf2, ['h-feed'])
+      except (KeyError, ValueError) as e:
+        raise BadRequest(f'Could not parse {final_url} as {input}: {e}')
 
-  logger.info(f'Converted to AS1: {json_dumps(activities, indent=2)}')
+  with timed('convert'):
+    try:
+      if input in ('as1', 'activitystreams'):
+        activities = body_items
+      elif input == 'as2':
+        activities = [as2.to_as1(obj) for obj in body_items]
+      elif input == 'atom':
+        try:
+          activities = atom.atom_to_activities(resp.text)
+        except ElementTree.ParseError as e:
+          raise BadRequest(f'Could not parse {final_url} as XML: {e}')
+        except ValueError as e:
+          raise BadRequest(f'Could not parse {final_url} as Atom: {e}')
+      elif input == 'html':
+        try:
+          feed = microformats2.parsed_to_activities(
+            mf2, fetch_mf2_func=fetch_mf2_func)
+        except KeyError as e:
+          raise BadRequest(f'Could not parse {final_url} as {input}: {e}')
+        activities = feed['activities']
+        actor = feed['actor']
+        title = feed['title']
+        hfeed = feed['hfeed']
+      elif input in ('mf2-json', 'json-mf2'):
+        activities = [microformats2.json_to_object(item, actor=actor)
+                      for item in mf2.get('items', [])]
+      elif input == 'jsonfeed':
+        activities, actor = jsonfeed.jsonfeed_to_activities(body_json)
+      elif input == 'rss':
+        try:
+          activities = rss.to_activities(resp.text)
+        except ElementTree.ParseError as e:
+          raise BadRequest(f'Could not parse {final_url} as XML: {e}')
+        except ValueError as e:
+          raise BadRequest(f'Could not parse {final_url} as Atom: {e}')
+    except ValueError as e:
+      logger.warning('parsing input failed', exc_info=True)
+      return abort(400, f'Could not parse {final_url} as {input}: {str(e)}')
+
+  return {
+    'activities': activities,
+    'actor': actor,
+    'title': title,
+    'hfeed': hfeed,
+    'url': final_url,
+  }
+
+
+def fetch_upstream(url, headers):
+  """Fetches a /url input, revalidating a stored copy with a conditional GET.
+
+  Bodies that come back with an ``ETag`` or ``Last-Modified`` header are stored
+  in the cache. Later fetches send ``If-None-Match``/``If-Modified-Since``, and
+  if the server answers 304, the stored body is reused instead.
 
-  return make_response(source.Source.make_activities_base_response(activities),
-                       url=final_url, actor=actor, title=title, hfeed=hfeed)
+  Args:
+    url: str
+    headers: dict, HTTP request headers
+
+  Returns:
+    :class:`requests.Response`
+  """
+  key = f'upstream {headers.get("Accept", "")} {url}'
+  stored = cache.get(key)
+  if stored:
+    headers = copy.copy(headers)
+    if stored['etag']:
+      headers['If-None-Match'] = stored['etag']
+    if stored['last_modified']:
+      headers['If-Modified-Since'] = stored['last_modified']
+
+  resp = source.Source.transport.get(url, headers=headers, gateway=True)
+
+  if resp.status_code == 304 and stored:
+    logger.info(f'{url} not modified, using stored copy')
+    cache.set(key, stored, timeout=UPSTREAM_CACHE_TIME.total_seconds())
+    return to_requests_response(stored['content'], url=stored['url'],
+                                content_type=stored['content_type'],
+                                encoding=stored['encoding'])
+
+  etag = resp.headers.get('ETag')
+  last_modified = resp.headers.get('Last-Modified')
+  if (resp.status_code == 200 and (etag or last_modified) and
+      len(resp.content) <= UPSTREAM_CACHE_MAX_SIZE):
+    cache.set(key, {
+      'etag': etag,
+      'last_modified': last_modified,
+      'url': resp.url,
+      'content_type': resp.headers.get('Content-Type'),
+      'encoding': resp.encoding,
+      'content': resp.content,
+    }, timeout=UPSTREAM_CACHE_TIME.total_seconds())
+
+  return resp
+
+
+def to_requests_response(content, url=None, content_type=None, encoding=None):
+  """Wraps a document in a :class:`requests.Response`, eg for :func:`convert_to_as1`.
+
+  Args:
+    content: bytes
+    url: str, optional
+    content_type: str, optional
+    encoding: str, optional
+
+  Returns:
+    :class:`requests.Response`, HTTP 200
+  """
+  resp = requests.Response()
+  resp.status_code = 200
+  resp.url = url
+  if content_type:
+    resp.headers['Content-Type'] = content_type
+  resp.encoding = encoding
+  resp._content = content
+  return resp
 
 
 @app.route('/<any(scraped,html):_>', methods=('POST',))
@@ -336,23 +895,73 @@ def scraped(_):
   if not body or type not in expected_types:
     raise BadRequest(f'No {FORMATS["json"]} or {FORMATS["html"]} body found in request or MIME multipart file')
 
-  logger.info(f'Got input: {util.ellipsize(body, words=999, chars=999)}')
+  log_payload('Got input', body)
 
   if type == FORMATS['json']:
     activities, actor = Instagram().scraped_json_to_activities(
       json_loads(body), fetch_extras=False)
   else:
     activities, actor = Instagram().scraped_to_activities(body, fetch_extras=False)
-  logger.info(f'Converted to AS1: {json_dumps(activities, indent=2)}')
+  log_payload('Converted to AS1', activities)
 
   title = 'Instagram feed'
   if actor:
     title += f' for {actor.get("username") or actor.get("displayName")}'
   return make_response(source.Source.make_activities_base_response(activities),
-                       actor=actor, title=title)
+                       actor=actor, title=title, stream=True)
+
+
+@app.route('/convert', methods=('POST',))
+def convert():
+  """Converts a document in the request body, without fetching anything.
+
+  Like /url, but the input document comes in the request instead of being
+  fetched. Requires ``input`` (any of :const:`INPUTS`) and ``output`` (any of
+  :const:`FORMATS`) params. The document may be either the raw request body or
+  a MIME multipart encoded file. The optional ``url`` param is the document's
+  URL, used as the base for relative URLs and in feed output. With
+  ``input=html``, its fragment selects an element to convert, like /url.
+  """
+  input = request.values['input']
+  if input not in INPUTS:
+    raise BadRequest(f'Invalid input: {input}, expected one of {INPUTS!r}')
+
+  doc_url = request.values.get('url')
+  fragment = None
+  if doc_url and input == 'html':
+    fragment = urllib.parse.urlparse(doc_url).fragment
+
+  # MIME multipart
+  content = content_type = charset = None
+  for name, file in request.files.items():
+    logger.debug(f'Using MIME multipart file {name} {file.filename} {file.mimetype}')
+    content = file.read()
+    content_type = file.mimetype
+    charset = file.mimetype_params.get('charset')
+    break
+  else:
+    # raw request body
+    content = request.get_data()
+    content_type = request.mimetype
+    charset = request.mimetype_params.get('charset')
 
+  if not content:
+    raise BadRequest('No document found in request body or MIME multipart file')
 
-def make_response(response, actor=None, url=None, title=None, hfeed=None):
+  resp = to_requests_response(content, url=doc_url, content_type=content_type,
+                              encoding=charset or 'utf-8')
+  converted = convert_to_as1(resp, input, fragment)
+  log_payload('Converted to AS1', converted['activities'])
+
+  return make_response(
+    source.Source.make_activities_base_response(converted['activities']),
+    url=converted['url'], actor=converted['actor'], title=converted['title'],
+    hfeed=converted['hfeed'], stream=True)
+
+
+@timed('render')
+def make_response(response, actor=None, url=None, title=None, hfeed=None,
+                  request_url=None, stream=False):
   """Converts ActivityStreams activities and returns a Flask response.
 
   Args:
@@ -363,7 +972,16 @@ def make_response(response, actor=None, url=None, title=None, hfeed=None):
     url: the input URL
     title: string, used in feed output (Atom, JSON Feed, RSS)
     hfeed: dict, parsed mf2 h-feed, if available
+    request_url: str, URL to use for feeds' self links. Defaults to the
+      current request's URL.
+    stream: bool, whether to render Atom, HTML, and AS1, AS2, and mf2 JSON
+      incrementally and return a streaming :class:`flask.Response`. Only for
+      responses that won't be cached. Rendering errors after the first chunk
+      can't change the HTTP status.
   """
+  if not request_url:
+    request_url = request.url
+
   format = request.values.get('format') or request.values.get('output') or 'json'
   if format not in FORMATS:
     raise BadRequest(f'Invalid format: {format}, expected one of {FORMATS!r}')
@@ -383,9 +1001,24 @@ def make_response(response, actor=None, url=None, title=None, hfeed=None):
   activities = response['items']
   try:
     if format in ('as1', 'json', 'activitystreams'):
+      if stream:
+        return stream_response(iter_json(response, activities), headers)
       return response, headers
 
     elif format == 'as2':
+      if stream:
+        fields = util.trim_nulls({
+          **response,
+          'totalItems': response.get('totalResults'),
+          'updated': response.get('updatedSince'),
+          'totalResults': None,
+          'updatedSince': None,
+          'filtered': None,
+          'sorted': None,
+        })
+        items = (util.trim_nulls(as2.from_as1(a)) for a in activities)
+        return stream_response(iter_json(fields, items), headers)
+
       response.update({
         'items': [as2.from_as1(a) for a in activities],
         'totalItems': response.pop('totalResults', None),
@@ -406,37 +1039,46 @@ def make_response(response, actor=None, url=None, title=None, hfeed=None):
         })
 
       # encode/quote Unicode chars in URLs; only ASCII is safe in HTTP headers
-      link_self = urllib.parse.quote(request.url, safe=':/?&=%')
+      link_self = urllib.parse.quote(request_url, safe=':/?&=%')
       headers['Link'] = [f'<{link_self}>; rel="self"']
       if hub:
         link_hub = urllib.parse.quote(hub, safe=':/?&=')
         headers['Link'].append(f'<{link_hub}>; rel="hub"')
 
-      return atom.activities_to_atom(
+      atom_fn = atom.activities_to_atom_iter if stream else atom.activities_to_atom
+      body = atom_fn(
         activities, actor,
         host_url=url or request.host_url + '/',
-        request_url=request.url,
+        request_url=request_url,
         xml_base=util.base_url(url),
         title=title,
         rels={'hub': hub} if hub else None,
         reader=(reader == 'true'),
-      ), headers
+      )
+      return stream_response(body, headers) if stream else (body, headers)
 
     elif format == 'rss':
+      # not streamed, feedgen only renders whole documents
       if not title:
         title = f'Feed for {url}'
       return rss.from_activities(
         activities, actor, title=title,
-        feed_url=request.url, hfeed=hfeed,
+        feed_url=request_url, hfeed=hfeed,
         home_page_url=util.base_url(url)), headers
 
     elif format in ('as1-xml', 'xml'):
       return XML_TEMPLATE % util.to_xml(response), headers
 
     elif format == 'html':
+      if stream:
+        return stream_response(
+          microformats2.activities_to_html_iter(activities), headers)
       return microformats2.activities_to_html(activities), headers
 
     elif format in ('mf2-json', 'json-mf2'):
+      if stream:
+        items = (microformats2.activity_to_json(a) for a in activities)
+        return stream_response(iter_json({}, items), headers)
       return {
         'items': [microformats2.activity_to_json(a) for a in activities],
       }, headers
@@ -444,7 +1086,7 @@ def make_response(response, actor=None, url=None, title=None, hfeed=None):
     elif format == 'jsonfeed':
       try:
         return jsonfeed.activities_to_jsonfeed(
-          activities, actor=actor, title=title, feed_url=request.url,
+          activities, actor=actor, title=title, feed_url=request_url,
         ), headers
       except TypeError as e:
         raise BadRequest(f'Unsupported input data: {e}')
@@ -454,6 +1096,40 @@ def make_response(response, actor=None, url=None, title=None, hfeed=None):
     return abort(400, f'Could not convert to {format}: {str(e)}')
 
 
+def iter_json(fields, items):
+  """Yields a JSON object with an ``items`` list in chunks, one per item.
+
+  Args:
+    fields: dict, JSON object. Its ``items`` value, if any, is ignored.
+    items: iterable of JSON-compatible values, consumed lazily
+
+  Returns:
+    generator of str
+  """
+  yield '{'
+  for name, val in fields.items():
+    if name != 'items':
+      yield f'{json_dumps(name)}: {json_dumps(val)}, '
+
+  yield '"items": ['
+  for i, item in enumerate(items):
+    yield (',\n' if i else '\n') + json_dumps(item)
+  yield '\n]}\n'
+
+
+def stream_response(chunks, headers):
+  """Returns a streaming :class:`flask.Response` that sends chunks as they come.
+
+  chunks is consumed after the request context is gone, so it can't use
+  :data:`flask.request`.
+
+  Args:
+    chunks: iterable of str
+    headers: dict, HTTP response headers
+  """
+  return Response(chunks, headers=headers)
+
+
 def handle_discovery_errors(fn):
   """A wrapper that handles URL discovery errors.
 
@@ -0,0 +1,64 @@
+"""Flask-Caching backend that stores compressed entries in Redis.
+
+Lets every gunicorn process and App Engine instance share one response cache
+instead of each having its own cold :class:`SimpleCache`. Enable it by putting
+a Redis URL, eg ``redis://10.0.0.3:6379``, in a ``redis_url`` file; see
+``config.py``.
+"""
+import logging
+import pickle
+import zlib
+
+from cachelib.serializers import RedisSerializer
+from flask_caching.backends.rediscache import RedisCache
+
+logger = logging.getLogger(__name__)
+
+# entries smaller than this are stored uncompressed
+COMPRESS_MIN_SIZE = 512  # bytes
+COMPRESS_LEVEL = 6
+
+# value prefixes. RedisSerializer uses ! for pickles and no prefix for ints.
+PICKLE_PREFIX = b'!'
+COMPRESSED_PREFIX = b'z'
+
+
+class CompressedSerializer(RedisSerializer):
+  """Redis serializer that zlib-compresses pickled values.
+
+  Values that don't shrink, or are smaller than :const:`COMPRESS_MIN_SIZE`,
+  are stored uncompressed in :class:`RedisSerializer`'s format, so existing
+  entries stay readable. Ints are stored as plain ASCII digits so that
+  :meth:`RedisCache.inc` and :meth:`RedisCache.dec`, ie INCRBY and DECRBY,
+  work on them.
+  """
+  def dumps(self, value, protocol=pickle.HIGHEST_PROTOCOL):
+    if type(value) is int:
+      return str(value).encode('ascii')
+
+    pickled = pickle.dumps(value, protocol)
+    if len(pickled) >= COMPRESS_MIN_SIZE:
+      compressed = zlib.compress(pickled, COMPRESS_LEVEL)
+      if len(compressed) < len(pickled):
+        return COMPRESSED_PREFIX + compressed
+
+    return super().dumps(value, protocol)
+
+  def loads(self, value):
+    if value is not None and value.startswith(COMPRESSED_PREFIX):
+      try:
+        return pickle.loads(zlib.decompress(value[len(COMPRESSED_PREFIX):]))
+      except (zlib.error, pickle.PickleError) as e:
+        logger.warning(f"Couldn't load compressed cache entry: {e}")
+        return None
+
+    return super().loads(value)
+
+
+class CompressedRedisCache(RedisCache):
+  """:class:`RedisCache` that stores entries with :class:`CompressedSerializer`.
+
+  Configured the same way, eg with ``CACHE_REDIS_URL``. The ``host`` constructor
+  arg may also be any object with the same API as :class:`redis.Redis`.
+  """
+  serializer = CompressedSerializer()
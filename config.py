@@ -10,5 +10,11 @@ if appengine_info.DEBUG:
   SECRET_KEY = 'sooper seekret'
 else:
   ENV = 'production'
-  CACHE_TYPE = 'SimpleCache'
   SECRET_KEY = util.read('flask_secret_key')
+  # share one compressed cache across instances if we have a Redis to use
+  CACHE_REDIS_URL = util.read('redis_url')
+  if CACHE_REDIS_URL:
+    CACHE_TYPE = 'compressed_cache.CompressedRedisCache'
+    CACHE_KEY_PREFIX = 'granary '
+  else:
+    CACHE_TYPE = 'SimpleCache'
@@ -5,7 +5,6 @@ AS2: http://www.w3.org/TR/activitystreams-core/
 AS1: http://activitystrea.ms/specs/json/1.0/
      http://activitystrea.ms/specs/json/schema/activity-schema.html
 """
-import copy
 import datetime
 import logging
 
@@ -70,6 +69,46 @@ VERB_TO_TYPE = {
 TYPE_TO_VERB = _invert(VERB_TO_TYPE)
 TYPE_TO_VERB['Like'] = 'like'  # disambiguate
 
+# same as in :func:`util.trim_nulls`
+NULLS = (None, {}, [], (), '', set(), frozenset())
+
+# to_as1 output fields that are always populated by recursive to_as1 calls
+TO_AS1_CONVERTED = frozenset((
+  'actor',
+  'attachments',
+  'image',
+  'inReplyTo',
+  'location',
+  'object',
+  'tags',
+))
+
+
+def _trim_nulls(obj, converted):
+  """Removes None and empty values from a shallow-copied dict.
+
+  Like :func:`util.trim_nulls`, but doesn't re-walk the values in converted
+  fields. Those came from recursive :func:`from_as1` or :func:`to_as1` calls,
+  so they're new and already trimmed; lists only need their empty elements
+  dropped. Other fields are trimmed recursively, which also copies them, so the
+  result never shares containers with the input.
+
+  Args:
+    obj: dict
+    converted: set of string field names
+
+  Returns: dict
+  """
+  trimmed = {}
+  for key, val in obj.items():
+    if key not in converted:
+      val = util.trim_nulls(val)
+    elif isinstance(val, list):
+      val = [elem for elem in val if elem]
+    if val not in NULLS:
+      trimmed[key] = val
+  return trimmed
+
 
 def from_as1(obj, type=None, context=CONTEXT, top_level=True):
   """Converts an ActivityStreams 1 activity or object to ActivityStreams 2.
@@ -86,7 +125,8 @@ def from_as1(obj, type=None, context=CONTEXT, top_level=True):
   elif not isinstance(obj, dict):
     raise ValueError(f'Expected dict, got {obj!r}')
 
-  obj = copy.deepcopy(obj)
+  obj = dict(obj)
+  converted = {'actor', 'attachment', 'attributedTo', 'inReplyTo', 'object', 'tag'}
 
   verb = obj.pop('verb', None)
   obj_type = obj.pop('objectType', None)
@@ -138,8 +178,10 @@ def from_as1(obj, type=None, context=CONTEXT, top_level=True):
     if obj_type == 'person':
       obj['icon'] = from_as1((non_featured or featured)[0], type='Image',
                              context=None, top_level=False)
+      converted.add('icon')
     obj['image'] = [from_as1(img, type='Image', context=None)
                     for img in featured + non_featured]
+    converted.add('image')
     if len(obj['image']) == 1:
       obj['image'] = obj['image'][0]
 
@@ -181,8 +223,9 @@ def from_as1(obj, type=None, context=CONTEXT, top_level=True):
   loc = obj.get('location')
   if loc:
     obj['location'] = from_as1(loc, type='Place', context=None)
+    converted.add('location')
 
-  obj = util.trim_nulls(obj)
+  obj = _trim_nulls(obj, converted)
   if list(obj.keys()) == ['url']:
     return obj['url']
 
@@ -205,7 +248,7 @@ def to_as1(obj, use_type=True):
   elif not isinstance(obj, dict):
     raise ValueError(f'Expected dict, got {obj!r}')
 
-  obj = copy.deepcopy(obj)
+  obj = dict(obj)
   obj.pop('@context', None)
 
   type = obj.pop('type', None)
@@ -219,9 +262,6 @@ def to_as1(obj, use_type=True):
     elif obj['verb'] and not obj['objectType']:
       obj['objectType'] = 'activity'
 
-  def url_or_as1(val):
-    return {'url': val} if isinstance(val, str) else to_as1(val)
-
   def all_to_as1(field):
     return [to_as1(elem) for elem in util.pop_list(obj, field)
             if not (type == 'Person' and elem.get('type') == 'PropertyValue')]
@@ -237,7 +277,7 @@ def to_as1(obj, use_type=True):
   inner_objs = all_to_as1('object')
   actor = to_as1(obj.get('actor', {}))
 
-  if type == 'Create':
+  if type == 'Create' and actor:
     for inner_obj in inner_objs:
       inner_obj.setdefault('author', {}).update(actor)
 
@@ -256,8 +296,8 @@ def to_as1(obj, use_type=True):
     'actor': actor,
     'attachments': attachments,
     'image': images,
-    'inReplyTo': [url_or_as1(orig) for orig in util.get_list(obj, 'inReplyTo')],
-    'location': url_or_as1(obj.get('location')),
+    'inReplyTo': [to_as1(orig) for orig in util.get_list(obj, 'inReplyTo')],
+    'location': to_as1(obj.get('location')),
     'object': inner_objs,
     'tags': all_to_as1('tag'),
   })
@@ -281,9 +321,9 @@ def to_as1(obj, use_type=True):
   if attrib:
     if len(attrib) > 1:
       logger.warning(f'ActivityStreams 1 only supports single author; dropping extra attributedTo values: {attrib[1:]}')
-    obj.setdefault('author', {}).update(to_as1(attrib[0]))
+    obj['author'] = {**(obj.get('author') or {}), **to_as1(attrib[0])}
 
-  return util.trim_nulls(obj)
+  return _trim_nulls(obj, TO_AS1_CONVERTED)
 
 
 def is_public(activity):
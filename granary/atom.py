@@ -132,6 +132,22 @@ def activities_to_atom(activities, actor, title=None, request_url=None,
   Returns:
     unicode string with Atom XML
   """
+  return ''.join(activities_to_atom_iter(
+    activities, actor, title=title, request_url=request_url, host_url=host_url,
+    xml_base=xml_base, rels=rels, reader=reader))
+
+
+def activities_to_atom_iter(activities, actor, title=None, request_url=None,
+                            host_url=None, xml_base=None, rels=None, reader=True):
+  """Converts ActivityStreams 1 activities to an Atom feed, incrementally.
+
+  Same args as :func:`activities_to_atom`, but returns a generator that yields
+  the Atom XML in chunks. Each activity is prepared and rendered only when the
+  feed gets to its entry, so callers can stream the output.
+
+  Returns:
+    generator of unicode strings
+  """
   # Strip query params from URLs so that we don't include access tokens, etc
   host_url = (_remove_query_params(host_url) if host_url
               else 'https://github.com/snarfed/granary')
@@ -139,8 +155,6 @@ def activities_to_atom(activities, actor, title=None, request_url=None,
     request_url = host_url
 
   _prepare_actor(actor)
-  for a in activities:
-    _prepare_activity(a, reader=reader)
 
   updated = (util.get_first(activities[0], 'object', default={}).get('published', '')
              if activities else '')
@@ -148,10 +162,15 @@ def activities_to_atom(activities, actor, title=None, request_url=None,
   if actor is None:
     actor = {}
 
-  return jinja_env.get_template(FEED_TEMPLATE).render(
+  def items():
+    for a in activities:
+      _prepare_activity(a, reader=reader)
+      yield Defaulter(a)
+
+  return jinja_env.get_template(FEED_TEMPLATE).generate(
     actor=Defaulter(actor),
     host_url=host_url,
-    items=[Defaulter(a) for a in activities],
+    items=items(),
     mimetypes=mimetypes,
     rels=rels or {},
     request_url=request_url,
@@ -310,7 +329,8 @@ def _author_to_actor(elem):
       }
 
 
-def html_to_atom(html, url=None, fetch_author=False, reader=True):
+def html_to_atom(html, url=None, fetch_author=False, reader=True,
+                 backend=None):
   """Converts microformats2 HTML to an Atom feed.
 
   Args:
@@ -319,6 +339,7 @@ def html_to_atom(html, url=None, fetch_author=False, reader=True):
     fetch_author: boolean, whether to make HTTP request to fetch rel-author link
     reader: boolean, whether the output will be rendered in a feed reader.
       Currently just includes location if True, not otherwise.
+    backend: string, mf2 parser to use, see :func:`microformats2.parse_mf2`
 
   Returns:
     unicode string with Atom XML
@@ -326,13 +347,13 @@ def html_to_atom(html, url=None, fetch_author=False, reader=True):
   if fetch_author:
     assert url, 'fetch_author=True requires url!'
 
-  parsed = util.parse_mf2(html, url=url)
-  actor = microformats2.find_author(parsed, fetch_mf2_func=util.fetch_mf2)
+  parsed = microformats2.parse_mf2(html, url=url, backend=backend)
+  feed = microformats2.parsed_to_activities(parsed, fetch_mf2_func=util.fetch_mf2)
 
   return activities_to_atom(
-    microformats2.html_to_activities(html, url, actor),
-    actor,
-    title=microformats2.get_title(parsed),
+    feed['activities'],
+    feed['actor'],
+    title=feed['title'],
     xml_base=util.base_url(url),
     host_url=url,
     reader=reader)
@@ -9,9 +9,11 @@ from datetime import datetime
 import html
 import logging
 import re
+import threading
 import urllib.error, urllib.parse, urllib.request
 
 from bs4.element import NavigableString, Tag
+from cachetools import TTLCache
 import dateutil.parser
 import mf2util
 import oauth_dropins.facebook
@@ -87,11 +89,21 @@ API_NOTIFICATION = '%s/notifications'
 API_UPLOAD_VIDEO = 'https://graph-video.facebook.com/v4.0/me/videos'
 
 MAX_IDS = 50  # for the ids query param
+# https://developers.facebook.com/docs/graph-api/batch-requests#limits
+MAX_BATCH_REQUESTS = 50
 
 M_HTML_BASE_URL = 'https://mbasic.facebook.com/'
 M_HTML_TIMELINE_URL = '%s?v=timeline'
 M_HTML_REACTIONS_URL = 'ufi/reaction/profile/browser/?ft_ent_identifier=%s'
 
+# Caches scraped and parsed mbasic post permalinks and reactions pages. Keys are
+# (c_user cookie, kind, fbid, fingerprint) tuples, where fingerprint captures
+# the post's content and comment and reaction counts from the timeline, so
+# changed posts are scraped again.
+SCRAPE_CACHE_TIME = 30 * 60  # 30 minute expiration, in seconds
+scrape_cache = TTLCache(1000, SCRAPE_CACHE_TIME)
+scrape_cache_lock = threading.RLock()
+
 # Use a modern browser user agent so that we get modern HTML tags like article
 # and footer, which we then use to scrape.
 SCRAPE_USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:88.0) Gecko/20100101 Firefox/88.0'
@@ -262,6 +274,9 @@ class Facebook(source.Source):
     searching for them.
     https://github.com/snarfed/bridgy/issues/523#issuecomment-155523875
 
+    For @self, the posts, photos, albums, news, and events are all fetched in a
+    single batch request. See :meth:`_get_self_batch()` for details.
+
     Additional args:
       fetch_news: boolean, whether to also fetch and include Open Graph news
         stories (/USER/news.publishes). Requires the user_actions.news
@@ -301,27 +316,25 @@ class Facebook(source.Source):
       if count:
         url = util.add_query_params(url, {'limit': count})
       headers = {'If-None-Match': etag} if etag else {}
-      try:
-        resp = self.urlopen(url, headers=headers, _as=None)
-        etag = resp.info().get('ETag')
-        posts = self._as(list, source.load_json(resp.read(), url))
-      except urllib.error.HTTPError as e:
-        if e.code == 304:  # Not Modified, from a matching ETag
-          posts = []
-        else:
-          raise
 
       if group_id == source.SELF:
-        # TODO: save and use ETag for all of these extra calls
-        # TODO: use batch API to get photos, events, etc in one request
-        # https://developers.facebook.com/docs/graph-api/making-multiple-requests
-        # https://github.com/snarfed/bridgy/issues/44
-        if fetch_news:
-          posts.extend(self.urlopen(API_NEWS_PUBLISHES % user_id, _as=list))
-        posts = self._merge_photos(posts, user_id)
+        posts, etag, events = self._get_self_batch(
+          url, user_id, headers=headers, fetch_news=fetch_news,
+          fetch_events=fetch_events)
         if fetch_events:
-          activities.extend(self._get_events(owner_id=event_owner_id))
+          activities.extend(self._get_events(owner_id=event_owner_id,
+                                             events=events))
       else:
+        try:
+          resp = self.urlopen(url, headers=headers, _as=None)
+          etag = resp.info().get('ETag')
+          posts = self._as(list, source.load_json(resp.read(), url))
+        except urllib.error.HTTPError as e:
+          if e.code == 304:  # Not Modified, from a matching ETag
+            posts = []
+          else:
+            raise
+
         # for group feeds, filter out some shared_story posts because they tend
         # to be very tangential - friends' likes, related posts, etc.
         #
@@ -349,21 +362,28 @@ class Facebook(source.Source):
     # don't fetch extras for Facebook notes. if you pass /comments a note id, it
     # 400s with "notes API is deprecated for versions ..."
     # https://github.com/snarfed/bridgy/issues/480
+    id_requests = {}
     if fetch_shares and fetch_shares_ids:
+      id_requests[API_SHARES] = fetch_shares_ids
+    if fetch_replies and fetch_comments_ids:
+      id_requests[API_COMMENTS_ALL] = fetch_comments_ids
+    id_resps = self._split_id_requests(id_requests)
+
+    if API_SHARES in id_resps:
       # some sharedposts requests 400, not sure why.
       # https://github.com/snarfed/bridgy/issues/348
       with util.ignore_http_4xx_error():
-        for id, shares in self._split_id_requests(API_SHARES, fetch_shares_ids).items():
+        for id, shares in self._merge_id_responses(id_resps[API_SHARES]).items():
           activity = id_to_activity.get(id)
           if activity:
             activity['object'].setdefault('tags', []).extend(
               [self.share_to_object(share) for share in shares])
 
-    if fetch_replies and fetch_comments_ids:
+    if API_COMMENTS_ALL in id_resps:
       # some comments requests 400, not sure why.
       with util.ignore_http_4xx_error():
-        for id, comments in self._split_id_requests(API_COMMENTS_ALL,
-                                                    fetch_comments_ids).items():
+        for id, comments in self._merge_id_responses(
+            id_resps[API_COMMENTS_ALL]).items():
           activity = id_to_activity.get(id)
           if activity:
             replies = activity['object'].setdefault('replies', {}
@@ -377,8 +397,73 @@ class Facebook(source.Source):
     response['etag'] = etag
     return response
 
-  def _merge_photos(self, posts, user_id):
-    """Fetches and merges photo objects into posts, replacing matching posts.
+  def _get_self_batch(self, url, user_id, headers=None, fetch_news=False,
+                      fetch_events=False):
+    """Fetches a user's posts, photos, albums, etc in a single batch request.
+
+    https://developers.facebook.com/docs/graph-api/making-multiple-requests
+    https://github.com/snarfed/bridgy/issues/44
+
+    The posts request uses headers, e.g. If-None-Match, as is. If it returns
+    304 Not Modified, the posts list is empty. The other requests are always
+    fetched in full.
+
+    Args:
+      url: string, relative API URL for the user's posts
+      user_id: string Facebook user id
+      headers: dict, optional HTTP headers for the posts request
+      fetch_news: boolean, whether to also fetch Open Graph news stories
+      fetch_events: boolean, whether to also fetch the current user's events
+
+    Returns:
+      tuple, (list of Facebook post and photo object dicts, string posts ETag
+      or None, list of Facebook event object dicts)
+
+    Raises:
+      :class:`urllib.error.HTTPError`: if the batch request or any of its
+      individual requests fail, except the posts request with 304
+    """
+    requests = {'posts': {'relative_url': url}}
+    if headers:
+      requests['posts']['headers'] = headers
+    if fetch_news:
+      requests['news'] = {'relative_url': API_NEWS_PUBLISHES % user_id}
+    requests['photos'] = {'relative_url': API_PHOTOS_UPLOADED % user_id}
+    requests['albums'] = {'relative_url': API_ALBUMS % user_id}
+    if fetch_events:
+      requests['events'] = {'relative_url': API_USER_EVENTS}
+
+    urls = {name: req['relative_url'] for name, req in requests.items()}
+    resps = dict(zip(requests.keys(),
+                     self.urlopen_batch_full(list(requests.values()))))
+
+    results = {}
+    for name, resp in resps.items():
+      url = urls[name]
+      if resp is None:
+        # Facebook returns null for requests that didn't complete before the
+        # batch timed out. retry them individually.
+        logger.info(f'Batch request for {url} timed out, retrying on its own')
+        results[name] = self.urlopen(url, _as=list)
+        continue
+
+      code = int(resp.get('code', 0))
+      if name == 'posts' and code == 304:  # Not Modified, from a matching ETag
+        results[name] = []
+        continue
+      elif code // 100 in (4, 5):
+        raise urllib.error.HTTPError(url, code, resp.get('body'),
+                                     resp.get('headers'), None)
+
+      results[name] = self._as(list, resp.get('body'))
+
+    posts = results['posts'] + results.get('news', [])
+    posts = self._merge_photos(posts, results['photos'], results['albums'])
+    etag = (resps['posts'] or {}).get('headers', {}).get('ETag')
+    return posts, etag, results.get('events', [])
+
+  def _merge_photos(self, posts, photos, albums):
+    """Merges photo objects into posts, replacing matching posts.
 
     Have to fetch uploaded photos manually since facebook sometimes collapses
     multiple photos into consolidated posts. Also, photo objects don't have the
@@ -394,13 +479,12 @@ class Facebook(source.Source):
 
     Args:
       posts: list of Facebook post object dicts
-      user_id: string Facebook user id
+      photos: list of Facebook photo object dicts, the user's uploaded photos
+      albums: list of Facebook album object dicts, the user's albums
 
     Returns:
       new list of post and photo object dicts
     """
-    assert user_id
-
     posts_by_obj_id = {}
     for post in posts:
       obj_id = post.get('object_id')
@@ -410,9 +494,8 @@ class Facebook(source.Source):
           logger.warning(f"merging posts for object_id {obj_id}: overwriting {existing.get('id')} with {post.get('id')}!")
         posts_by_obj_id[obj_id] = post
 
-    albums = None  # lazy loaded, maps facebook id to ActivityStreams object
+    albums = {a.get('id'): a for a in albums}
 
-    photos = self.urlopen(API_PHOTOS_UPLOADED % user_id, _as=list)
     for photo in photos:
       album_id = photo.get('album', {}).get('id')
       post = posts_by_obj_id.pop(photo.get('id'), {})
@@ -423,8 +506,6 @@ class Facebook(source.Source):
       if privacy and privacy.get('value') != 'CUSTOM':
         photo['privacy'] = privacy
       elif album_id:
-        if albums is None:
-          albums = {a['id']: a for a in self.urlopen(API_ALBUMS % user_id, _as=list)}
         photo['privacy'] = albums.get(album_id, {}).get('privacy')
       else:
         photo['privacy'] = 'custom'  # ie unknown
@@ -432,28 +513,90 @@ class Facebook(source.Source):
     return ([p for p in posts if not p.get('object_id')] +
             list(posts_by_obj_id.values()) + photos)
 
-  def _split_id_requests(self, api_call, ids):
-    """Splits an API call into multiple to stay under the MAX_IDS limit per call.
+  def _split_id_requests(self, api_calls):
+    """Splits API calls into multiple to stay under the MAX_IDS limit per call.
 
     https://developers.facebook.com/docs/graph-api/using-graph-api#multiidlookup
 
+    If that results in more than one call overall, sends them all in batch
+    requests of up to MAX_BATCH_REQUESTS calls each, concurrently. Otherwise,
+    the single call isn't sent here; :meth:`_merge_id_responses()` sends it.
+    Either way, 4xx errors are raised by :meth:`_merge_id_responses()`, not
+    here, even if a whole batch request fails.
+
+    Args:
+      api_calls: dict mapping string API call with %s placeholder for ids query
+        param to sequence of string ids
+
+    Returns:
+      dict mapping each API call to a list of (string URL, dict response)
+      tuples, where response is in :meth:`urlopen_batch_full()`'s format, or
+      None if it hasn't been sent yet. Pass these to
+      :meth:`_merge_id_responses()`.
+    """
+    urls = []
+    for api_call, ids in api_calls.items():
+      for i in range(0, len(ids), MAX_IDS):
+        urls.append((api_call, api_call % ','.join(ids[i:i + MAX_IDS])))
+
+    def send_batch(batch):
+      try:
+        return self.urlopen_batch_full([{'relative_url': url} for _, url in batch])
+      except urllib.error.HTTPError as e:
+        if e.code // 100 != 4:
+          raise
+        # give each call the error, so that _merge_id_responses raises it
+        # inside the caller's ignore_http_4xx_error, one edge at a time
+        return [{'code': e.code, 'body': e.reason, 'headers': {}}] * len(batch)
+
+    if len(urls) > 1:
+      batches = [urls[i:i + MAX_BATCH_REQUESTS]
+                 for i in range(0, len(urls), MAX_BATCH_REQUESTS)]
+      resps = sum(source.concurrent_map(send_batch, batches,
+                                        self.MAX_CONCURRENCY), [])
+    else:
+      resps = [None] * len(urls)
+
+    results = {}
+    for (api_call, url), resp in zip(urls, resps):
+      results.setdefault(api_call, []).append((url, resp))
+
+    return results
+
+  def _merge_id_responses(self, responses):
+    """Merges responses from :meth:`_split_id_requests()` for a single API call.
+
+    Sends any requests that haven't been sent yet, or that timed out in their
+    batch request.
+
     Args:
-      api_call: string with %s placeholder for ids query param
-      ids: sequence of string ids
+      responses: list of (string URL, dict response or None) tuples
 
     Returns:
-      merged list of objects from the responses' 'data' fields
+      dict mapping string id to merged list of objects from the responses'
+      'data' fields
+
+    Raises:
+      :class:`urllib.error.HTTPError`: if any of the requests failed
     """
     results = {}
-    for i in range(0, len(ids), MAX_IDS):
-      resp = self.urlopen(api_call % ','.join(ids[i:i + MAX_IDS]))
-      for id, objs in resp.items():
+    for url, resp in responses:
+      if resp is None:
+        body = self.urlopen(url)
+      else:
+        code = int(resp.get('code', 0))
+        if code // 100 in (4, 5):
+          raise urllib.error.HTTPError(url, code, resp.get('body'),
+                                       resp.get('headers'), None)
+        body = self._as(dict, resp.get('body'))
+
+      for id, objs in body.items():
         # objs is usually a dict but sometimes a boolean. (oh FB, never change!)
         results.setdefault(id, []).extend(self._as(dict, objs).get('data', []))
 
     return results
 
-  def _get_events(self, owner_id=None):
+  def _get_events(self, owner_id=None, events=None):
     """Fetches the current user's events.
 
     https://developers.facebook.com/docs/graph-api/reference/user/events/
@@ -463,11 +606,14 @@ class Facebook(source.Source):
 
     Args:
       owner_id: string. if provided, only returns events owned by this user
+      events: list of Facebook event object dicts, optional. If provided,
+        they're converted instead of fetching.
 
     Returns:
       list of ActivityStreams event objects
     """
-    events = self.urlopen(API_USER_EVENTS, _as=list)
+    if events is None:
+      events = self.urlopen(API_USER_EVENTS, _as=list)
     return [self.event_to_activity(event) for event in events
             if not owner_id or owner_id == event.get('owner', {}).get('id')]
 
@@ -875,7 +1021,7 @@ class Facebook(source.Source):
       'access_token': f'{oauth_dropins.facebook.FACEBOOK_APP_ID}|{oauth_dropins.facebook.FACEBOOK_APP_SECRET}',
     }
     url = API_BASE + API_NOTIFICATION % user_id
-    resp = util.urlopen(urllib.request.Request(url, data=urllib.parse.urlencode(params)))
+    resp = self.transport.urlopen(urllib.request.Request(url, data=urllib.parse.urlencode(params)))
     logger.debug(f'Response: {resp.getcode()} {resp.read()}')
 
   def post_url(self, post):
@@ -1779,6 +1925,13 @@ class Facebook(source.Source):
                 fetch_likes=False, **kwargs):
     """Scrapes a user's timeline or a post and converts it to activities.
 
+    Fetches post permalinks and reactions pages concurrently, and caches their
+    parsed results in :data:`scrape_cache`, keyed by fbid and a fingerprint of
+    the post's content and counts, so unchanged posts aren't scraped again.
+    Posts without a comment count always have their permalinks scraped, and
+    posts without a reaction count always have their reactions scraped, since
+    the fingerprint can't tell when those change.
+
     Args:
       user_id: string
       activity_id: string
@@ -1796,40 +1949,92 @@ class Facebook(source.Source):
     def get(url, *params, allow_redirects=False):
       url = urllib.parse.urljoin(M_HTML_BASE_URL, url % params)
       cookie = f'c_user={self.cookie_c_user}; xs={self.cookie_xs}'
-      resp = util.requests_get(url, allow_redirects=allow_redirects, headers={
+      resp = self.transport.get(url, allow_redirects=allow_redirects, headers={
         'Cookie': cookie,
         'User-Agent': SCRAPE_USER_AGENT,
       })
       resp.raise_for_status()
       return resp
 
+    def cached(kind, fbid, fingerprint, fn):
+      key = (self.cookie_c_user, kind, fbid, fingerprint)
+      with scrape_cache_lock:
+        val = scrape_cache.get(key)
+      if val is None:
+        val = fn()
+        with scrape_cache_lock:
+          scrape_cache[key] = val
+      else:
+        logger.debug(f'Using cached {kind} for {fbid}')
+      return copy.deepcopy(val)
+
     if activity_id:
       # permalinks with classic ids now redirect to URLs with pfbid ids
       # https://about.fb.com/news/2022/09/deterring-scraping-by-protecting-facebook-identifiers/
 
       resp = get(activity_id, allow_redirects=True)
       activities = [self.scraped_to_activity(resp.text, **kwargs)[0]]
+      fingerprints = [self._scraped_fingerprint(activities[0])]
     else:
       resp = get(M_HTML_TIMELINE_URL, user_id)
       activities, _ = self.scraped_to_activities(resp.text, **kwargs)
+      fingerprints = [self._scraped_fingerprint(a) for a in activities]
       if fetch_replies:
         # fetch and convert individual post permalinks
-        # TODO: cache?
-        fbids = [a['fb_id'] for a in activities]
-        activities = []
-        for id in fbids:
-          resp = get(id)
-          activities.append(self.scraped_to_activity(resp.text)[0])
+        def fetch_post(activity_and_fingerprint):
+          activity, fingerprint = activity_and_fingerprint
+          fbid = activity['fb_id']
+          scrape = lambda: self.scraped_to_activity(get(fbid).text)[0]
+          _, _, comment_count, _ = fingerprint
+          if comment_count is None:
+            return scrape()
+          return cached('post', fbid, fingerprint, scrape)
+
+        activities = source.concurrent_map(
+          fetch_post, zip(activities, fingerprints), self.MAX_CONCURRENCY)
 
     if fetch_likes:
       # fetch and convert likes
-      # TODO: cache?
-      for activity in activities:
-        resp = get(M_HTML_REACTIONS_URL, activity['fb_id'])
-        self.merge_scraped_reactions(resp.text, activity)
+      def fetch_reactions(activity_and_fingerprint):
+        activity, fingerprint = activity_and_fingerprint
+        fbid = activity['fb_id']
+
+        def scrape():
+          # convert into a throwaway copy; we merge into the real one below
+          empty = {'fb_id': fbid, 'url': activity['url'], 'object': {}}
+          resp = get(M_HTML_REACTIONS_URL, fbid)
+          return self.merge_scraped_reactions(resp.text, empty)
+
+        # permalink pages don't have reaction counts, so single posts never
+        # use the cache
+        _, _, _, reaction_count = fingerprint
+        tags = (scrape() if reaction_count is None
+                else cached('reactions', fbid, fingerprint, scrape))
+        as1.merge_by_id(activity['object'], 'tags', tags)
+
+      source.concurrent_map(fetch_reactions, zip(activities, fingerprints),
+                            self.MAX_CONCURRENCY)
 
     return self.make_activities_base_response(activities)
 
+  @staticmethod
+  def _scraped_fingerprint(activity):
+    """Returns a hashable fingerprint of a scraped post's content and counts.
+
+    The fingerprint is a (content, published, comment count, reaction count)
+    tuple. The counts are None if the page doesn't show them.
+
+    Args:
+      activity: dict, AS activity from :meth:`scraped_to_activities` or
+        :meth:`scraped_to_activity`
+
+    Returns: tuple
+    """
+    obj = (activity or {}).get('object', {})
+    return (obj.get('content'), obj.get('published'),
+            obj.get('replies', {}).get('totalItems'),
+            obj.get('fb_reaction_count'))
+
   def scraped_to_activities(self, scraped, log_html=False, **kwargs):
     """Converts HTML from an mbasic.facebook.com timeline to AS1 activities.
 
@@ -2560,7 +2765,7 @@ class Facebook(source.Source):
       url = API_BASE + url
     if self.access_token:
       url = util.add_query_params(url, [('access_token', self.access_token)])
-    resp = util.urlopen(urllib.request.Request(url, **kwargs))
+    resp = self.transport.urlopen(urllib.request.Request(url, **kwargs))
 
     if _as is None:
       return resp
@@ -2603,7 +2808,8 @@ class Facebook(source.Source):
     """Sends a batch of multiple API calls using Facebook's batch API.
 
     Raises the appropriate :class:`urllib2.HTTPError` if any individual call
-    returns HTTP status code 4xx or 5xx.
+    returns HTTP status code 4xx or 5xx, or 504 if it didn't complete before the
+    batch timed out.
 
     https://developers.facebook.com/docs/graph-api/making-multiple-requests
 
@@ -2618,6 +2824,8 @@ class Facebook(source.Source):
 
     bodies = []
     for url, resp in zip(urls, resps):
+      if resp is None:
+        raise urllib.error.HTTPError(url, 504, 'Batch request timed out', {}, None)
       code = int(resp.get('code', 0))
       body = resp.get('body')
       if code // 100 in (4, 5):
@@ -2648,7 +2856,8 @@ class Facebook(source.Source):
     Returns:
       sequence of dict responses in Facebook's batch format, except that body is
       JSON-decoded if possible, and headers is a single dict, not a list of
-      dicts, e.g.::
+      dicts. Requests that didn't complete before the batch timed out have
+      None responses. e.g.::
 
           [{'code': 200,
             'headers': {'ETag': 'xyz', ...},
@@ -2664,10 +2873,14 @@ class Facebook(source.Source):
         req['headers'] = [{'name': n, 'value': v}
                           for n, v in sorted(req['headers'].items())]
 
-    data = 'batch=' + json_dumps(util.trim_nulls(requests), sort_keys=True)
+    data = urllib.parse.urlencode({
+      'batch': json_dumps(util.trim_nulls(requests), sort_keys=True),
+    })
     resps = self.urlopen('', data=data, _as=list)
 
     for resp in resps:
+      if resp is None:
+        continue
       if 'headers' in resp:
         resp['headers'] = {h['name']: h['value'] for h in resp['headers']}
 
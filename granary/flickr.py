@@ -3,12 +3,11 @@
 
 Uses Flickr's REST API https://www.flickr.com/services/api/
 
-TODO: Fetching feeds with comments and/or favorites is very request
-intensive right now. It would be ideal to find a way to batch
-requests, make requests asynchronously, or make better calls to the
-API itself. Maybe use flickr.activity.userPhotos
-(https://www.flickr.com/services/api/flickr.activity.userPhotos.html)
-when group_id=SELF.
+Fetching feeds with comments and/or favorites is request intensive, two extra
+calls per photo. Those calls are made concurrently. When group_id=SELF,
+get_activities_response's use_activity_feed kwarg gets recent comments and
+faves for all photos from flickr.activity.userPhotos
+(https://www.flickr.com/services/api/flickr.activity.userPhotos.html) instead.
 """
 import copy
 import logging
@@ -24,6 +23,11 @@ from . import source
 
 logger = logging.getLogger(__name__)
 
+# how far back flickr.activity.userPhotos looks, and how many pages of it (max
+# 50 photos each) to fetch
+ACTIVITY_TIMEFRAME = '30d'
+ACTIVITY_MAX_PAGES = 2
+
 
 class Flickr(source.Source):
   """Flickr source class. See file docstring and Source class for details."""
@@ -181,7 +185,7 @@ class Flickr(source.Source):
         params.append(('tags', ','.join((f'"{t}"' if ' ' in t else t)
                                         for t in hashtags)))
 
-      file = util.urlopen(video_url or image_url)
+      file = self.transport.urlopen(video_url or image_url)
       try:
         resp = self.upload(params, file)
       except requests.exceptions.ConnectionError as e:
@@ -377,13 +381,23 @@ class Flickr(source.Source):
                               etag=None, min_id=None, cache=None,
                               fetch_replies=False, fetch_likes=False,
                               fetch_shares=False, fetch_events=False,
-                              fetch_mentions=False, search_query=None, **kwargs):
+                              fetch_mentions=False, search_query=None,
+                              use_activity_feed=False, **kwargs):
     """Fetches Flickr photos and converts them to ActivityStreams activities.
 
     See method docstring in source.py for details.
 
     Mentions are not fetched or included because they don't exist in Flickr.
     https://github.com/snarfed/bridgy/issues/523#issuecomment-155523875
+
+    Additional args:
+      use_activity_feed: boolean, only used with group_id SELF and the
+        authenticated user's own user_id, ie 'me' or their nsid. If True, gets
+        comments and faves for all photos from flickr.activity.userPhotos in
+        one or two calls instead of two calls per photo. That only includes
+        activity from the last :const:`ACTIVITY_TIMEFRAME`. Photos whose
+        activity it truncates, or that it may have missed because it has more
+        than :const:`ACTIVITY_MAX_PAGES` pages, are fetched individually.
     """
     if user_id is None:
       user_id = 'me'
@@ -412,42 +426,142 @@ class Flickr(source.Source):
 
     photos_resp = self.call_api_method(method, params)
 
-    result = {'items': []}
     if activity_id:
       photos = [photos_resp.get('photo', {})]
     else:
       photos = photos_resp.get('photos', {}).get('photo', [])
 
-    for photo in photos:
-      activity = self.photo_to_activity(photo)
+    activities = [self.photo_to_activity(photo) for photo in photos]
+    to_fetch = list(zip(photos, activities))
+
+    # the activity feed only covers the authenticated user's own photos
+    if ((fetch_replies or fetch_likes) and use_activity_feed and not activity_id
+        and group_id == source.SELF
+        and (user_id == 'me' or user_id == self.user_id())):
+      to_fetch = self._merge_activity_feed(to_fetch, fetch_replies=fetch_replies,
+                                           fetch_likes=fetch_likes)
+
+    if fetch_replies or fetch_likes:
+      def fetch_extras(photo_and_activity):
+        self._fetch_photo_extras(*photo_and_activity, fetch_replies=fetch_replies,
+                                 fetch_likes=fetch_likes)
+
+      source.concurrent_map(fetch_extras, to_fetch, self.MAX_CONCURRENCY)
+
+    return util.trim_nulls({'items': activities})
+
+  def _fetch_photo_extras(self, photo, activity, fetch_replies=False,
+                          fetch_likes=False):
+    """Fetches a photo's comments and/or faves and adds them to its activity.
+
+    Args:
+      photo: dict, Flickr photo
+      activity: dict, ActivityStreams activity for photo, modified in place
+      fetch_replies: boolean
+      fetch_likes: boolean
+    """
+    if fetch_replies:
+      comments_resp = self.call_api_method('flickr.photos.comments.getList', {
+        'photo_id': photo.get('id'),
+      })
+      replies = [
+          self.comment_to_object(comment, photo.get('id'))
+          for comment in comments_resp.get('comments', {}).get('comment', [])
+      ]
+      activity['object']['replies'] = {
+        'items': replies,
+        'totalItems': len(replies),
+      }
+
+    if fetch_likes:
+      faves_resp = self.call_api_method('flickr.photos.getFavorites', {
+        'photo_id': photo.get('id'),
+      })
+      for person in faves_resp.get('photo', {}).get('person', []):
+        activity['object'].setdefault('tags', []).append(
+          self.like_to_object(person, activity))
+
+  def _merge_activity_feed(self, photos_and_activities, fetch_replies=False,
+                           fetch_likes=False):
+    """Adds comments and faves from flickr.activity.userPhotos to activities.
+
+    https://www.flickr.com/services/api/flickr.activity.userPhotos.html
+
+    Args:
+      photos_and_activities: sequence of (Flickr photo dict, ActivityStreams
+        activity dict) tuples. Activities are modified in place.
+      fetch_replies: boolean
+      fetch_likes: boolean
+
+    Returns:
+      list of the (photo, activity) tuples whose comments and faves the feed
+      didn't fully cover, which should be fetched individually
+    """
+    items = []
+    complete = False
+    for page in range(1, ACTIVITY_MAX_PAGES + 1):
+      resp = self.call_api_method('flickr.activity.userPhotos', {
+        'timeframe': ACTIVITY_TIMEFRAME,
+        'per_page': 50,
+        'page': page,
+      }).get('items', {})
+      items.extend(resp.get('item', []))
+      if page >= int(resp.get('pages') or 1):
+        complete = True
+        break
+
+    items_by_id = {item.get('id'): item for item in items if item.get('id')}
+
+    gaps = []
+    for photo, activity in photos_and_activities:
+      photo_id = photo.get('id')
+      item = items_by_id.get(photo_id)
+      if not item:
+        if not complete:
+          gaps.append((photo, activity))
+        continue
+
+      events = item.get('activity', {}).get('event', [])
+      comments = [e for e in events if e.get('type') == 'comment']
+      faves = [e for e in events if e.get('type') == 'fave']
+      total_comments = (int(item.get('commentsold') or 0) +
+                        int(item.get('commentsnew') or 0))
+      total_faves = (int(item.get('favesold') or 0) +
+                     int(item.get('favesnew') or 0))
+      if ((fetch_replies and len(comments) < total_comments) or
+          (fetch_likes and len(faves) < total_faves)):
+        gaps.append((photo, activity))
+        continue
 
-      # TODO consider using 'flickr.activity.userPhotos' when group_id=@self,
-      # gives all recent comments and faves, instead of hitting the API for
-      # each photo
       if fetch_replies:
-        comments_resp = self.call_api_method('flickr.photos.comments.getList', {
-          'photo_id': photo.get('id'),
-        })
-        replies = [
-            self.comment_to_object(comment, photo.get('id'))
-            for comment in comments_resp.get('comments', {}).get('comment', [])
-        ]
+        replies = [self.comment_to_object({
+          'id': e.get('commentid'),
+          'author': e.get('user'),
+          'authorname': e.get('username'),
+          'realname': e.get('realname'),
+          'iconserver': e.get('iconserver'),
+          'iconfarm': e.get('iconfarm'),
+          'datecreate': e.get('dateadded'),
+          'permalink': f"{activity['object']['url']}#comment{e.get('commentid')}",
+          '_content': e.get('_content', ''),
+        }, photo_id) for e in comments]
         activity['object']['replies'] = {
           'items': replies,
           'totalItems': len(replies),
         }
 
       if fetch_likes:
-        faves_resp = self.call_api_method('flickr.photos.getFavorites', {
-          'photo_id': photo.get('id'),
-        })
-        for person in faves_resp.get('photo', {}).get('person', []):
+        for e in faves:
           activity['object'].setdefault('tags', []).append(
-            self.like_to_object(person, activity))
-
-      result['items'].append(activity)
-
-    return util.trim_nulls(result)
+            self.like_to_object({
+              'nsid': e.get('user'),
+              'username': e.get('username'),
+              'realname': e.get('realname'),
+              'iconserver': e.get('iconserver'),
+              'iconfarm': e.get('iconfarm'),
+            }, activity))
+
+    return gaps
 
   def get_actor(self, user_id=None):
     """Get an ActivityStreams object of type 'person' given a Flickr user's nsid.
@@ -110,6 +110,46 @@ query {
   }
 }
 """
+GRAPHQL_AUTHOR_FIELDS = """
+  ... on Bot {""" + GRAPHQL_BOT_FIELDS + """}
+  ... on Organization {""" + GRAPHQL_ORG_FIELDS + """}
+  ... on User {""" + GRAPHQL_USER_FIELDS + """}
+"""
+# one aliased issue or PR in a bulk query. %(i)d and %(fields)s are filled in
+# first, then the rest, e.g. %(owner3)s, by GitHub.graphql().
+GRAPHQL_ISSUE_OR_PR_ALIAS = """
+  subject%(i)d: repository(owner: "%%(owner%(i)d)s", name: "%%(repo%(i)d)s") {
+    issueOrPullRequest(number: %%(number%(i)d)s) {
+      ... on Issue {%(fields)s}
+      ... on PullRequest {%(fields)s merged baseRefName}
+    }
+  }
+"""
+GRAPHQL_ISSUE_OR_PR_FIELDS = """
+  id number url title body createdAt lastEditedAt
+  author {""" + GRAPHQL_AUTHOR_FIELDS + """}
+  labels(first: 100) {
+    nodes {name}
+  }
+"""
+GRAPHQL_ISSUE_OR_PR_COMMENTS = """
+  comments(last: 100) {
+    nodes {
+      id url body createdAt updatedAt lastEditedAt
+      author {""" + GRAPHQL_AUTHOR_FIELDS + """}
+    }
+  }
+"""
+GRAPHQL_ISSUE_OR_PR_REACTIONS = """
+  reactions(last: 100) {
+    nodes {
+      id content createdAt
+      user {""" + GRAPHQL_USER_FIELDS + """}
+    }
+  }
+"""
+# max number of issues/PRs to fetch in a single GraphQL query
+GRAPHQL_ISSUES_OR_PRS_BATCH_SIZE = 20
 GRAPHQL_COMMENT = """
 query {
   node(id:"%(id)s") {
@@ -181,6 +221,7 @@ REACTIONS_REST = {
   u'👀': 'eyes',
 }
 REACTIONS_REST_CHARS = {char: name for name, char, in REACTIONS_REST.items()}
+REACTIONS_GRAPHQL_CHARS = {char: name for name, char, in REACTIONS_GRAPHQL.items()}
 
 
 # preserve some HTML elements instead of converting them. eg <code> so that
@@ -272,17 +313,21 @@ class GitHub(source.Source):
     if len(parts) == 4 and util.is_int(parts[3]):
       return ':'.join((parts[0], parts[1], parts[3]))
 
-  def graphql(self, graphql, kwargs):
+  def graphql(self, graphql, kwargs, partial=False):
     """Makes a v4 GraphQL API call.
 
     Args:
       graphql: string GraphQL operation
+      partial: boolean, whether to return partial data instead of raising if
+        every error's path points into a single top-level field, e.g. when one
+        aliased repo in a bulk query was deleted or is private. Those fields
+        are set to None. Errors with no path still raise.
 
     Returns: dict, parsed JSON response
     """
     escaped = {k: (email.utils.quote(v) if isinstance(v, str) else v)
                for k, v in kwargs.items()}
-    resp = util.requests_post(
+    resp = self.transport.post(
       GRAPHQL_BASE, json={'query': graphql % escaped},
       headers={
         'Authorization': f'bearer {self.access_token}',
@@ -293,10 +338,56 @@ class GitHub(source.Source):
     errs = result.get('errors')
     if errs:
       logger.warning(result)
-      raise ValueError('\n'.join(e.get('message') for e in errs))
+      if not (partial and all(e.get('path') for e in errs)):
+        raise ValueError('\n'.join(e.get('message') for e in errs))
+      data = result.get('data') or {}
+      for e in errs:
+        data[e['path'][0]] = None
+      return data
 
     return result['data']
 
+  def _graphql_issues_or_prs(self, subject_urls, fetch_replies=False,
+                             fetch_likes=False):
+    """Fetches issues and PRs, optionally with comments and reactions, in bulk.
+
+    Uses aliased GraphQL queries, up to
+    :const:`GRAPHQL_ISSUES_OR_PRS_BATCH_SIZE` issues/PRs per query, sent
+    concurrently.
+
+    Args:
+      subject_urls: sequence of string REST API issue or PR URLs, e.g.
+        https://api.github.com/repos/foo/bar/issues/123
+      fetch_replies: boolean, whether to include each one's comments
+      fetch_likes: boolean, whether to include each one's reactions
+
+    Returns:
+      list of GraphQL issue or PR dicts, in the same order as subject_urls, or
+      None for ones that weren't found
+    """
+    fields = GRAPHQL_ISSUE_OR_PR_FIELDS
+    if fetch_replies:
+      fields += GRAPHQL_ISSUE_OR_PR_COMMENTS
+    if fetch_likes:
+      fields += GRAPHQL_ISSUE_OR_PR_REACTIONS
+
+    def fetch(batch):
+      query = ''
+      kwargs = {}
+      for i, url in batch:
+        query += GRAPHQL_ISSUE_OR_PR_ALIAS % {'i': i, 'fields': fields}
+        owner, repo, _, number = url.split('/')[-4:]
+        kwargs.update({f'owner{i}': owner, f'repo{i}': repo,
+                       f'number{i}': int(number)})
+      data = self.graphql('query {' + query + '}', kwargs, partial=True)
+      return [((data or {}).get(f'subject{i}') or {}).get('issueOrPullRequest')
+              for i, _ in batch]
+
+    indexed = list(enumerate(subject_urls))
+    batches = [indexed[i:i + GRAPHQL_ISSUES_OR_PRS_BATCH_SIZE]
+               for i in range(0, len(indexed), GRAPHQL_ISSUES_OR_PRS_BATCH_SIZE)]
+    return sum(source.concurrent_map(fetch, batches, self.MAX_CONCURRENCY), [])
+
   def rest(self, url, data=None, parse_json=True, **kwargs):
     """Makes a v3 REST API call.
 
@@ -314,9 +405,9 @@ class GitHub(source.Source):
     })
 
     if data is None:
-      resp = util.requests_get(url, **kwargs)
+      resp = self.transport.get(url, **kwargs)
     else:
-      resp = util.requests_post(url, json=data, **kwargs)
+      resp = self.transport.post(url, json=data, **kwargs)
     resp.raise_for_status()
 
     return resp.json() if parse_json else resp
@@ -327,7 +418,7 @@ class GitHub(source.Source):
                               fetch_replies=False, fetch_likes=False,
                               fetch_shares=False, fetch_events=False,
                               fetch_mentions=False, search_query=None,
-                              public_only=True, **kwargs):
+                              public_only=True, use_graphql=False, **kwargs):
     """Fetches issues and comments and converts them to ActivityStreams activities.
 
     See :meth:`Source.get_activities_response` for details.
@@ -348,6 +439,12 @@ class GitHub(source.Source):
     timestamp, usually the exact value returned in a Last-Modified header. It
     will also be passed to the comments API endpoint as the since= value
     (converted to ISO 8601).
+
+    Additional args:
+      use_graphql: boolean, whether to fetch the notifications' issues and PRs,
+        along with their comments and reactions, in a few bulk v4 GraphQL
+        queries instead of up to three REST calls per notification. Comments
+        are limited to the last 100 per issue or PR, as are reactions.
     """
     if fetch_shares or fetch_events or fetch_mentions or search_query:
       raise NotImplementedError()
@@ -359,6 +456,7 @@ class GitHub(source.Source):
 
     if activity_id:
       # single issue
+      use_graphql = False
       parts = tuple(activity_id.split(':'))
       if len(parts) != 3:
         raise ValueError('GitHub activity ids must be of the form USER:REPO:ISSUE_OR_PR')
@@ -379,6 +477,7 @@ class GitHub(source.Source):
       etag = resp.headers.get('Last-Modified')
       notifs = [] if resp.status_code == 304 else resp.json()
 
+      subjects = []
       for notif in notifs:
         id = notif.get('id')
         subject_url = notif.get('subject').get('url')
@@ -391,14 +490,30 @@ class GitHub(source.Source):
             'Skipping thread %s with subject %s, only issues and PRs right now',
             id, subject_url)
           continue
-
-        try:
-          issue = self.rest(subject_url)
-        except requests.HTTPError as e:
-          if e.response.status_code in HTTP_NON_FATAL_CODES:
-            util.interpret_http_exception(e)
+        elif use_graphql and not util.is_int(split[-1]):
+          logger.info(f'Skipping thread {id} with subject {subject_url}, no issue or PR number')
+          continue
+        subjects.append((notif, subject_url))
+
+      if use_graphql:
+        fetched = self._graphql_issues_or_prs(
+          [url for _, url in subjects], fetch_replies=fetch_replies,
+          fetch_likes=fetch_likes)
+
+      for i, (notif, subject_url) in enumerate(subjects):
+        if use_graphql:
+          issue = fetched[i]
+          if not issue:
+            logger.info(f'Skipping {subject_url}, not found')
             continue
-          raise
+        else:
+          try:
+            issue = self.rest(subject_url)
+          except requests.HTTPError as e:
+            if e.response.status_code in HTTP_NON_FATAL_CODES:
+              util.interpret_http_exception(e)
+              continue
+            raise
 
         obj = self.issue_to_object(issue)
 
@@ -415,6 +530,26 @@ class GitHub(source.Source):
     # add comments and reactions, if requested
     assert len(issues) == len(activities)
     for issue, obj in zip(issues, activities):
+      if use_graphql:
+        # these came along with the issues and PRs themselves
+        if fetch_replies:
+          comments = issue.get('comments', {}).get('nodes', [])
+          if since:
+            since_str = since.isoformat() + 'Z'
+            comments = [c for c in comments
+                        if (c.get('updatedAt') or '') >= since_str]
+          comment_objs = list(util.trim_nulls(
+            self.comment_to_object(c) for c in comments))
+          obj['replies'] = {
+            'items': comment_objs,
+            'totalItems': len(comment_objs),
+          }
+        if fetch_likes:
+          obj.setdefault('tags', []).extend(
+            self.reaction_to_object(r, obj)
+            for r in issue.get('reactions', {}).get('nodes', []))
+        continue
+
       comments_url = issue.get('comments_url')
       if fetch_replies and comments_url:
         if since:
@@ -776,18 +911,23 @@ class GitHub(source.Source):
     repo_url = re.sub(r'/(issue|pull)s?/[0-9]+$', '', obj['url'])
     if issue.get('merged') is not None:
       type = 'pull-request'
-      in_reply_to = repo_url + '/tree/' + (issue.get('base', {}).get('ref') or 'master')
+      in_reply_to = repo_url + '/tree/' + (
+        issue.get('base', {}).get('ref') or issue.get('baseRefName') or 'master')
     else:
       type = 'issue'
       in_reply_to = repo_url + '/issues'
 
+    labels = issue.get('labels') or []
+    if isinstance(labels, dict):  # GraphQL connection
+      labels = labels.get('nodes') or []
+
     obj.update({
       'objectType': type,
       'inReplyTo': [{'url': in_reply_to}],
       'tags': [{
         'displayName': l['name'],
         'url': f"{repo_url}/labels/{urllib.parse.quote(l['name'])}",
-      } for l in issue.get('labels', []) if l.get('name')],
+      } for l in labels if l.get('name')],
     })
     return self.postprocess_object(obj)
 
@@ -821,12 +961,13 @@ class GitHub(source.Source):
   def reaction_to_object(self, reaction, target):
     """Converts a GitHub emoji reaction to ActivityStreams.
 
-    Handles v3 REST API reaction objects.
+    Handles both v4 GraphQL and v3 REST API reaction objects.
 
+    https://developer.github.com/v4/object/reaction/
     https://developer.github.com/v3/reactions/
 
     Args:
-      reaction: dict, decoded v3 JSON GitHub reaction
+      reaction: dict, decoded JSON GitHub reaction
       target: dict, ActivityStreams object of reaction
 
     Returns:
@@ -836,7 +977,8 @@ class GitHub(source.Source):
     if not obj:
       return obj
 
-    content = REACTIONS_REST_CHARS.get(reaction.get('content'))
+    content = (REACTIONS_REST_CHARS.get(reaction.get('content')) or
+               REACTIONS_GRAPHQL_CHARS.get(reaction.get('content')))
     enum = (REACTIONS_GRAPHQL.get(content) or '').lower()
     author = self.user_to_actor(reaction.get('user'))
     username = author.get('username')
@@ -12,6 +12,7 @@ import logging
 import operator
 import re
 import string
+import threading
 import urllib.parse, urllib.request
 import xml.sax.saxutils
 
@@ -72,6 +73,9 @@ MENTION_RE = re.compile(r'@([A-Za-z0-9._]+)')
 
 # global lock for backing off scraping due to rate limiting.
 RATE_LIMIT_BACKOFF = datetime.timedelta(seconds=5 * 60)
+# HTTP status codes, as returned by util.interpret_http_exception(), that mean
+# we've been rate limited
+RATE_LIMIT_HTTP_CODES = ('302', '401', '429', '503')
 _last_rate_limited = None      # datetime
 _last_rate_limited_exc = None  # requests.HTTPError
 
@@ -89,6 +93,8 @@ class Instagram(source.Source):
   NAME = 'Instagram'
   FRONT_PAGE_TEMPLATE = 'templates/instagram_index.html'
   OPTIMIZED_COMMENTS = False
+  # keep this small to avoid tripping instagram.com's rate limits
+  MAX_CONCURRENCY = 3
 
   EMBED_POST = """
   <script async defer src="//platform.instagram.com/en_US/embeds.js"></script>
@@ -124,7 +130,7 @@ class Instagram(source.Source):
     if self.access_token:
       # TODO add access_token to the data parameter for POST requests
       url = util.add_query_params(url, [('access_token', self.access_token)])
-    resp = util.urlopen(urllib.request.Request(url, **kwargs))
+    resp = self.transport.urlopen(urllib.request.Request(url, **kwargs))
     return (resp if kwargs.get('data')
             else source.load_json(resp.read(), url).get('data'))
 
@@ -230,10 +236,11 @@ class Instagram(source.Source):
       try:
         return self._scrape(
           user_id=user_id, group_id=group_id, activity_id=activity_id, count=count,
-          cookie=cookie, fetch_extras=fetch_replies or fetch_likes, cache=cache)
+          cookie=cookie, fetch_extras=fetch_replies or fetch_likes, cache=cache,
+          ignore_rate_limit=ignore_rate_limit)
       except Exception as e:
         code, body = util.interpret_http_exception(e)
-        if not ignore_rate_limit and code in ('302', '401', '429', '503'):
+        if not ignore_rate_limit and code in RATE_LIMIT_HTTP_CODES:
           logger.info(f'Got rate limited! Remembering for {RATE_LIMIT_BACKOFF}')
           _last_rate_limited = now
           _last_rate_limited_exc = e
@@ -297,9 +304,16 @@ class Instagram(source.Source):
     return self.make_activities_base_response(activities)
 
   def _scrape(self, user_id=None, group_id=None, activity_id=None, cookie=None,
-              count=None, fetch_extras=False, cache=None, shortcode=None):
+              count=None, fetch_extras=False, cache=None, shortcode=None,
+              ignore_rate_limit=False):
     """Scrapes a user's profile or feed and converts the media to activities.
 
+    If fetch_extras is True, refetches posts whose like or comment counts have
+    changed concurrently, up to :attr:`MAX_CONCURRENCY` at a time. If one of
+    those refetches gets rate limited, the rest are skipped, the rate limit is
+    remembered in :data:`_last_rate_limited` unless ignore_rate_limit is True,
+    and the posts refetched so far are returned.
+
     Args:
       user_id: string
       activity_id: string, e.g. '1020355224898358984_654594'
@@ -307,6 +321,7 @@ class Instagram(source.Source):
       fetch_extras: boolean
       cookie: string
       shortcode: string, e.g. '4pB6vEx87I'
+      ignore_rate_limit: boolean
 
     Returns:
       dict activities API response
@@ -327,7 +342,7 @@ class Instagram(source.Source):
         cookie = 'sessionid=' + cookie
       get_kwargs['headers'] = {'Cookie': cookie, **HEADERS}
 
-    resp = util.requests_get(url, **get_kwargs)
+    resp = self.transport.get(url, **get_kwargs)
     location = resp.headers.get('Location', '')
     if ((cookie and 'not-logged-in' in resp.text) or
         (resp.status_code in (301, 302) and
@@ -349,6 +364,7 @@ class Instagram(source.Source):
         # for convenience, throwaway object just for this method
         cache = {}
 
+      to_refetch = []  # (index, cache dict) tuples
       for i, activity in enumerate(activities):
         obj = activity['object']
         _, id = util.parse_tag_uri(activity['id'])
@@ -359,17 +375,43 @@ class Instagram(source.Source):
 
         if (likes and likes != cache.get(likes_key) or
             comments and comments != cache.get(comments_key)):
-          if not activity_id and not shortcode:
-            url = activity['url'].replace(self.BASE_URL, HTML_BASE_URL)
-            resp = util.requests_get(url, **get_kwargs)
-            resp.raise_for_status()
-          # otherwise resp is a fetch of just this activity; reuse it
-
-          full_activity, _ = self.scraped_to_activities(
-            resp.text, cookie=cookie, count=count, fetch_extras=fetch_extras)
-          if full_activity:
-            activities[i] = full_activity[0]
-            cache.update({likes_key: likes, comments_key: comments})
+          to_refetch.append((i, {likes_key: likes, comments_key: comments}))
+
+      rate_limited = threading.Event()
+
+      def refetch(index_and_cache):
+        i, _ = index_and_cache
+        if rate_limited.is_set():
+          return None
+
+        html = resp.text  # a fetch of just this activity; reuse it
+        if not activity_id and not shortcode:
+          url = activities[i]['url'].replace(self.BASE_URL, HTML_BASE_URL)
+          try:
+            page = self.transport.get(url, **get_kwargs)
+            page.raise_for_status()
+          except BaseException as e:
+            code, _ = util.interpret_http_exception(e)
+            if code not in RATE_LIMIT_HTTP_CODES:
+              raise
+            logger.info(f'Got rate limited refetching {url}, skipping the rest')
+            rate_limited.set()
+            if not ignore_rate_limit:
+              global _last_rate_limited, _last_rate_limited_exc
+              _last_rate_limited = datetime.datetime.now()
+              _last_rate_limited_exc = e
+            return None
+          html = page.text
+
+        full_activity, _ = self.scraped_to_activities(
+          html, cookie=cookie, count=count, fetch_extras=fetch_extras)
+        return full_activity
+
+      fetched = source.concurrent_map(refetch, to_refetch, self.MAX_CONCURRENCY)
+      for (i, counts), full_activity in zip(to_refetch, fetched):
+        if full_activity:
+          activities[i] = full_activity[0]
+          cache.update(counts)
 
     resp = self.make_activities_base_response(activities)
     resp['actor'] = actor
@@ -1081,8 +1123,7 @@ class Instagram(source.Source):
 
     return []
 
-  @staticmethod
-  def _scrape_json(url, cookie=None):
+  def _scrape_json(self, url, cookie=None):
     """Fetches and returns JSON from www.instagram.com."""
     if not cookie:
       return {}
@@ -1091,7 +1132,7 @@ class Instagram(source.Source):
       cookie = 'sessionid=' + cookie
     headers = {'Cookie': cookie, **HEADERS}
 
-    resp = util.requests_get(url, allow_redirects=False, headers=headers)
+    resp = self.transport.get(url, allow_redirects=False, headers=headers)
     resp.raise_for_status()
 
     try:
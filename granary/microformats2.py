@@ -3,7 +3,9 @@
 Microformats2 specs: http://microformats.org/wiki/microformats2
 ActivityStreams 1 specs: http://activitystrea.ms/specs/
 """
-from collections import defaultdict
+from collections import defaultdict, deque
+import contextlib
+import contextvars
 import copy
 import html
 import itertools
@@ -11,8 +13,10 @@ import logging
 import urllib.parse
 import string
 import re
+import warnings
 import xml.sax.saxutils
 
+import bs4
 import humanfriendly
 import mf2util
 from oauth_dropins.webutil import util
@@ -30,6 +34,15 @@ from . import source
 
 logger = logging.getLogger(__name__)
 
+# mf2 parsers for HTML input. see parse_mf2().
+MF2_BACKENDS = ('mf2py', 'lxml')
+# default backend. can be overridden per call.
+mf2_backend = 'mf2py'
+
+# the current render_content() cache, if any. maps (id(obj), flags...) tuple to
+# (obj, html) tuple. see render_cache_scope().
+render_cache = contextvars.ContextVar('render_cache', default=None)
+
 HENTRY = string.Template("""\
 <article class="$types">
   <span class="p-uid">$uid</span>
@@ -167,7 +180,8 @@ def object_to_json(obj, trim_nulls=True, entry_class='h-entry',
 
   Args:
     obj: dict, a decoded JSON ActivityStreams object
-    trim_nulls: boolean, whether to remove elements with null or empty values
+    trim_nulls: deprecated and ignored. The output never includes null or
+      empty values. Passing False emits a :class:`DeprecationWarning`.
     entry_class: string or sequence, the mf2 class(es) that entries should be
       given (e.g. 'h-cite' when parsing a reference to a foreign entry).
       defaults to 'h-entry'
@@ -179,9 +193,27 @@ def object_to_json(obj, trim_nulls=True, entry_class='h-entry',
   Returns:
     dict, decoded microformats2 JSON
   """
+  if not trim_nulls:
+    warnings.warn('object_to_json no longer supports trim_nulls=False; its '
+                  'output never includes null or empty values',
+                  DeprecationWarning, stacklevel=2)
+
   if not obj or not isinstance(obj, dict):
     return {}
 
+  with render_cache_scope():
+    return _object_to_json(obj, entry_class=entry_class,
+                           default_object_type=default_object_type,
+                           synthesize_content=synthesize_content)
+
+
+def _object_to_json(obj, entry_class='h-entry', default_object_type=None,
+                    synthesize_content=True):
+  """Converts an ActivityStreams object to microformats2 JSON.
+
+  Implementation of :func:`object_to_json`, which opens a
+  :func:`render_cache_scope` around it.
+  """
   obj_type = as1.object_type(obj) or default_object_type
   # if the activity type is a post, then it's really just a conduit
   # for the object. for other verbs, the activity itself is the
@@ -234,49 +266,48 @@ def object_to_json(obj, trim_nulls=True, entry_class='h-entry',
   size = stream.get('size')
   sizes = [str(size)] if size else []
 
-  # construct mf2!
-  ret = {
-    'type': (AS_TO_MF2_TYPE.get(obj_type) or
-             [entry_class] if isinstance(entry_class, str)
-             else list(entry_class)),
-    'properties': {
-      'uid': [obj.get('id') or ''],
-      'numeric-id': [obj.get('numeric_id') or ''],
-      'name': [name],
-      'nickname': [obj.get('username') or ''],
-      ('note' if obj_type == 'person' else 'summary'): [summary],
-      'url': (list(as1.object_urls(obj) or as1.object_urls(primary)) +
-              obj.get('upstreamDuplicates', [])),
-      # photo is special cased below, to handle alt
-      'video': dedupe_urls(get_urls(attachments, 'video', 'stream') +
-                           get_urls(primary, 'stream')),
-      'audio': get_urls(attachments, 'audio', 'stream'),
-      'duration': [duration],
-      'size': sizes,
-      'published': [obj.get('published', primary.get('published', ''))],
-      'updated': [obj.get('updated', primary.get('updated', ''))],
-      'in-reply-to': util.trim_nulls([o.get('url') for o in in_reply_tos]),
-      'author': [object_to_json(
-        author, trim_nulls=False, default_object_type='person')],
-      'location': [object_to_json(
-        primary.get('location', {}), trim_nulls=False,
-        default_object_type='place')],
-      'comment': [object_to_json(c, trim_nulls=False, entry_class='h-cite')
-                  for c in obj.get('replies', {}).get('items', [])],
-      'start': [primary.get('startTime')],
-      'end': [primary.get('endTime')],
-    },
-    'children': (
-      # silly hack: i haven't found anywhere in AS1 or AS2 to indicate that
-      # something is being "quoted," like in a quote tweet, so i cheat and use
-      # extra knowledge here that quoted tweets are converted to note
-      # attachments, but URLs in the tweet text are converted to article tags.
-      [object_to_json(a, trim_nulls=False, entry_class=['u-quotation-of', 'h-cite'])
-       for a in attachments['note'] if 'startIndex' not in a] +
-      [object_to_json(a, trim_nulls=False, entry_class=['h-cite'])
-       for a in attachments['article'] if 'startIndex' not in a])
+  # construct mf2! nested objects come from recursive calls, so they're already
+  # trimmed; everything else goes through _non_empty(). the overall trim is
+  # shallow, just properties that ended up empty.
+  props = {
+    'uid': _non_empty([obj.get('id')]),
+    'numeric-id': _non_empty([obj.get('numeric_id')]),
+    'name': _non_empty([name]),
+    'nickname': _non_empty([obj.get('username')]),
+    ('note' if obj_type == 'person' else 'summary'): _non_empty([summary]),
+    'url': _non_empty(list(as1.object_urls(obj) or as1.object_urls(primary)) +
+                      obj.get('upstreamDuplicates', [])),
+    # photo is special cased below, to handle alt
+    'video': _non_empty(dedupe_urls(get_urls(attachments, 'video', 'stream') +
+                                    get_urls(primary, 'stream'))),
+    'audio': _non_empty(get_urls(attachments, 'audio', 'stream')),
+    'duration': _non_empty([duration]),
+    'size': sizes,
+    'published': _non_empty([obj.get('published', primary.get('published'))]),
+    'updated': _non_empty([obj.get('updated', primary.get('updated'))]),
+    'in-reply-to': _non_empty([o.get('url') for o in in_reply_tos]),
+    'author': _non_empty([object_to_json(
+      author, default_object_type='person')], trimmed=True),
+    'location': _non_empty([object_to_json(
+      primary.get('location', {}), default_object_type='place')], trimmed=True),
+    'comment': _non_empty([object_to_json(c, entry_class='h-cite')
+                           for c in obj.get('replies', {}).get('items', [])],
+                          trimmed=True),
+    'start': _non_empty([primary.get('startTime')]),
+    'end': _non_empty([primary.get('endTime')]),
   }
 
+  # silly hack: i haven't found anywhere in AS1 or AS2 to indicate that
+  # something is being "quoted," like in a quote tweet, so i cheat and use
+  # extra knowledge here that quoted tweets are converted to note
+  # attachments, but URLs in the tweet text are converted to article tags.
+  children = _non_empty(
+    [object_to_json(a, entry_class=['u-quotation-of', 'h-cite'])
+     for a in attachments['note'] if 'startIndex' not in a] +
+    [object_to_json(a, entry_class=['h-cite'])
+     for a in attachments['article'] if 'startIndex' not in a],
+    trimmed=True)
+
   # content. emulate e- vs p- microformats2 parsing: e- if there are HTML tags,
   # otherwise p-.
   # https://indiewebcamp.com/note#Indieweb_whitespace_thinking
@@ -284,13 +315,13 @@ def object_to_json(obj, trim_nulls=True, entry_class='h-entry',
   rendered = render_content(primary, include_location=False,
                             synthesize_content=synthesize_content)
   if '<' in rendered:
-    ret['properties']['content'] = [{'value': text, 'html': rendered}]
+    props['content'] = _non_empty([{'value': text, 'html': rendered}])
   else:
-    ret['properties']['content'] = [text]
+    props['content'] = _non_empty([text])
 
   # photos, including alt text
   photo_urls = set()
-  ret['properties']['photo'] = []
+  props['photo'] = []
   for img in get_list(attachments, 'image') + get_list(primary, 'image'):
     if img.get('image'):
       img = get_first(img, 'image')
@@ -298,32 +329,33 @@ def object_to_json(obj, trim_nulls=True, entry_class='h-entry',
     if url and url not in photo_urls:
       photo_urls.add(url)
       name = img.get('displayName')
-      ret['properties']['photo'].append({'value': url, 'alt': name} if name else url)
+      props['photo'].append({'value': url, 'alt': name} if name else url)
+  props['photo'] = _non_empty(props['photo'])
 
   # hashtags and person tags
   if obj_type == 'tag':
-    ret['properties']['tag-of'] = util.get_urls(obj, 'target')
+    props['tag-of'] = _non_empty(util.get_urls(obj, 'target'))
 
   tags = obj.get('tags', []) or get_first(obj, 'object', {}).get('tags', [])
   if not tags and obj_type == 'tag':
     tags = util.get_list(obj, 'object')
-  ret['properties']['category'] = []
+  props['category'] = []
   for tag in tags:
     if tag.get('objectType') == 'person':
-      ret['properties']['category'].append(
+      props['category'].append(
         object_to_json(tag, entry_class='u-category h-card'))
     elif tag.get('objectType') == 'hashtag' or obj_type == 'tag':
       name = tag.get('displayName')
       if name:
-        ret['properties']['category'].append(name)
+        props['category'].append(name)
+  props['category'] = _non_empty(props['category'], trimmed=True)
 
   # rsvp
   if is_rsvp:
-    ret['properties']['rsvp'] = [obj_type[len('rsvp-'):]]
+    props['rsvp'] = [obj_type[len('rsvp-'):]]
   elif obj_type == 'invite':
-    invitee = object_to_json(obj.get('object'), trim_nulls=False,
-                             default_object_type='person')
-    ret['properties']['invitee'] = [invitee]
+    invitee = object_to_json(obj.get('object'), default_object_type='person')
+    props['invitee'] = _non_empty([invitee], trimmed=True)
 
   # like and repost mentions
   for type, prop in (
@@ -338,20 +370,21 @@ def object_to_json(obj, trim_nulls=True, entry_class='h-entry',
       # multiple targets, e.g. a like of a post with original post URLs in it,
       # which brid.gy does.
       objs = get_list(obj, 'object')
-      ret['properties'][prop + '-of'] = [
+      props[prop + '-of'] = _non_empty([
         # flatten contexts that are just a url
-        o['url'] if 'url' in o and set(o.keys()) <= set(['url', 'objectType'])
-        else object_to_json(o, trim_nulls=False, entry_class='h-cite')
-        for o in objs]
+        util.trim_nulls(o['url'])
+        if 'url' in o and set(o.keys()) <= set(['url', 'objectType'])
+        else object_to_json(o, entry_class='h-cite')
+        for o in objs], trimmed=True)
     else:
       # received likes and reposts
-      ret['properties'][prop] = [
-        object_to_json(t, trim_nulls=False, entry_class='h-cite')
-        for t in tags if as1.object_type(t) == type]
+      props[prop] = _non_empty([
+        object_to_json(t, entry_class='h-cite')
+        for t in tags if as1.object_type(t) == type], trimmed=True)
 
   # bookmarks
   if obj_type == 'bookmark':
-    ret['properties']['bookmark-of'] = [primary.get('targetUrl')]
+    props['bookmark-of'] = _non_empty([primary.get('targetUrl')])
 
   # latitude & longitude
   lat = long = None
@@ -364,13 +397,34 @@ def object_to_json(obj, trim_nulls=True, entry_class='h-entry',
     long = primary.get('longitude')
 
   if lat:
-    ret['properties']['latitude'] = [str(lat)]
+    props['latitude'] = [str(lat)]
   if long:
-    ret['properties']['longitude'] = [str(long)]
+    props['longitude'] = [str(long)]
 
-  if trim_nulls:
-    ret = util.trim_nulls(ret)
-  return ret
+  ret = {
+    'type': _non_empty(AS_TO_MF2_TYPE.get(obj_type) or [entry_class]
+                       if isinstance(entry_class, str) else list(entry_class)),
+    'properties': {prop: vals for prop, vals in props.items() if vals},
+    'children': children,
+  }
+  return {key: val for key, val in ret.items() if val}
+
+
+def _non_empty(values, trimmed=False):
+  """Removes None and empty values from an mf2 property value list.
+
+  Args:
+    values: sequence
+    trimmed: boolean, whether the values are already trimmed, e.g. because
+      they came from :func:`object_to_json`. If False, each value is passed
+      through :func:`util.trim_nulls` first.
+
+  Returns:
+    list
+  """
+  if not trimmed:
+    values = (util.trim_nulls(val) for val in values)
+  return [val for val in values if val]
 
 
 def json_to_object(mf2, actor=None, fetch_mf2=False):
@@ -589,7 +643,41 @@ def json_to_object(mf2, actor=None, fetch_mf2=False):
   return source.Source.postprocess_object(obj)
 
 
-def html_to_activities(html, url=None, actor=None, id=None):
+def parse_mf2(input, url=None, id=None, backend=None):
+  """Parses microformats2 out of HTML.
+
+  Args:
+    input: unicode or bytes HTML string, :class:`requests.Response`, or
+      :class:`bs4.BeautifulSoup`. BeautifulSoup input is always parsed with
+      mf2py.
+    url: optional unicode string, URL of the input page, used as the base for
+      relative URLs
+    id: string, optional id of specific element to extract and parse. defaults
+      to the whole page.
+    backend: string, one of :const:`MF2_BACKENDS`. ``mf2py`` uses mf2py and
+      BeautifulSoup, ``lxml`` uses :mod:`granary.mf2_lxml`, which is faster and
+      gives the same output. ``lxml`` requires the ``granary[lxml]`` extra.
+      Defaults to the :data:`mf2_backend` global.
+
+  Returns: dict, parsed mf2 data, or None if id is provided and no element
+    has it
+
+  Raises:
+    ValueError, if backend isn't one of :const:`MF2_BACKENDS`
+  """
+  backend = backend or mf2_backend
+  if backend not in MF2_BACKENDS:
+    raise ValueError(f'Unknown mf2 backend {backend}; expected one of {MF2_BACKENDS}')
+
+  if backend == 'lxml' and not isinstance(input, (bs4.BeautifulSoup, bs4.Tag)):
+    # imported here since it needs the optional lxml extra's dependencies
+    from . import mf2_lxml
+    return mf2_lxml.parse(input, url=url, id=id)
+
+  return util.parse_mf2(input, url=url, id=id)
+
+
+def html_to_activities(html, url=None, actor=None, id=None, backend=None):
   """Converts a microformats2 HTML h-feed to ActivityStreams activities.
 
   Args:
@@ -599,12 +687,89 @@ def html_to_activities(html, url=None, actor=None, id=None):
       from a rel="author" link.
     id: string, optional id of specific element to extract and parse. defaults
       to the whole page.
+    backend: string, mf2 parser to use, see :func:`parse_mf2`
 
   Returns:
     list of ActivityStreams activity dicts
   """
-  parsed = util.parse_mf2(html, url=url, id=id)
+  parsed = parse_mf2(html, url=url, id=id, backend=backend)
   hfeed = mf2util.find_first_entry(parsed, ['h-feed'])
+  return _items_to_activities(hfeed, parsed, actor=actor)
+
+
+def parsed_to_activities(parsed, actor=None, fetch_mf2_func=None):
+  """Converts a parsed microformats2 document to ActivityStreams activities.
+
+  Also finds the document's author, title, and h-feed. Unlike calling
+  :func:`html_to_activities`, :func:`find_author`, and :func:`get_title`
+  separately, this reuses the already parsed document and finds the first
+  h-feed and h-entry in a single walk over its items.
+
+  Args:
+    parsed: dict, parsed mf2 document (ie return value from mf2py.parse())
+    actor: optional author AS actor object for all activities. If not
+      provided, runs the authorship algorithm on the first h-entry.
+    fetch_mf2_func: optional function that takes a URL and returns parsed
+      mf2, passed through to :func:`find_author`
+
+  Returns:
+    dict with ``activities`` (list of AS activity dicts), ``actor`` (AS actor
+    dict or None), ``title`` (string), and ``hfeed`` (mf2 item dict or None)
+    keys
+  """
+  first = _find_first_entries(parsed, ('h-feed', 'h-entry'))
+  hfeed = first.get('h-feed')
+
+  if actor is None:
+    hentry = first.get('h-entry')
+    if hentry:
+      actor = find_author(parsed, hentry=hentry, fetch_mf2_func=fetch_mf2_func)
+
+  return {
+    'activities': _items_to_activities(hfeed, parsed, actor=actor),
+    'actor': actor,
+    'title': _hfeed_title(hfeed),
+    'hfeed': hfeed,
+  }
+
+
+def _find_first_entries(parsed, types):
+  """Finds the first item of each type in a parsed mf2 document.
+
+  Same breadth-first order as :func:`mf2util.find_first_entry`, but finds all
+  of the types in one walk.
+
+  Args:
+    parsed: dict, parsed mf2 document
+    types: sequence of string mf2 types, eg ``('h-feed', 'h-entry')``
+
+  Returns:
+    dict mapping string type to the first mf2 item with that type. Types
+    that aren't found are omitted.
+  """
+  found = {}
+  queue = deque(parsed.get('items', []))
+  while queue and len(found) < len(types):
+    item = queue.popleft()
+    for type in item.get('type', []):
+      if type in types:
+        found.setdefault(type, item)
+    queue.extend(item.get('children', []))
+
+  return found
+
+
+def _items_to_activities(hfeed, parsed, actor=None):
+  """Converts an h-feed's children, or else a document's items, to activities.
+
+  Args:
+    hfeed: dict, mf2 h-feed item, or None
+    parsed: dict, parsed mf2 document, used if hfeed is None
+    actor: optional author AS actor object for all activities
+
+  Returns:
+    list of ActivityStreams activity dicts
+  """
   items = hfeed.get('children', []) if hfeed else parsed.get('items', [])
 
   activities = []
@@ -631,14 +796,32 @@ def activities_to_html(activities, extra='', body_class=''):
     converted to links if they have startIndex and length, otherwise added to
     the end.
   """
-  html = '\n'.join(object_to_html(_activity_or_object(a)) for a in activities)
-  return f"""\
+  return ''.join(activities_to_html_iter(activities, extra=extra,
+                                         body_class=body_class))
+
+
+def activities_to_html_iter(activities, extra='', body_class=''):
+  """Converts ActivityStreams activities to a microformats2 HTML h-feed, incrementally.
+
+  Same args as :func:`activities_to_html`, but yields the HTML in chunks, one
+  per activity, so callers can stream the output.
+
+  Returns:
+    generator of strings
+  """
+  yield f"""\
 <!DOCTYPE html>
 <html>
 <head><meta charset="utf-8"></head>
 <body class="{body_class}">
 {extra}
-{html}
+"""
+  for i, activity in enumerate(activities):
+    if i:
+      yield '\n'
+    yield object_to_html(_activity_or_object(activity))
+
+  yield """
 </body>
 </html>
 """
@@ -887,6 +1070,60 @@ def render_content(obj, include_location=True, synthesize_content=True,
   Returns:
     string, rendered HTML
   """
+  cache = render_cache.get()
+  if cache is None:
+    return _render_content(
+      obj, include_location=include_location,
+      synthesize_content=synthesize_content,
+      render_attachments=render_attachments, render_image=render_image,
+      white_space_pre=white_space_pre)
+
+  key = (id(obj), include_location, synthesize_content, render_attachments,
+         render_image, white_space_pre)
+  cached = cache.get(key)
+  # the cache holds a reference to obj, so its id can't be reused, but check
+  # anyway
+  if cached and cached[0] is obj:
+    return cached[1]
+
+  html = _render_content(
+    obj, include_location=include_location,
+    synthesize_content=synthesize_content,
+    render_attachments=render_attachments, render_image=render_image,
+    white_space_pre=white_space_pre)
+  cache[key] = (obj, html)
+  return html
+
+
+@contextlib.contextmanager
+def render_cache_scope():
+  """Context manager that caches :func:`render_content` output while active.
+
+  Renders are keyed by object identity and render flags, so an object that's
+  rendered more than once with the same flags, eg as a share's target and then
+  again as its u-repost-of h-cite, is only rendered once. Objects shouldn't be
+  modified inside the scope after they've been rendered.
+
+  Nested scopes share the outermost scope's cache.
+  """
+  if render_cache.get() is not None:
+    yield
+    return
+
+  token = render_cache.set({})
+  try:
+    yield
+  finally:
+    render_cache.reset(token)
+
+
+def _render_content(obj, include_location=True, synthesize_content=True,
+                    render_attachments=False, render_image=False,
+                    white_space_pre=True):
+  """Renders the content of an ActivityStreams object as HTML, uncached.
+
+  Implementation of :func:`render_content`. Same args and return value.
+  """
   obj_type = as1.object_type(obj)
   content = obj.get('content') or ''
 
@@ -1096,7 +1333,19 @@ def get_title(mf2):
 
   Returns: string title, possibly ellipsized
   """
-  lines = mf2util.interpret_feed(mf2, '').get('name', '').splitlines()
+  return _hfeed_title(mf2util.find_first_entry(mf2, ['h-feed']))
+
+
+def _hfeed_title(hfeed):
+  """Returns an h-feed's title, ie the first line of its name.
+
+  Args:
+    hfeed: dict, mf2 h-feed item, or None
+
+  Returns: string title, possibly ellipsized
+  """
+  names = hfeed['properties'].get('name') if hfeed else None
+  lines = names[0].splitlines() if names else []
   if lines:
     return util.ellipsize(lines[0])
 
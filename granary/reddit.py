@@ -235,13 +235,25 @@ class Reddit(source.Source):
 
     Only includes top level comments!
 
+    If there's more than one activity, first looks up all of their submissions
+    in a single batched /api/info request, so that only the ones whose comment
+    counts have changed since they were cached need individual requests.
+
     Args:
       activities: list of activity dicts
       cache: dict, cache as described in get_activities_response()
     """
-    for activity in activities:
-      id = util.parse_tag_uri(activity.get('id'))[1]
-      subm = self.api.submission(id=id)
+    ids = [util.parse_tag_uri(activity.get('id'))[1] for activity in activities]
+
+    subms = {}
+    if len(ids) > 1:
+      # https://www.reddit.com/dev/api/#GET_api_info
+      # praw batches these into groups of 100 fullnames per request
+      subms = {subm.id: subm
+               for subm in self.api.info(fullnames=[f't3_{id}' for id in ids])}
+
+    for id, activity in zip(ids, activities):
+      subm = subms.get(id) or self.api.submission(id=id)
 
       cache_key = f'ARR {id}'
       if cache and cache.get(cache_key) == subm.num_comments:
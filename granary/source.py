@@ -10,16 +10,22 @@ or unset if unknown.
 http://activitystrea.ms/specs/json/targeting/1.0/#anchor3
 """
 import collections
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
 import copy
 from html import escape, unescape
+import http.cookiejar
 import logging
 import re
-import urllib.parse
+import threading
+import time
+import urllib.error, urllib.parse, urllib.request
 
 import brevity
 from bs4 import BeautifulSoup
 import html2text
 from oauth_dropins.webutil import util
+import requests
 from oauth_dropins.webutil.util import json_dumps, json_loads
 
 from . import as1
@@ -44,6 +50,12 @@ HTML_ENTITY_RE = re.compile(r'&#?[a-zA-Z0-9]+;')
 # maps lower case string short name to Source subclass. populated by SourceMeta.
 sources = {}
 
+# default connection pool sizes for Transport. see requests.adapters.HTTPAdapter.
+POOL_CONNECTIONS = 20  # number of hosts to keep pools for
+POOL_MAXSIZE = 10      # number of keep-alive connections per host
+# number of most recently used hosts that Transport keeps metrics for
+METRICS_MAX_HOSTS = 200
+
 CreationResult = collections.namedtuple('CreationResult', [
   'content', 'description', 'abort', 'error_plain', 'error_html'])
 
@@ -101,6 +113,220 @@ def load_json(body, url):
     raise urllib.error.HTTPError(url, 502, msg, {}, None)
 
 
+def concurrent_map(fn, items, max_workers):
+  """Calls fn on each element of items in a bounded pool of worker threads.
+
+  If max_workers is 1 or less, or there's only one item, calls fn serially in
+  the current thread instead.
+
+  Worker threads run in copies of the caller's :mod:`contextvars` context, so
+  they see the same :data:`upstream_stats`, Flask request context, etc.
+
+  Args:
+    fn: callable that takes a single argument
+    items: sequence of arguments to call fn with
+    max_workers: integer, maximum number of concurrent calls
+
+  Returns:
+    list of fn's return values, in the same order as items
+
+  Raises:
+    the first exception raised by fn, if any, after all in-flight calls finish
+  """
+  items = list(items)
+  if max_workers <= 1 or len(items) <= 1:
+    return [fn(item) for item in items]
+
+  # a context can only be entered by one thread at a time, so copy per call
+  contexts = [contextvars.copy_context() for _ in items]
+  with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+    return list(executor.map(lambda ctx, item: ctx.run(fn, item),
+                             contexts, items))
+
+
+class UpstreamStats(object):
+  """Counts HTTP requests made by :class:`Transport`, eg for a single request.
+
+  Set :data:`upstream_stats` to an instance to collect them. Thread safe.
+
+  Attributes:
+    requests: integer
+    errors: integer
+    bytes: integer, total response body size
+    seconds: float, total elapsed time
+  """
+  def __init__(self):
+    self.requests = self.errors = self.bytes = 0
+    self.seconds = 0
+    self._lock = threading.Lock()
+
+  def record(self, seconds, bytes=0, error=False):
+    """Records a single HTTP request."""
+    with self._lock:
+      self.requests += 1
+      self.seconds += seconds
+      self.bytes += bytes
+      if error:
+        self.errors += 1
+
+
+# the current UpstreamStats, if any. Transport records into it in addition to
+# its own per-host metrics.
+upstream_stats = contextvars.ContextVar('upstream_stats', default=None)
+
+
+class Transport(object):
+  """HTTP transport with per-host keep-alive connection pools and metrics.
+
+  Wraps :func:`oauth_dropins.webutil.util.requests_fn` with a shared
+  :class:`requests.Session`, so that requests to the same host reuse
+  connections and skip TCP and TLS handshakes. The session doesn't store
+  cookies, since it's shared across sources, users, and arbitrary upstream
+  sites. Records per-host request counts, errors, and elapsed time for the
+  :const:`METRICS_MAX_HOSTS` most recently used hosts.
+
+  :class:`Source` subclasses use :attr:`Source.transport`, which defaults to a
+  single :data:`transport` shared across all of them, and can be overridden
+  per subclass or instance.
+
+  urllib-based calls, via :meth:`urlopen`, get the same timeout and metrics,
+  but not pooling, since urllib doesn't support keep-alive.
+
+  Attributes:
+    session: :class:`requests.Session`, or None if not pooled
+    timeout: float, default timeout in seconds for each request
+  """
+  def __init__(self, pooled=True, pool_connections=POOL_CONNECTIONS,
+               pool_maxsize=POOL_MAXSIZE, timeout=None):
+    """Constructor.
+
+    Args:
+      pooled: boolean, whether to reuse connections. If False, each request
+        uses a new connection via the top-level :mod:`requests` functions.
+      pool_connections: integer, number of hosts to keep connection pools for
+      pool_maxsize: integer, maximum number of connections to keep per host
+      timeout: float, default timeout in seconds, defaults to
+        :data:`oauth_dropins.webutil.util.HTTP_TIMEOUT`
+    """
+    self.timeout = timeout or util.HTTP_TIMEOUT
+    self.session = None
+    if pooled:
+      self.session = requests.Session()
+      # never store or send cookies
+      self.session.cookies.set_policy(
+        http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+      adapter = requests.adapters.HTTPAdapter(pool_connections=pool_connections,
+                                              pool_maxsize=pool_maxsize)
+      self.session.mount('http://', adapter)
+      self.session.mount('https://', adapter)
+
+    # maps host to metrics dict, least recently used first
+    self._metrics = collections.OrderedDict()
+    self._metrics_lock = threading.Lock()
+
+  def request(self, method, url, **kwargs):
+    """Makes an HTTP request.
+
+    Args:
+      method: string, 'get', 'head', 'post', or 'delete'
+      url: string
+      kwargs: passed through to :func:`oauth_dropins.webutil.util.requests_fn`
+
+    Returns: :class:`requests.Response`
+    """
+    kwargs.setdefault('timeout', self.timeout)
+    if self.session:
+      kwargs['session'] = self.session
+
+    start = time.perf_counter()
+    resp = None
+    try:
+      resp = util.requests_fn(method)(url, **kwargs)
+      return resp
+    finally:
+      # don't read streamed bodies that haven't been read yet, eg media uploads
+      size = 0
+      if resp is not None:
+        length = resp.headers.get('Content-Length')
+        if util.is_int(length):
+          size = int(length)
+        elif resp._content_consumed:
+          size = len(resp.content or b'')
+      self._record(method, url, start, size=size,
+                   error=resp is None or resp.status_code // 100 in (4, 5))
+
+  def get(self, url, **kwargs):
+    return self.request('get', url, **kwargs)
+
+  def head(self, url, **kwargs):
+    return self.request('head', url, **kwargs)
+
+  def post(self, url, **kwargs):
+    return self.request('post', url, **kwargs)
+
+  def delete(self, url, **kwargs):
+    return self.request('delete', url, **kwargs)
+
+  def urlopen(self, url_or_req, **kwargs):
+    """Wraps :func:`oauth_dropins.webutil.util.urlopen`.
+
+    Args:
+      url_or_req: string URL or :class:`urllib.request.Request`
+      kwargs: passed through to :func:`oauth_dropins.webutil.util.urlopen`
+
+    Returns: file-like response object
+    """
+    url = (url_or_req.get_full_url() if isinstance(url_or_req, urllib.request.Request)
+           else url_or_req)
+    kwargs.setdefault('timeout', self.timeout)
+
+    start = time.perf_counter()
+    resp = None
+    try:
+      resp = util.urlopen(url_or_req, **kwargs)
+      return resp
+    finally:
+      self._record('urlopen', url, start, error=resp is None)
+
+  def _record(self, method, url, start, size=0, error=False):
+    """Records metrics for a single request."""
+    elapsed = time.perf_counter() - start
+    host = urllib.parse.urlparse(url).netloc
+    logger.debug(f'{method} {host} took {elapsed:.3f}s{" (error)" if error else ""}')
+    with self._metrics_lock:
+      metrics = self._metrics.get(host)
+      if metrics is None:
+        metrics = self._metrics[host] = {'requests': 0, 'errors': 0, 'seconds': 0}
+        if len(self._metrics) > METRICS_MAX_HOSTS:
+          self._metrics.popitem(last=False)
+      else:
+        self._metrics.move_to_end(host)
+      metrics['requests'] += 1
+      metrics['seconds'] += elapsed
+      if error:
+        metrics['errors'] += 1
+
+    stats = upstream_stats.get()
+    if stats is not None:
+      stats.record(elapsed, bytes=size, error=error)
+
+  def metrics(self):
+    """Returns per-host metrics for requests made so far.
+
+    Only includes the :const:`METRICS_MAX_HOSTS` most recently used hosts.
+
+    Returns:
+      dict mapping string host to dict with integer 'requests' and 'errors'
+      counts and float total 'seconds'
+    """
+    with self._metrics_lock:
+      return {host: dict(m) for host, m in self._metrics.items()}
+
+
+# default transport shared by all Source subclasses and app.py
+transport = Transport()
+
+
 def creation_result(content=None, description=None, abort=False,
                     error_plain=None, error_html=None):
   """Create a new :class:`CreationResult`.
@@ -165,12 +391,19 @@ class Source(object, metaclass=SourceMeta):
   * OPTIMIZED_COMMENTS: boolean, whether :meth:`get_comment()` is optimized and
     only fetches the requested comment. If False, :meth:`get_comment()` fetches
     many or all of the post's comments to find the requested one.
+  * MAX_CONCURRENCY: integer, maximum number of HTTP requests to make at once
+    when fetching per-activity extras like likes and shares. 1 makes them
+    serially. Can also be overridden per instance.
+  * transport: :class:`Transport` to make HTTP requests with. Defaults to the
+    shared, pooled :data:`transport`. Can also be overridden per instance.
   """
   POST_ID_RE = None
   HTML2TEXT_OPTIONS = {}
   TRUNCATE_TEXT_LENGTH = None
   TRUNCATE_URL_LENGTH = None
   OPTIMIZED_COMMENTS = False
+  MAX_CONCURRENCY = 8
+  transport = transport
 
   def user_url(self, user_id):
     """Returns the URL for a user's profile."""
@@ -1,3 +1,18 @@
 # webutil/tests/__init__.py has setup code that makes App Engine SDK's
 # bundled libraries importable.
 import oauth_dropins.webutil.tests
+
+from .. import source
+
+
+def stub_transport(test):
+  """Makes sources use a new connection for each request.
+
+  Pooled connections go through a shared :class:`requests.Session`, which the
+  requests.* stubs in :class:`oauth_dropins.webutil.testutil.TestCase` don't
+  see.
+
+  Args:
+    test: :class:`oauth_dropins.webutil.testutil.TestCase`
+  """
+  test.mox.stubs.Set(source.Source, 'transport', source.Transport(pooled=False))
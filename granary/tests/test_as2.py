@@ -4,11 +4,18 @@
 Most of the tests are in testdata/. This is just a few things that are too small
 for full testdata tests.
 """
+import copy
+import glob
+import json
+import os
+
 from oauth_dropins.webutil import testutil
 
 from .. import as2
 from ..as2 import is_public, PUBLICS
 
+TESTDATA = os.path.join(os.path.dirname(__file__), 'testdata')
+
 
 class ActivityStreams2Test(testutil.TestCase):
 
@@ -54,6 +61,61 @@ class ActivityStreams2Test(testutil.TestCase):
     })
     self.assertEqual([{'url': 'http://x.y/z'}], as1['inReplyTo'])
 
+  def test_inputs_unchanged(self):
+    files = glob.glob(os.path.join(TESTDATA, '*.as2.json'))
+    self.assertGreater(len(files), 0)
+    for as2_file in files:
+      as1_file = as2_file.replace('.as2.json', '.as.json')
+      for filename, fn in (as2_file, as2.to_as1), (as1_file, as2.from_as1):
+        if not os.path.exists(filename):
+          continue
+        with self.subTest(os.path.basename(filename)), open(filename) as f:
+          input = json.load(f)
+          orig = copy.deepcopy(input)
+          fn(input)
+          self.assertEqual(orig, input)
+
+  def test_to_as1_attributed_to_author_unchanged(self):
+    author = {'displayName': 'Alice', 'image': [{'url': 'http://a/pic'}]}
+    input = {
+      'type': 'Note',
+      'author': author,
+      'attributedTo': [{'type': 'Person', 'id': 'http://a', 'name': None}],
+    }
+    self.assert_equals({
+      'objectType': 'note',
+      'author': {
+        'objectType': 'person',
+        'id': 'http://a',
+        'displayName': 'Alice',
+        'image': [{'url': 'http://a/pic'}],
+      },
+    }, as2.to_as1(input))
+    self.assertEqual({'displayName': 'Alice', 'image': [{'url': 'http://a/pic'}]},
+                     author)
+
+  def test_from_as1_trims_nested_nulls(self):
+    self.assert_equals({
+      'type': 'Create',
+      'actor': {'type': 'Person', 'name': 'Alice'},
+      'object': {
+        'type': 'Note',
+        'content': 'foo',
+        'tag': [{'type': 'Tag', 'name': 'x'}],
+      },
+      'to': [{'id': 'y'}],
+    }, as2.from_as1({
+      'verb': 'post',
+      'actor': {'objectType': 'person', 'displayName': 'Alice', 'image': []},
+      'object': {
+        'objectType': 'note',
+        'content': 'foo',
+        'tags': [None, {'objectType': 'hashtag', 'displayName': 'x', 'url': ''}],
+        'replies': {'items': []},
+      },
+      'to': [{'id': 'y', 'foo': None}, {}],
+    }, context=None))
+
   def test_is_public(self):
     publics = list(PUBLICS)
     for result, input in (
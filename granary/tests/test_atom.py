@@ -126,6 +126,30 @@ class AtomTest(testutil.TestCase):
           ),
           ignore_blanks=True)
 
+  def test_activities_to_atom_iter(self):
+    activities = [copy.deepcopy(test_twitter.ACTIVITY),
+                  copy.deepcopy(test_instagram.ACTIVITY)]
+    passed = copy.deepcopy(activities)
+    chunks = atom.activities_to_atom_iter(
+      passed, test_twitter.ACTOR, host_url='http://host/url')
+
+    # activities are only prepared when their entries are rendered
+    rendered = lambda: ['rendered_content' in a['object'] for a in passed]
+    self.assertEqual([False, False], rendered())
+
+    consumed = [next(chunks)]
+    while not rendered()[0]:
+      consumed.append(next(chunks))
+    self.assertEqual([True, False], rendered())
+
+    chunks = consumed + list(chunks)
+    self.assertEqual([True, True], rendered())
+    self.assertGreater(len(chunks), 2)
+    self.assert_multiline_equals(
+      atom.activities_to_atom(activities, test_twitter.ACTOR,
+                              host_url='http://host/url'),
+      ''.join(chunks))
+
   def test_activity_to_atom(self):
     self.assert_multiline_equals(
       INSTAGRAM_ENTRY,
@@ -34,9 +34,7 @@ from ..facebook import (
   SCRAPE_USER_AGENT
 )
 from .. import source
-
-API_ME_POSTS = API_SELF_POSTS % ('me', 0)
-API_ME_PHOTOS = API_PHOTOS_UPLOADED % 'me'
+from . import stub_transport
 
 # test data
 def tag_uri(name):
@@ -1359,9 +1357,13 @@ class FacebookTest(testutil.TestCase):
 
   def setUp(self):
     super(FacebookTest, self).setUp()
+    stub_transport(self)
     self.fb = Facebook()
     self.fbscrape = Facebook(scrape=True, cookie_c_user='CU', cookie_xs='XS')
     self.mox.StubOutWithMock(facebook, 'now_fn')
+    # make HTTP requests serially so that mox sees them in a deterministic order
+    self.mox.stubs.Set(source.Source, 'MAX_CONCURRENCY', 1)
+    facebook.scrape_cache.clear()
 
   def expect_urlopen(self, url, response=None, **kwargs):
     if not url.startswith('http'):
@@ -1369,6 +1371,52 @@ class FacebookTest(testutil.TestCase):
     return super(FacebookTest, self).expect_urlopen(
       url, response=json_dumps(response), **kwargs)
 
+  def expect_self_batch(self, posts=None, photos=None, albums=None, news=None,
+                        events=None, user_id='me', posts_headers=None,
+                        responses=None):
+    """Expects a batch request for @self posts, photos, albums, etc.
+
+    news and events are only included if they're not None. responses, if
+    provided, overrides the batch responses.
+    """
+    posts_req = {'method': 'GET', 'relative_url': API_SELF_POSTS % (user_id, 0)}
+    if posts_headers:
+      posts_req['headers'] = [{'name': n, 'value': v}
+                              for n, v in sorted(posts_headers.items())]
+    requests = [(posts_req, posts)]
+    if news is not None:
+      requests.append(({'method': 'GET',
+                        'relative_url': API_NEWS_PUBLISHES % user_id}, news))
+    requests += [
+      ({'method': 'GET', 'relative_url': API_PHOTOS_UPLOADED % user_id}, photos),
+      ({'method': 'GET', 'relative_url': API_ALBUMS % user_id}, albums),
+    ]
+    if events is not None:
+      requests.append(({'method': 'GET', 'relative_url': API_USER_EVENTS}, events))
+
+    if responses is None:
+      responses = [{'code': 200, 'body': json_dumps(body or {})}
+                   for _, body in requests]
+
+    return self.expect_urlopen('', responses, data=urllib.parse.urlencode({
+      'batch': json_dumps([req for req, _ in requests], sort_keys=True),
+    }))
+
+  def expect_batch(self, urls, responses, **kwargs):
+    """Expects a batch request for the given relative URLs.
+
+    responses may be decoded JSON bodies, which are returned with status 200,
+    full responses in Facebook's batch format, or None for timed out requests.
+    kwargs are passed through to expect_urlopen.
+    """
+    responses = [resp if resp is None or (isinstance(resp, dict) and 'code' in resp)
+                 else {'code': 200, 'body': json_dumps(resp)}
+                 for resp in responses]
+    return self.expect_urlopen('', responses, data=urllib.parse.urlencode({
+      'batch': json_dumps([{'method': 'GET', 'relative_url': url} for url in urls],
+                          sort_keys=True),
+    }), **kwargs)
+
   def expect_requests_get(self, url, resp='', cookie=None, **kwargs):
     kwargs.setdefault('allow_redirects', False)
     # override user agent for facebook scraping (specific to facebook tests)
@@ -1458,15 +1506,14 @@ class FacebookTest(testutil.TestCase):
     self.assertNotIn('tags', got[0])
 
   def test_get_activities_self_empty(self):
-    self.expect_urlopen(API_ME_POSTS, {})
-    self.expect_urlopen(API_ME_PHOTOS, {})
+    self.expect_self_batch()
     self.mox.ReplayAll()
     self.assert_equals([], self.fb.get_activities(group_id=source.SELF))
 
   def test_get_activities_self_photo_and_event(self):
-    self.expect_urlopen(API_ME_POSTS, {'data': [PHOTO_POST]})
-    self.expect_urlopen(API_ME_PHOTOS, {'data': [PHOTO]})
-    self.expect_urlopen(API_USER_EVENTS, {'data': [EVENT]})
+    self.expect_self_batch(posts={'data': [PHOTO_POST]},
+                           photos={'data': [PHOTO]},
+                           events={'data': [EVENT]})
 
     self.mox.ReplayAll()
     self.assert_equals(
@@ -1475,7 +1522,7 @@ class FacebookTest(testutil.TestCase):
 
   def test_get_activities_self_merge_photos(self):
     """https://github.com/snarfed/bridgy/issues/562"""
-    self.expect_urlopen(API_ME_POSTS, {'data': [
+    self.expect_self_batch(posts={'data': [
       {'id': '1', 'object_id': '11',   # has photo but no album
        'privacy': {'value': 'EVERYONE'}},
       {'id': '3', 'object_id': '33'},  # has photo but no album
@@ -1484,16 +1531,14 @@ class FacebookTest(testutil.TestCase):
        'privacy': {'value': 'CUSTOM'}},
       {'id': '7', 'object_id': '77',   # ditto, and photo has no album
        'privacy': {'value': 'CUSTOM'}},
-    ]})
-    self.expect_urlopen(API_ME_PHOTOS, {'data': [
+    ]}, photos={'data': [
       {'id': '11'},
       {'id': '22', 'album': {'id': '222'}},  # no matching post
       {'id': '33', 'album': {'id': '333'}},  # no matching album
       {'id': '44', 'album': {'id': '444'}},  # no matching post or album
       {'id': '66', 'album': {'id': '666'}},  # consolidated posts...
       {'id': '77'},
-    ]})
-    self.expect_urlopen(API_ALBUMS % 'me', {'data': [
+    ]}, albums={'data': [
       {'id': '222', 'privacy': 'friends'},   # no post
       {'id': '666', 'privacy': 'everyone'},  # consolidated post
     ]})
@@ -1511,47 +1556,100 @@ class FacebookTest(testutil.TestCase):
         for activity in self.fb.get_activities(group_id=source.SELF)])
 
   def test_get_activities_user_id_merge_photos(self):
-    self.expect_urlopen(API_SELF_POSTS % ('567', 0), {'data': []})
-    self.expect_urlopen(API_PHOTOS_UPLOADED % '567', {'data': [
+    self.expect_self_batch(user_id='567', posts={'data': []}, photos={'data': [
       {'album': {'id': '222'}},
-    ]})
-    self.expect_urlopen(API_ALBUMS % '567', {'data': []})
+    ]}, albums={'data': []})
 
     self.mox.ReplayAll()
     self.assert_equals([], self.fb.get_activities(user_id='567', group_id=source.SELF))
 
   def test_get_activities_self_photos_returns_list(self):
-    self.expect_urlopen(API_ME_POSTS, {})
-    self.expect_urlopen(API_ME_PHOTOS, [])
+    self.expect_self_batch(photos=[])
     self.mox.ReplayAll()
     self.assert_equals([], self.fb.get_activities(group_id=source.SELF))
 
   def test_get_activities_self_owned_event_rsvps(self):
-    self.expect_urlopen(API_ME_POSTS, {})
-    self.expect_urlopen(API_ME_PHOTOS, {})
-    self.expect_urlopen(API_USER_EVENTS, {'data': [EVENT]})
+    self.expect_self_batch(events={'data': [EVENT]})
 
     self.mox.ReplayAll()
     self.assert_equals([EVENT_ACTIVITY], self.fb.get_activities(
       group_id=source.SELF, fetch_events=True, event_owner_id=EVENT['owner']['id']))
 
   def test_get_activities_self_unowned_event_no_rsvps(self):
-    self.expect_urlopen(API_ME_POSTS, {})
-    self.expect_urlopen(API_ME_PHOTOS, {})
-    self.expect_urlopen(API_USER_EVENTS, {'data': [EVENT]})
+    self.expect_self_batch(events={'data': [EVENT]})
 
     self.mox.ReplayAll()
     self.assert_equals([], self.fb.get_activities(
       group_id=source.SELF, fetch_events=True, event_owner_id='xyz'))
 
   def test_get_activities_self_events_returns_list(self):
-    self.expect_urlopen(API_ME_POSTS, {})
-    self.expect_urlopen(API_ME_PHOTOS, {})
-    self.expect_urlopen(API_USER_EVENTS, [])
+    self.expect_self_batch(events=[])
     self.mox.ReplayAll()
     self.assert_equals([], self.fb.get_activities(
       group_id=source.SELF, fetch_events=True))
 
+  def test_get_activities_self_etags(self):
+    self.expect_self_batch(posts_headers={'If-None-Match': '"posts etag"'},
+                           events={}, responses=[
+      {'code': 304, 'headers': [{'name': 'ETag', 'value': '"posts etag"'}]},
+      {'code': 200, 'body': '{}'},
+      {'code': 200, 'body': '{}'},
+      {'code': 200, 'body': json_dumps({'data': [EVENT]}),
+       'headers': [{'name': 'ETag', 'value': '"events etag"'}]},
+    ])
+    self.mox.ReplayAll()
+
+    resp = self.fb.get_activities_response(
+      group_id=source.SELF, etag='"posts etag"', fetch_events=True)
+    self.assert_equals([EVENT_ACTIVITY], resp['items'])
+    self.assertEqual('"posts etag"', resp['etag'])
+
+  def test_get_activities_self_news_events_repeated_polls(self):
+    news = {'id': '12', 'message': 'news'}
+    for _ in range(2):
+      self.expect_self_batch(news={'data': [news]}, events={'data': [EVENT]},
+                             responses=[
+        {'code': 200, 'body': '{}'},
+        {'code': 200, 'body': json_dumps({'data': [news]}),
+         'headers': [{'name': 'ETag', 'value': '"news etag"'}]},
+        {'code': 200, 'body': '{}'},
+        {'code': 200, 'body': '{}'},
+        {'code': 200, 'body': json_dumps({'data': [EVENT]}),
+         'headers': [{'name': 'ETag', 'value': '"events etag"'}]},
+      ])
+    self.mox.ReplayAll()
+
+    cache = {}
+    for _ in range(2):
+      got = self.fb.get_activities(
+        group_id=source.SELF, fetch_news=True, fetch_events=True,
+        event_owner_id=EVENT['owner']['id'], cache=cache)
+      self.assert_equals(['12', EVENT['id']],
+                         [a['object']['fb_id'] for a in got])
+
+  def test_get_activities_self_batch_error(self):
+    self.expect_self_batch(responses=[
+      {'code': 200, 'body': '{}'},
+      {'code': 400, 'body': '{"error": "foo"}'},
+      {'code': 200, 'body': '{}'},
+    ])
+    self.mox.ReplayAll()
+
+    with self.assertRaises(urllib.error.HTTPError) as e:
+      self.fb.get_activities(group_id=source.SELF)
+    self.assertEqual(400, e.exception.code)
+
+  def test_get_activities_self_batch_timeout_retries(self):
+    self.expect_self_batch(responses=[
+      {'code': 200, 'body': json_dumps({'data': [PHOTO_POST]})},
+      None,
+      {'code': 200, 'body': '{}'},
+    ])
+    self.expect_urlopen(API_PHOTOS_UPLOADED % 'me', {'data': [PHOTO]})
+    self.mox.ReplayAll()
+
+    self.assert_equals([PHOTO_ACTIVITY], self.fb.get_activities(group_id=source.SELF))
+
   def test_get_activities_passes_through_access_token(self):
     self.expect_urlopen('me/home?offset=0&access_token=asdf', {"id": 123})
     self.mox.ReplayAll()
@@ -1662,12 +1760,21 @@ class FacebookTest(testutil.TestCase):
   def test_get_activities_too_many_ids(self):
     ids = ['1', '2', '3', '4', '5']
     self.expect_urlopen('me/home?offset=0', {'data': [{'id': id} for id in ids]})
-    self.expect_urlopen(API_SHARES % '1,2', {'1': {'data': [{'id': '222'}]}})
-    self.expect_urlopen(API_SHARES % '3,4', {'2': {'data': [{'id': '444'}]}})
-    self.expect_urlopen(API_SHARES % '5', {})
-    self.expect_urlopen(API_COMMENTS_ALL % '1,2', {'1': {'data': [{'id': '111'}]}})
-    self.expect_urlopen(API_COMMENTS_ALL % '3,4', {'1': {'data': [{'id': '333'}]}})
-    self.expect_urlopen(API_COMMENTS_ALL % '5', {})
+    self.expect_batch([
+      API_SHARES % '1,2',
+      API_SHARES % '3,4',
+      API_SHARES % '5',
+      API_COMMENTS_ALL % '1,2',
+      API_COMMENTS_ALL % '3,4',
+      API_COMMENTS_ALL % '5',
+    ], [
+      {'1': {'data': [{'id': '222'}]}},
+      {'2': {'data': [{'id': '444'}]}},
+      {},
+      {'1': {'data': [{'id': '111'}]}},
+      {'1': {'data': [{'id': '333'}]}},
+      {},
+    ])
     self.mox.ReplayAll()
 
     try:
@@ -1686,6 +1793,68 @@ class FacebookTest(testutil.TestCase):
     obj1 = activities[1]['object']
     self.assert_equals(['444'], [t['fb_id'] for t in obj1['tags']])
 
+  def test_get_activities_extras_batch_4xx_skips_only_that_edge(self):
+    self.expect_urlopen('me/home?offset=0', {'data': [{'id': '1_2'}]})
+    self.expect_batch([API_SHARES % '1_2', API_COMMENTS_ALL % '1_2'], [
+      {'code': 400, 'body': '{"error": "foo"}'},
+      {'1_2': {'data': [{'id': '777', 'message': 'foo'}]}},
+    ])
+    self.mox.ReplayAll()
+
+    got = self.fb.get_activities(fetch_shares=True, fetch_replies=True)
+    self.assertNotIn('tags', got[0]['object'])
+    self.assert_equals(['777'], [c['fb_id'] for c in
+                                 got[0]['object']['replies']['items']])
+
+  def test_get_activities_extras_batch_request_4xx(self):
+    self.mox.stubs.Set(facebook, 'MAX_BATCH_REQUESTS', 1)
+    self.expect_urlopen('me/home?offset=0', {'data': [{'id': '1_2'}]})
+    self.expect_batch([API_SHARES % '1_2'], [], status=400)
+    self.expect_batch([API_COMMENTS_ALL % '1_2'],
+                      [{'1_2': {'data': [{'id': '777', 'message': 'foo'}]}}])
+    self.mox.ReplayAll()
+
+    got = self.fb.get_activities(fetch_shares=True, fetch_replies=True)
+    self.assertNotIn('tags', got[0]['object'])
+    self.assert_equals(['777'], [c['fb_id'] for c in
+                                 got[0]['object']['replies']['items']])
+
+  def test_get_activities_extras_batch_request_5xx(self):
+    self.expect_urlopen('me/home?offset=0', {'data': [{'id': '1_2'}]})
+    self.expect_batch([API_SHARES % '1_2', API_COMMENTS_ALL % '1_2'], [],
+                      status=503)
+    self.mox.ReplayAll()
+
+    with self.assertRaises(urllib.error.HTTPError) as e:
+      self.fb.get_activities(fetch_shares=True, fetch_replies=True)
+    self.assertEqual(503, e.exception.code)
+
+  def test_get_activities_extras_batch_5xx(self):
+    self.expect_urlopen('me/home?offset=0', {'data': [{'id': '1_2'}]})
+    self.expect_batch([API_SHARES % '1_2', API_COMMENTS_ALL % '1_2'], [
+      {}, {'code': 500, 'body': 'oops'},
+    ])
+    self.mox.ReplayAll()
+
+    with self.assertRaises(urllib.error.HTTPError) as e:
+      self.fb.get_activities(fetch_shares=True, fetch_replies=True)
+    self.assertEqual(500, e.exception.code)
+
+  def test_get_activities_extras_multiple_batches(self):
+    self.mox.stubs.Set(facebook, 'MAX_BATCH_REQUESTS', 1)
+    self.expect_urlopen('me/home?offset=0', {'data': [{'id': '1_2'}]})
+    self.expect_batch([API_SHARES % '1_2'], [{'1_2': {'data': [SHARE]}}])
+    # timed out in its batch, so it gets retried on its own
+    self.expect_batch([API_COMMENTS_ALL % '1_2'], [None])
+    self.expect_urlopen(API_COMMENTS_ALL % '1_2',
+                        {'1_2': {'data': [{'id': '777', 'message': 'foo'}]}})
+    self.mox.ReplayAll()
+
+    got = self.fb.get_activities(fetch_shares=True, fetch_replies=True)
+    self.assert_equals([SHARE_OBJ], got[0]['object']['tags'])
+    self.assert_equals(['777'], [c['fb_id'] for c in
+                                 got[0]['object']['replies']['items']])
+
   def test_get_event(self):
     self.expect_urlopen(API_EVENT % '145304994', EVENT)
     self.mox.ReplayAll()
@@ -1724,8 +1893,7 @@ class FacebookTest(testutil.TestCase):
     post = {'id': '1', 'status_type': 'shared_story'}
     activity = self.fb.post_to_activity(post)
 
-    self.expect_urlopen(API_ME_POSTS, {'data': [post]})
-    self.expect_urlopen(API_ME_PHOTOS, {})
+    self.expect_self_batch(posts={'data': [post]})
     self.mox.ReplayAll()
     self.assert_equals([activity], self.fb.get_activities(group_id=source.SELF))
 
@@ -1762,24 +1930,18 @@ class FacebookTest(testutil.TestCase):
     self.assert_equals([activity], self.fb.get_activities(fetch_replies=True))
 
   def test_get_activities_skips_extras_if_no_posts(self):
-    self.expect_urlopen(API_ME_POSTS, {'data': []})
-    self.expect_urlopen(API_ME_PHOTOS, {})
+    self.expect_self_batch(posts={'data': []})
     self.mox.ReplayAll()
     self.assert_equals([], self.fb.get_activities(
       group_id=source.SELF, fetch_shares=True, fetch_replies=True))
 
   def test_get_activities_extras_skips_notes_includes_links(self):
     # first call returns just notes
-    self.expect_urlopen(API_ME_POSTS,
-                        {'data': [FB_NOTE, FB_CREATED_NOTE]})
-    self.expect_urlopen(API_ME_PHOTOS, {})
+    self.expect_self_batch(posts={'data': [FB_NOTE, FB_CREATED_NOTE]})
 
     # second call returns notes and link
-    self.expect_urlopen(API_ME_POSTS,
-                        {'data': [FB_NOTE, FB_CREATED_NOTE, FB_LINK]})
-    self.expect_urlopen(API_ME_PHOTOS, {})
-    self.expect_urlopen(API_SHARES % '555', [])
-    self.expect_urlopen(API_COMMENTS_ALL % '555', {})
+    self.expect_self_batch(posts={'data': [FB_NOTE, FB_CREATED_NOTE, FB_LINK]})
+    self.expect_batch([API_SHARES % '555', API_COMMENTS_ALL % '555'], [[], {}])
 
     self.mox.ReplayAll()
 
@@ -1789,13 +1951,14 @@ class FacebookTest(testutil.TestCase):
         group_id=source.SELF, fetch_shares=True, fetch_replies=True))
 
   def test_get_activities_matches_extras_with_correct_activity(self):
-    self.expect_urlopen(API_ME_POSTS, {'data': [POST]})
-    self.expect_urlopen(API_ME_PHOTOS, {})
-    self.expect_urlopen(API_USER_EVENTS, {'data': [EVENT]})
-    self.expect_urlopen(API_SHARES % '212038_10100176064482163',
-                        {'212038_10100176064482163': {'data': [SHARE]}})
-    self.expect_urlopen(API_COMMENTS_ALL % '212038_10100176064482163',
-                        {'212038_10100176064482163': {'data': COMMENTS}})
+    self.expect_self_batch(posts={'data': [POST]}, events={'data': [EVENT]})
+    self.expect_batch([
+      API_SHARES % '212038_10100176064482163',
+      API_COMMENTS_ALL % '212038_10100176064482163',
+    ], [
+      {'212038_10100176064482163': {'data': [SHARE]}},
+      {'212038_10100176064482163': {'data': COMMENTS}},
+    ])
 
     self.mox.ReplayAll()
     activity = copy.deepcopy(ACTIVITY)
@@ -1804,9 +1967,8 @@ class FacebookTest(testutil.TestCase):
       group_id=source.SELF, fetch_events=True, fetch_shares=True, fetch_replies=True))
 
   def test_get_activities_self_fetch_news(self):
-    self.expect_urlopen(API_ME_POSTS, {'data': [POST]})
-    self.expect_urlopen(API_NEWS_PUBLISHES % 'me', {'data': [FB_NEWS_PUBLISH]})
-    self.expect_urlopen(API_ME_PHOTOS, {})
+    self.expect_self_batch(posts={'data': [POST]},
+                           news={'data': [FB_NEWS_PUBLISH]})
     # should only fetch sharedposts for POST, not FB_NEWS_PUBLISH
     self.expect_urlopen(API_SHARES % '212038_10100176064482163', {})
 
@@ -1816,9 +1978,8 @@ class FacebookTest(testutil.TestCase):
     self.assert_equals([ACTIVITY, FB_NEWS_PUBLISH_ACTIVITY], got)
 
   def test_get_activities_user_id_fetch_news(self):
-    self.expect_urlopen(API_SELF_POSTS % ('567', 0), {'data': []})
-    self.expect_urlopen(API_NEWS_PUBLISHES % '567', {'data': [FB_NEWS_PUBLISH]})
-    self.expect_urlopen(API_PHOTOS_UPLOADED % '567', {})
+    self.expect_self_batch(user_id='567', posts={'data': []},
+                           news={'data': [FB_NEWS_PUBLISH]})
 
     self.mox.ReplayAll()
     got = self.fb.get_activities(group_id=source.SELF, user_id='567', fetch_news=True)
@@ -1897,6 +2058,46 @@ class FacebookTest(testutil.TestCase):
                                               fetch_replies=True, fetch_likes=True)
     self.assert_equals(expected, activities)
 
+  def test_get_activities_scrape_timeline_fetch_replies_likes_cached(self):
+    facebook.now_fn().MultipleTimes().AndReturn(datetime(1999, 1, 1))
+    self.expect_requests_get('212038?v=timeline', MBASIC_HTML_TIMELINE,
+                             cookie='c_user=CU; xs=XS')
+    self.expect_requests_get('123', MBASIC_HTML_POST.replace('456', '123'),
+                             cookie='c_user=CU; xs=XS')
+    self.expect_requests_get('456', MBASIC_HTML_POST, cookie='c_user=CU; xs=XS')
+    for id in '123', '456':
+      self.expect_requests_get(
+        f'ufi/reaction/profile/browser/?ft_ent_identifier={id}',
+        MBASIC_HTML_REACTIONS, cookie='c_user=CU; xs=XS')
+
+    # second time, nothing has changed. 456 is cached, but 123 doesn't have
+    # comment or reaction counts, so we can't tell if they changed.
+    self.expect_requests_get('212038?v=timeline', MBASIC_HTML_TIMELINE,
+                             cookie='c_user=CU; xs=XS')
+    self.expect_requests_get('123', MBASIC_HTML_POST.replace('456', '123'),
+                             cookie='c_user=CU; xs=XS')
+    self.expect_requests_get('ufi/reaction/profile/browser/?ft_ent_identifier=123',
+                             MBASIC_HTML_REACTIONS, cookie='c_user=CU; xs=XS')
+
+    # third time, one post's content changed, so we scrape it again
+    self.expect_requests_get(
+      '212038?v=timeline', MBASIC_HTML_TIMELINE.replace('Checking another', 'Checking one more'),
+      cookie='c_user=CU; xs=XS')
+    self.expect_requests_get('123', MBASIC_HTML_POST.replace('456', '123'),
+                             cookie='c_user=CU; xs=XS')
+    self.expect_requests_get('ufi/reaction/profile/browser/?ft_ent_identifier=123',
+                             MBASIC_HTML_REACTIONS, cookie='c_user=CU; xs=XS')
+    self.mox.ReplayAll()
+
+    first = self.fbscrape.get_activities(
+      user_id='212038', group_id=source.SELF, fetch_replies=True, fetch_likes=True)
+    second = self.fbscrape.get_activities(
+      user_id='212038', group_id=source.SELF, fetch_replies=True, fetch_likes=True)
+    self.assert_equals(first, second)
+    third = self.fbscrape.get_activities(
+      user_id='212038', group_id=source.SELF, fetch_replies=True, fetch_likes=True)
+    self.assert_equals(first, third)
+
   def test_get_activities_scrape_post(self):
     facebook.now_fn().MultipleTimes().AndReturn(datetime(1999, 1, 1))
     self.expect_requests_get('456', MBASIC_HTML_POST, cookie='c_user=CU; xs=XS',
@@ -1918,6 +2119,24 @@ class FacebookTest(testutil.TestCase):
                                               fetch_likes=True)
     self.assert_equals([MBASIC_ACTIVITY_REACTIONS], activities)
 
+  def test_get_activities_scrape_post_fetch_likes_not_cached(self):
+    """Permalink pages don't have reaction counts, so we always scrape them."""
+    facebook.now_fn().MultipleTimes().AndReturn(datetime(1999, 1, 1))
+    for reactions in MBASIC_HTML_REACTIONS, MBASIC_HTML_REACTIONS.replace(
+        'id=333', 'id=444'):
+      self.expect_requests_get('456', MBASIC_HTML_POST, cookie='c_user=CU; xs=XS',
+                               allow_redirects=True)
+      self.expect_requests_get('ufi/reaction/profile/browser/?ft_ent_identifier=456',
+                               reactions, cookie='c_user=CU; xs=XS')
+    self.mox.ReplayAll()
+
+    first = self.fbscrape.get_activities(user_id='212038', activity_id='456',
+                                         fetch_likes=True)
+    self.assert_equals([MBASIC_ACTIVITY_REACTIONS], first)
+    second = self.fbscrape.get_activities(user_id='212038', activity_id='456',
+                                          fetch_likes=True)
+    self.assertNotEqual(first, second)
+
   def test_get_comment(self):
     self.expect_urlopen(API_COMMENT % '123_456', COMMENTS[0])
     self.mox.ReplayAll()
@@ -3200,9 +3419,9 @@ cc Sam G, Michael M<br />""", preview.description)
       }}))
 
   def test_urlopen_batch(self):
-    self.expect_urlopen('',
-      data='batch=[{"method":"GET","relative_url":"abc"},'
-                  '{"method":"GET","relative_url":"def"}]',
+    self.expect_urlopen('', data=urllib.parse.urlencode({
+      'batch': '[{"method":"GET","relative_url":"abc"},'
+                '{"method":"GET","relative_url":"def"}]'}),
       response=[{'code': 200, 'body': '{"abc": 1}'},
                 {'code': 200, 'body': '{"def": 2}'}])
     self.mox.ReplayAll()
@@ -3211,9 +3430,9 @@ cc Sam G, Michael M<br />""", preview.description)
                        self.fb.urlopen_batch(('abc', 'def')))
 
   def test_urlopen_batch_error(self):
-    self.expect_urlopen('',
-      data='batch=[{"method":"GET","relative_url":"abc"},'
-                  '{"method":"GET","relative_url":"def"}]',
+    self.expect_urlopen('', data=urllib.parse.urlencode({
+      'batch': '[{"method":"GET","relative_url":"abc"},'
+                '{"method":"GET","relative_url":"def"}]'}),
       response=[{'code': 304},
                 {'code': 499, 'body': 'error body'}])
     self.mox.ReplayAll()
@@ -3226,11 +3445,11 @@ cc Sam G, Michael M<br />""", preview.description)
       self.assertEqual('error body', e.reason)
 
   def test_urlopen_batch_full(self):
-    self.expect_urlopen('',
-      data='batch=[{"headers":[{"name":"U","value":"V"},'
-                              '{"name":"X","value":"Y"}],'
-                   '"method":"GET","relative_url":"abc"},'
-                  '{"method":"GET","relative_url":"def"}]',
+    self.expect_urlopen('', data=urllib.parse.urlencode({
+      'batch': '[{"headers":[{"name":"U","value":"V"},'
+                            '{"name":"X","value":"Y"}],'
+                 '"method":"GET","relative_url":"abc"},'
+                '{"method":"GET","relative_url":"def"}]'}),
       response=[{'code': 200, 'body': '{"json": true}'},
                 {'code': 200, 'body': 'not json'}])
     self.mox.ReplayAll()
@@ -3245,9 +3464,9 @@ cc Sam G, Michael M<br />""", preview.description)
   def test_urlopen_batch_full_errors(self):
     resps = [{'code': 501},
              {'code': 499, 'body': 'error body'}]
-    self.expect_urlopen('',
-      data='batch=[{"method":"GET","relative_url":"abc"},'
-                  '{"method":"GET","relative_url":"def"}]',
+    self.expect_urlopen('', data=urllib.parse.urlencode({
+      'batch': '[{"method":"GET","relative_url":"abc"},'
+                '{"method":"GET","relative_url":"def"}]'}),
       response=resps)
     self.mox.ReplayAll()
 
@@ -14,6 +14,7 @@ import requests
 
 from .. import flickr
 from .. import source
+from . import stub_transport
 
 # test data
 def tag_uri(name):
@@ -284,6 +285,28 @@ FAVORITE_OBJS = [{
 ACTIVITY_WITH_FAVES = copy.deepcopy(ACTIVITY)
 ACTIVITY_WITH_FAVES['object']['tags'] += FAVORITE_OBJS
 
+# events from flickr.activity.userPhotos
+ACTIVITY_FEED_COMMENT = {
+  'type': 'comment',
+  'commentid': '72157625845945286',
+  'user': '36398523@N00',
+  'username': 'if winter ends',
+  'realname': 'Dusty',
+  'iconserver': '108',
+  'iconfarm': 1,
+  'dateadded': '1295288643',
+  '_content': 'Love this!',
+}
+ACTIVITY_FEED_FAVE = {
+  'type': 'fave',
+  'user': '95922884@N00',
+  'username': 'absentmindedprof',
+  'realname': 'Jennifer',
+  'iconserver': '5343',
+  'iconfarm': 6,
+  'dateadded': '1291599546',
+}
+
 # response from flickr.people.getInfo
 PERSON_INFO = {
   'person': {
@@ -576,9 +599,12 @@ class FlickrTest(testutil.TestCase):
 
   def setUp(self):
     super(FlickrTest, self).setUp()
+    stub_transport(self)
     flickr_auth.FLICKR_APP_KEY = 'fake'
     flickr_auth.FLICKR_APP_SECRET = 'fake'
     self.flickr = flickr.Flickr('key', 'secret')
+    # fetch extras serially so that mox sees requests in a deterministic order
+    self.mox.stubs.Set(source.Source, 'MAX_CONCURRENCY', 1)
 
   def expect_call_api_method(self, method, params, result):
     full_params = {
@@ -673,6 +699,120 @@ class FlickrTest(testutil.TestCase):
       [ACTIVITY_WITH_FAVES], self.flickr.get_activities(
         activity_id='5227922370', fetch_likes=True))
 
+  def expect_self_photos(self, user_id='me'):
+    self.expect_call_api_method('flickr.people.getPhotos', {
+      'extras': flickr.Flickr.API_EXTRAS,
+      'per_page': 50,
+      'user_id': user_id,
+    }, json_dumps(CONTACTS_PHOTOS))
+
+  def expect_activity_feed(self, items, page=1, pages=1):
+    self.expect_call_api_method('flickr.activity.userPhotos', {
+      'timeframe': flickr.ACTIVITY_TIMEFRAME,
+      'per_page': 50,
+      'page': page,
+    }, json_dumps({'items': {'item': items, 'page': page, 'pages': pages}}))
+
+  def test_get_activities_activity_feed(self):
+    self.expect_self_photos()
+    self.expect_activity_feed([{
+      'type': 'photo',
+      'id': '1234',
+      'commentsold': 1,
+      'favesold': 0,
+      'favesnew': 1,
+      'activity': {'event': [ACTIVITY_FEED_COMMENT, ACTIVITY_FEED_FAVE]},
+    }, {
+      # truncated, so we should fetch this photo's comments and faves directly
+      'type': 'photo',
+      'id': '2345',
+      'commentsnew': 2,
+      'activity': {'event': [ACTIVITY_FEED_COMMENT]},
+    }])
+    self.expect_call_api_method('flickr.photos.comments.getList', {
+      'photo_id': '2345',
+    }, json_dumps(PHOTO_COMMENTS))
+    self.expect_call_api_method('flickr.photos.getFavorites', {
+      'photo_id': '2345',
+    }, json_dumps({}))
+    self.mox.ReplayAll()
+
+    acts = self.flickr.get_activities(group_id=source.SELF, fetch_replies=True,
+                                      fetch_likes=True, use_activity_feed=True)
+
+    reply = acts[0]['object']['replies']['items'][0]
+    self.assert_equals({
+      'objectType': 'comment',
+      'id': tag_uri('72157625845945286'),
+      'url': 'https://www.flickr.com/photos/5555/1234/#comment72157625845945286',
+      'inReplyTo': [{'id': tag_uri('1234')}],
+      'content': 'Love this!',
+      'published': '2011-01-17T18:24:03+00:00',
+      'updated': '2011-01-17T18:24:03+00:00',
+      'author': {
+        'objectType': 'person',
+        'displayName': 'Dusty',
+        'username': 'if winter ends',
+        'id': tag_uri('36398523@N00'),
+        'url': 'https://www.flickr.com/people/36398523@N00/',
+        'image': {'url': 'https://farm1.staticflickr.com/108/buddyicons/36398523@N00.jpg'},
+      },
+    }, reply)
+    self.assertEqual(1, acts[0]['object']['replies']['totalItems'])
+    like = acts[0]['object']['tags'][-1]
+    self.assertEqual('like', like['verb'])
+    self.assertEqual(tag_uri('1234_liked_by_95922884@N00'), like['id'])
+
+    self.assert_equals([COMMENT_OBJS[0]['id']],
+                       [r['id'] for r in acts[1]['object']['replies']['items']])
+
+  def test_get_activities_activity_feed_more_pages(self):
+    self.mox.stubs.Set(flickr, 'ACTIVITY_MAX_PAGES', 1)
+    self.expect_self_photos()
+    # photo 1234 isn't in the first page, but might be in later ones
+    self.expect_activity_feed([], pages=2)
+    for id in '1234', '2345':
+      self.expect_call_api_method('flickr.photos.getFavorites', {
+        'photo_id': id,
+      }, json_dumps({}))
+    self.mox.ReplayAll()
+
+    self.flickr.get_activities(group_id=source.SELF, fetch_likes=True,
+                               use_activity_feed=True)
+
+  def test_get_activities_activity_feed_no_activity(self):
+    self.expect_self_photos()
+    self.expect_activity_feed([])
+    self.mox.ReplayAll()
+
+    acts = self.flickr.get_activities(group_id=source.SELF, fetch_replies=True,
+                                      use_activity_feed=True)
+    self.assertNotIn('replies', acts[0]['object'])
+
+  def test_get_activities_activity_feed_authed_user_id(self):
+    self.flickr = flickr.Flickr('key', 'secret', user_id='39216764@N00')
+    self.expect_self_photos(user_id='39216764@N00')
+    self.expect_activity_feed([])
+    self.mox.ReplayAll()
+
+    self.flickr.get_activities(user_id='39216764@N00', group_id=source.SELF,
+                               fetch_replies=True, use_activity_feed=True)
+
+  def test_get_activities_activity_feed_other_user(self):
+    """The activity feed only has the authed user's photos, so don't use it."""
+    self.flickr = flickr.Flickr('key', 'secret', user_id='39216764@N00')
+    self.expect_self_photos(user_id='other')
+    for id in '1234', '2345':
+      self.expect_call_api_method('flickr.photos.comments.getList', {
+        'photo_id': id,
+      }, json_dumps(PHOTO_COMMENTS))
+    self.mox.ReplayAll()
+
+    acts = self.flickr.get_activities(user_id='other', group_id=source.SELF,
+                                      fetch_replies=True, use_activity_feed=True)
+    for act in acts:
+      self.assertEqual(1, act['object']['replies']['totalItems'])
+
   def test_favorite_without_display_name(self):
     """Make sure faves fall back to the username if the user did not
     supply a real name.
@@ -23,6 +23,7 @@ from ..github import (
   REST_REACTIONS,
 )
 from .. import source
+from . import stub_transport
 
 # test data
 def tag_uri(name):
@@ -291,6 +292,12 @@ REACTION_REST = {  # GitHub v3
   'created_at': '2018-02-21T19:49:16Z',
   'user': USER_REST,
 }
+REACTION_GRAPHQL = {  # GitHub v4
+  'id': 'MDg6UmVhY3Rpb24xOTg5NDk3MA==',
+  'content': 'THUMBS_UP',
+  'createdAt': '2018-02-21T19:49:16Z',
+  'user': USER_GRAPHQL,
+}
 REACTION_OBJ = {  # ActivityStreams
   'id': tag_uri('foo:bar:333_thumbs_up_by_snarfed'),
   'url': 'https://github.com/foo/bar/issues/333#thumbs_up-by-snarfed',
@@ -360,6 +367,7 @@ class GitHubTest(testutil.TestCase):
 
   def setUp(self):
     super(GitHubTest, self).setUp()
+    stub_transport(self)
     self.gh = github.GitHub('a-towkin')
     self.batch = []
     self.batch_responses = []
@@ -386,6 +394,27 @@ class GitHubTest(testutil.TestCase):
       },
     })
 
+  def expect_graphql_issues_or_prs(self, subjects, response, errors=None,
+                                   fetch_replies=True, fetch_likes=True):
+    fields = github.GRAPHQL_ISSUE_OR_PR_FIELDS
+    if fetch_replies:
+      fields += github.GRAPHQL_ISSUE_OR_PR_COMMENTS
+    if fetch_likes:
+      fields += github.GRAPHQL_ISSUE_OR_PR_REACTIONS
+
+    query = ''
+    kwargs = {}
+    for i, (owner, repo, number) in subjects:
+      query += github.GRAPHQL_ISSUE_OR_PR_ALIAS % {'i': i, 'fields': fields}
+      kwargs.update({f'owner{i}': owner, f'repo{i}': repo, f'number{i}': number})
+
+    resp = {'data': response}
+    if errors:
+      resp['errors'] = errors
+    self.expect_requests_post(GRAPHQL_BASE, headers={
+        'Authorization': 'bearer a-towkin',
+      }, json={'query': ('query {' + query + '}') % kwargs}, response=resp)
+
   def expect_graphql_get_labels(self, labels):
     self.expect_graphql(json={
       'query': github.GRAPHQL_REPO_LABELS % {
@@ -605,6 +634,96 @@ class GitHubTest(testutil.TestCase):
     obj_public_repo['to'] = [{'objectType': 'group', 'alias': '@private'}]
     self.assert_equals([obj_public_repo], self.gh.get_activities())
 
+  def test_get_activities_graphql(self):
+    issue = copy.deepcopy(ISSUE_GRAPHQL)
+    issue.update({
+      'labels': {'nodes': [{'name': 'new silo'}]},
+      'comments': {'nodes': [COMMENT_GRAPHQL, COMMENT_GRAPHQL]},
+      'reactions': {'nodes': [REACTION_GRAPHQL, REACTION_GRAPHQL]},
+    })
+
+    self.expect_rest(REST_NOTIFICATIONS,
+                     [NOTIFICATION_PULL_REST, NOTIFICATION_ISSUE_REST])
+    self.expect_graphql_issues_or_prs(
+      [(0, ('foo', 'bar', 123)), (1, ('foo', 'baz', 456))], {
+        'subject0': None,
+        'subject1': {'issueOrPullRequest': issue},
+      }, errors=[{'type': 'NOT_FOUND', 'message': 'Could not resolve',
+                  'path': ['subject0']}])
+    self.mox.ReplayAll()
+
+    comment = copy.deepcopy(COMMENT_OBJ)
+    comment['id'] = tag_uri('foo:bar:' + COMMENT_GRAPHQL['id'])
+    expected = copy.deepcopy(ISSUE_OBJ_WITH_REPLIES)
+    expected['replies']['items'] = [comment, comment]
+    expected['tags'].extend([REACTION_OBJ, REACTION_OBJ])
+    self.assert_equals([expected], self.gh.get_activities(
+      fetch_replies=True, fetch_likes=True, use_graphql=True))
+
+  def test_get_activities_graphql_batches_and_since(self):
+    self.mox.stubs.Set(github, 'GRAPHQL_ISSUES_OR_PRS_BATCH_SIZE', 1)
+    self.mox.stubs.Set(source.Source, 'MAX_CONCURRENCY', 1)
+
+    old = copy.deepcopy(COMMENT_GRAPHQL)
+    old['updatedAt'] = '2012-10-25T15:16:26Z'
+    new = copy.deepcopy(COMMENT_GRAPHQL)
+    new['updatedAt'] = '2012-10-25T15:16:27Z'
+    issue = copy.deepcopy(ISSUE_GRAPHQL)
+    issue['comments'] = {'nodes': [old, new]}
+    pull = copy.deepcopy(ISSUE_GRAPHQL)
+    pull.update({
+      'merged': True,
+      'baseRefName': 'main',
+      'comments': {'nodes': []},
+    })
+
+    self.expect_rest(REST_NOTIFICATIONS,
+                     [NOTIFICATION_PULL_REST, NOTIFICATION_ISSUE_REST],
+                     headers={'If-Modified-Since': 'Thu, 25 Oct 2012 15:16:27 GMT'})
+    self.expect_graphql_issues_or_prs(
+      [(0, ('foo', 'bar', 123))], {'subject0': {'issueOrPullRequest': pull}},
+      fetch_likes=False)
+    self.expect_graphql_issues_or_prs(
+      [(1, ('foo', 'baz', 456))], {'subject1': {'issueOrPullRequest': issue}},
+      fetch_likes=False)
+    self.mox.ReplayAll()
+
+    acts = self.gh.get_activities(etag='Thu, 25 Oct 2012 15:16:27 GMT',
+                                  fetch_replies=True, use_graphql=True)
+    self.assertEqual(2, len(acts))
+    self.assertEqual('pull-request', acts[0]['objectType'])
+    self.assertEqual([{'url': 'https://github.com/foo/bar/tree/main'}],
+                     acts[0]['inReplyTo'])
+    self.assertEqual(0, acts[0]['replies']['totalItems'])
+    self.assertEqual(1, acts[1]['replies']['totalItems'])
+
+  def test_get_activities_graphql_forbidden_subject(self):
+    self.expect_rest(REST_NOTIFICATIONS,
+                     [NOTIFICATION_PULL_REST, NOTIFICATION_ISSUE_REST])
+    self.expect_graphql_issues_or_prs(
+      [(0, ('foo', 'bar', 123)), (1, ('foo', 'baz', 456))], {
+        'subject0': {'issueOrPullRequest': None},
+        'subject1': {'issueOrPullRequest': ISSUE_GRAPHQL},
+      }, fetch_replies=False, fetch_likes=False, errors=[{
+        'type': 'FORBIDDEN',
+        'message': 'Resource not accessible by integration',
+        'path': ['subject0', 'issueOrPullRequest'],
+      }])
+    self.mox.ReplayAll()
+
+    acts = self.gh.get_activities(use_graphql=True)
+    self.assertEqual([ISSUE_GRAPHQL['url']], [a['url'] for a in acts])
+
+  def test_get_activities_graphql_error(self):
+    self.expect_rest(REST_NOTIFICATIONS, [NOTIFICATION_ISSUE_REST])
+    self.expect_graphql_issues_or_prs(
+      [(0, ('foo', 'baz', 456))], None, fetch_replies=False, fetch_likes=False,
+      errors=[{'type': 'RATE_LIMITED', 'message': 'slow down'}])
+    self.mox.ReplayAll()
+
+    with self.assertRaises(ValueError):
+      self.gh.get_activities(use_graphql=True)
+
   def test_get_activities_search_not_implemented(self):
     with self.assertRaises(NotImplementedError):
       self.gh.get_activities(search_query='foo')
@@ -680,6 +799,10 @@ class GitHubTest(testutil.TestCase):
     self.assert_equals(REACTION_OBJ,
                        self.gh.reaction_to_object(REACTION_REST, ISSUE_OBJ))
 
+  def test_reaction_to_object_graphql(self):
+    self.assert_equals(REACTION_OBJ,
+                       self.gh.reaction_to_object(REACTION_GRAPHQL, ISSUE_OBJ))
+
   def test_create_comment(self):
     self.expect_requests_post(
       REST_COMMENTS % ('foo', 'bar', 123), headers=EXPECTED_HEADERS,
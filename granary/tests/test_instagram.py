@@ -15,6 +15,7 @@ import requests
 from .. import instagram
 from ..instagram import HTML_BASE_URL, Instagram, HEADERS
 from .. import source
+from . import stub_transport
 
 logger = logging.getLogger(__name__)
 
@@ -1304,8 +1305,11 @@ class InstagramTest(testutil.TestCase):
 
   def setUp(self):
     super(InstagramTest, self).setUp()
+    stub_transport(self)
     self.instagram = Instagram()
     instagram._last_rate_limited = instagram._last_rate_limited_exc = None
+    # refetch posts serially so that mox sees requests in a deterministic order
+    self.mox.stubs.Set(Instagram, 'MAX_CONCURRENCY', 1)
 
   def expect_requests_get(self, url, resp='', cookie=None, **kwargs):
     kwargs.setdefault('allow_redirects', False)
@@ -1480,6 +1484,26 @@ class InstagramTest(testutil.TestCase):
       'AIL 789_456': 9,
     }, cache)
 
+  def test_get_activities_scrape_fetch_extras_rate_limited(self):
+    self.expect_requests_get('x/', HTML_PROFILE_COMPLETE, cookie='kuky')
+    self.expect_requests_get('p/ABC123/', status_code=429, cookie='kuky')
+    # shouldn't refetch p/XYZ789/ after that
+    self.mox.ReplayAll()
+
+    # should return the partial results instead of raising
+    cache = {}
+    self.assert_equals(HTML_ACTIVITIES, self.instagram.get_activities(
+      user_id='x', group_id=source.SELF, fetch_likes=True, fetch_replies=True,
+      scrape=True, cache=cache, cookie='kuky'))
+    self.assertEqual({}, cache)
+
+    # ...but remember the rate limit for next time
+    self.assertIsNotNone(instagram._last_rate_limited)
+    with self.assertRaises(requests.HTTPError) as cm:
+      self.instagram.get_activities(user_id='x', group_id=source.SELF,
+                                    scrape=True, cookie='kuky')
+    self.assertEqual(429, cm.exception.response.status_code)
+
   def test_get_activities_scrape_missing_data(self):
     self.expect_requests_get('x/', """
 <!DOCTYPE html>
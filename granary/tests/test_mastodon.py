@@ -1,6 +1,7 @@
 # coding=utf-8
 """Unit tests for mastodon.py."""
 import copy
+import threading
 
 from oauth_dropins.webutil import testutil, util
 from oauth_dropins.webutil.util import json_dumps, json_loads
@@ -25,6 +26,7 @@ from ..mastodon import (
   API_TIMELINE,
   API_VERIFY_CREDENTIALS,
 )
+from . import stub_transport
 
 def tag_uri(name):
   return util.tag_uri('foo.com', name)
@@ -309,8 +311,11 @@ class MastodonTest(testutil.TestCase):
 
   def setUp(self):
     super(MastodonTest, self).setUp()
+    stub_transport(self)
     self.mastodon = mastodon.Mastodon(INSTANCE, user_id=ACCOUNT['id'],
                                       access_token='towkin')
+    # fetch extras serially so that mox sees requests in a deterministic order
+    self.mox.stubs.Set(source.Source, 'MAX_CONCURRENCY', 1)
 
   def expect_get(self, *args, **kwargs):
     return self._expect_api(self.expect_requests_get, *args, **kwargs)
@@ -515,6 +520,29 @@ class MastodonTest(testutil.TestCase):
       self.mastodon.get_activities(fetch_replies=True, fetch_shares=True,
                                    fetch_likes=True, cache=cache)
 
+  def test_get_activities_fetch_extras_concurrently(self):
+    # likes and shares are fetched in separate threads, and they both have to
+    # be in flight at once to get past the barrier
+    barrier = threading.Barrier(2, timeout=5)
+    def fake_get(path, **kwargs):
+      if path == API_TIMELINE:
+        return [STATUS_WITH_COUNTS]
+      barrier.wait()
+      return [ACCOUNT]
+
+    m = mastodon.Mastodon(INSTANCE, user_id=ACCOUNT['id'],
+                          access_token='towkin', max_concurrency=2)
+    self.assertEqual(2, m.MAX_CONCURRENCY)
+    self.mox.stubs.Set(m, '_get', fake_get)
+
+    cache = {}
+    expected = copy.deepcopy(ACTIVITY)
+    expected['object']['tags'].extend([LIKE, SHARE])
+    self.assert_equals([expected], m.get_activities(
+      fetch_likes=True, fetch_shares=True, cache=cache))
+    self.assertEqual(2, cache['AMF 123'])
+    self.assertEqual(3, cache['AMRB 123'])
+
   def test_get_activities_returns_non_json(self):
     self.expect_get(API_TIMELINE, params={}, response='<html>',
                     content_type='text/html')
@@ -0,0 +1,140 @@
+# coding=utf-8
+"""Unit tests for mf2_lxml.py.
+
+Most tests check that the output matches mf2py's, via
+:func:`oauth_dropins.webutil.util.parse_mf2`.
+"""
+import glob
+import os
+
+from oauth_dropins.webutil import testutil, util
+import requests
+
+from .. import mf2_lxml
+
+TESTDATA = os.path.join(os.path.dirname(__file__), 'testdata')
+
+BACKCOMPAT = """\
+<html><head><base href="/base/"><link rel="alternate" type="application/rss+xml" href="/feed" title="RSS"></head>
+<body>
+<div class="hfeed">
+ <span class="author vcard"><a class="fn url" href="/me">Me  Myself</a><img class="photo" src="me.jpg" alt=""></span>
+ <div class="hentry">
+  <h2 class="entry-title"><a href="/p/1" rel="bookmark">First   post</a></h2>
+  <abbr class="published" title="2020-01-02T03:04:05Z">Jan 2</abbr>
+  <span class="updated"><span class="value">2020-01-03</span> <span class="value">4:05pm</span></span>
+  <div class="entry-content">Hello <b>world</b> &amp; <template><p>hidden</p></template> friends<br>
+   <a rel="tag" href="/tags/foo%20bar/">foo bar</a> <a rel="tag nofollow" href="/tags/baz">baz</a>
+   <div class="h-card p-author"><span class="p-name">Inner</span></div>
+   <pre>  keep
+    this   </pre>
+   <script>var x = "<b>";</script>
+  </div>
+  <div class="entry-summary">Sum<!-- c --> mary</div>
+  <span class="vcard author"><span class="fn">Bob</span></span>
+ </div>
+</div>
+<div class="vevent"><span class="summary">Party</span><span class="dtstart">2020-05-01</span><span class="location vcard"><span class="fn org">Place</span></span></div>
+<div class="hreview"><span class="item"><span class="fn">Thing</span></span><span class="rating">5</span><div class="description">Great <i>stuff</i></div></div>
+</body></html>
+"""
+
+MF2 = """\
+<!DOCTYPE html>
+<html><head><meta charset="utf-8">
+<link rel="webmention" href="https://wm.io/x"><link rel="alternate feed" href="/b" hreflang="en">
+</head><body>
+<div class="h-feed" id="feed"><h1 class="p-name">Feed   name</h1>
+<article class="h-entry" id="entry">
+ <a class="u-url" href="/p/1"><time class="dt-published" datetime="2020-01-01T10:00:00-0800">Jan</time></a>
+ <time class="dt-updated">10:30pm</time>
+ <span class="dt-start"><span class="value">2020-123</span> <span class="value">12:00 a.m.</span><span class="value">Z</span></span>
+ <span class="p-summary"><span class="value">A</span><span class="value-title" title="B"></span>C</span>
+ <div class="e-content"><p>Para  one
+ with   <a href="rel">link</a></p><p>Para two<img src="i.png" alt="an image"><img src="j.png"></p>
+ <textarea>  raw   text </textarea><template>t</template>tail &lt;x&gt; "q" 'a'
+ <meta charset="latin1"><span title='He said "hi"'>x</span><span data-x='both " and &apos;'>z</span>
+ </div>
+ <a class="p-author h-card" href="/me"><img src="me.png" alt="Me"></a>
+ <a class="u-in-reply-to h-cite" href="https://other/post"><span class="p-name">Other</span></a>
+ <data class="p-rating" value="4">four</data><abbr class="p-org" title="Org">O</abbr>
+ <img class="u-photo" src="/photo.jpg" alt="P"><video class="u-video" src="v.mp4" poster="p.jpg"></video>
+ <map><area class="h-card" href="/area" alt="Area" shape="rect" coords="0,0,1,1"></map>
+ <div class="h-card"><span><img src="deep.png"></span></div>
+ <ruby>漢<rt>kan</rt></ruby>
+</article>
+</div>
+<a rel="me" href="https://twitter.com/x">  Twitter
+  link </a>
+</body></html>
+"""
+
+
+class Mf2LxmlTest(testutil.TestCase):
+
+  def assert_same(self, input, **kwargs):
+    expected = util.parse_mf2(input, **kwargs)
+    self.assertEqual(expected, mf2_lxml.parse(input, **kwargs))
+    return expected
+
+  def test_testdata(self):
+    files = glob.glob(os.path.join(TESTDATA, '*.mf2.html'))
+    self.assertGreater(len(files), 0)
+    for filename in files:
+      with self.subTest(os.path.basename(filename)), open(filename) as f:
+        self.assert_same(f.read(), url='http://site/post')
+
+  def test_backcompat(self):
+    parsed = self.assert_same(BACKCOMPAT, url='http://site/')
+    self.assertEqual(['h-feed'], parsed['items'][0]['type'])
+
+  def test_mf2(self):
+    parsed = self.assert_same(MF2, url='http://site/')
+    self.assertEqual(['https://twitter.com/x'], parsed['rels']['me'])
+
+  def test_id(self):
+    self.assert_same(MF2, url='http://site/', id='entry')
+    self.assert_same(MF2, url='http://site/', id='feed')
+    self.assertIsNone(mf2_lxml.parse(MF2, id='missing'))
+
+  def test_bytes(self):
+    self.assert_same(MF2.encode('utf-8'), url='http://site/')
+    self.assert_same('<html><head><meta charset="iso-8859-1"></head><body>'
+                     '<p class="h-card">caf\xe9</p></body></html>'.encode('latin-1'))
+
+  def test_response(self):
+    resp = requests.Response()
+    resp._content = MF2.encode('utf-8')
+    resp._content_consumed = True
+    resp.url = 'http://site/post'
+    resp.headers['content-type'] = 'text/html; charset=utf-8'
+    self.assert_same(resp)
+
+  def test_whitespace(self):
+    self.assert_same("""
+<div class="h-entry">
+  <p class="p-name">
+     Spaced     out
+     name   </p>
+  <div class="e-content">
+
+    <p>
+      one
+    </p>
+
+    <pre>
+ pre
+   formatted
+</pre>
+  text   <em> em </em>   more
+  &nbsp; nbsp
+  </div>
+</div>
+<div class="h-card">   <img src="x.png" alt="alt text">  </div>
+<div class="h-card"><p>a</p><p>b</p>c<br>d</div>
+""")
+
+  def test_empty(self):
+    for input in '', '   ', 'just text':
+      with self.subTest(input):
+        self.assert_same(input)
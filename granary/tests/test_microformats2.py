@@ -6,11 +6,14 @@ for full testdata tests.
 """
 import copy
 import re
+import subprocess
+import sys
 
-from oauth_dropins.webutil import testutil
+import mf2util
+from oauth_dropins.webutil import testutil, util
 import mf2py
 
-from .. import microformats2
+from .. import microformats2, mf2_lxml
 
 
 class Microformats2Test(testutil.TestCase):
@@ -150,6 +153,31 @@ class Microformats2Test(testutil.TestCase):
                {'value': 'http://6'}],
     }))
 
+  def test_object_to_json_no_empty_values(self):
+    # trim_nulls=False is deprecated and ignored
+    with self.assertWarns(DeprecationWarning):
+      self.assertEqual({
+        'type': ['h-entry'],
+        'properties': {
+          'uid': ['tag:a'],
+          'author': [{'type': ['h-card'], 'properties': {'name': ['Alice']}}],
+          'comment': [{'type': ['h-cite'], 'properties': {'content': ['hi']}}],
+          'content': ['foo'],
+          'category': ['x'],
+        },
+      }, microformats2.object_to_json({
+        'id': 'tag:a',
+        'objectType': 'note',
+        'displayName': '',
+        'content': 'foo',
+        'published': None,
+        'author': {'displayName': 'Alice', 'image': [], 'url': None},
+        'replies': {'items': [{'content': 'hi', 'author': {}}, {}, None]},
+        'tags': [{'objectType': 'hashtag', 'displayName': 'x'},
+                 {'objectType': 'hashtag'}],
+        'upstreamDuplicates': ['', None],
+      }, trim_nulls=False))
+
   def test_object_to_html_note_with_in_reply_to(self):
     expected = """\
 <article class="h-entry">
@@ -398,6 +426,42 @@ Shared <a href="#">a post</a> by foo
           'url': 'https://twitter.com/itsmaeril',
         }]}))
 
+  def test_render_cache_scope(self):
+    obj = {'content': 'foo'}
+    self.assertIsNone(microformats2.render_cache.get())
+
+    with microformats2.render_cache_scope():
+      self.assertEqual('foo', microformats2.render_content(obj))
+      obj['content'] = 'bar'
+      # same object and flags
+      self.assertEqual('foo', microformats2.render_content(obj))
+      # different flags, different object
+      self.assertEqual('bar', microformats2.render_content(obj, render_image=True))
+      self.assertEqual('bar', microformats2.render_content({'content': 'bar'}))
+
+      with microformats2.render_cache_scope():
+        self.assertEqual('foo', microformats2.render_content(obj))
+
+    self.assertIsNone(microformats2.render_cache.get())
+    self.assertEqual('bar', microformats2.render_content(obj))
+
+  def test_object_to_json_renders_share_target_once(self):
+    rendered = []
+    def render(obj, **kwargs):
+      rendered.append(obj)
+      return orig_render(obj, **kwargs)
+
+    orig_render = microformats2._render_content
+    self.mox.stubs.Set(microformats2, '_render_content', render)
+
+    target = {'content': 'foo', 'url': 'http://orig'}
+    share = {'objectType': 'activity', 'verb': 'share', 'object': target}
+    got = microformats2.object_to_json(share)
+    self.assertEqual(['foo'],
+                     got['properties']['repost-of'][0]['properties']['content'])
+    self.assertEqual(1, rendered.count(target))
+    self.assertIsNone(microformats2.render_cache.get())
+
   def test_escape_html_attribute_values(self):
     obj = {
       'author': {
@@ -880,6 +944,93 @@ Shared <a href="#">a post</a> by   <span class="h-card">
   'actor': {'url': 'http://localhost:3000/users/ryan'},
 }]), ignore_blanks=True)
 
+  def test_parsed_to_activities(self):
+    html = """\
+<div class="h-feed">
+  <p class="p-name">My feed</p>
+  <article class="h-entry">
+    <p class="e-content">foo</p>
+    <a class="u-url" href="http://a/1"></a>
+  </article>
+  <article class="h-entry">
+    <a class="p-author h-card" href="http://alice">Alice</a>
+    <p class="e-content">bar</p>
+  </article>
+  <div class="h-card">not an entry</div>
+</div>
+<a rel="author" href="http://bob"></a>
+"""
+    parsed = util.parse_mf2(html, url='http://a/')
+    fetch = lambda url: {'items': [{'type': ['h-card'], 'properties': {
+      'name': ['Bob'], 'url': ['http://bob'],
+    }}]}
+
+    feed = microformats2.parsed_to_activities(parsed, fetch_mf2_func=fetch)
+    actor = microformats2.find_author(parsed, fetch_mf2_func=fetch)
+    self.assert_equals({
+      'displayName': 'Bob',
+      'url': 'http://bob',
+      'image': {'url': None},
+    }, actor)
+    self.assert_equals(actor, feed['actor'])
+    self.assert_equals(microformats2.get_title(parsed), feed['title'])
+    self.assert_equals('My feed', feed['title'])
+    self.assert_equals(mf2util.find_first_entry(parsed, ['h-feed']), feed['hfeed'])
+    self.assert_equals(
+      microformats2.html_to_activities(html, url='http://a/', actor=actor),
+      feed['activities'])
+    first, second = feed['activities']
+    self.assert_equals('Bob', first['object']['author']['displayName'])
+    self.assert_equals('Alice', second['object']['author']['displayName'])
+
+  def test_parsed_to_activities_no_entries(self):
+    parsed = util.parse_mf2('<div class="h-card">Alice</div>')
+    self.assert_equals({
+      'activities': [],
+      'actor': None,
+      'title': '',
+      'hfeed': None,
+    }, microformats2.parsed_to_activities(parsed))
+
+  def test_parse_mf2_backend(self):
+    html = '<div class="h-card"><a class="p-name u-url" href="/me">Me</a></div>'
+    expected = util.parse_mf2(html, url='http://a/')
+    self.assert_equals(expected, microformats2.parse_mf2(html, url='http://a/'))
+    self.assert_equals(expected, microformats2.parse_mf2(
+      html, url='http://a/', backend='lxml'))
+
+    self.mox.StubOutWithMock(mf2_lxml, 'parse')
+    mf2_lxml.parse(html, url='http://a/', id=None).AndReturn('x')
+    self.mox.ReplayAll()
+
+    self.mox.stubs.Set(microformats2, 'mf2_backend', 'lxml')
+    self.assertEqual('x', microformats2.parse_mf2(html, url='http://a/'))
+    self.assert_equals(expected, microformats2.parse_mf2(
+      html, url='http://a/', backend='mf2py'))
+
+    with self.assertRaises(ValueError):
+      microformats2.parse_mf2(html, backend='nope')
+
+  def test_import_doesnt_need_lxml_backend(self):
+    code = ('import sys; import granary.microformats2; '
+            'print("granary.mf2_lxml" in sys.modules)')
+    out = subprocess.run([sys.executable, '-c', code], check=True,
+                         capture_output=True, text=True).stdout
+    self.assertEqual('False', out.strip())
+
+  def test_activities_to_html_iter(self):
+    activities = [
+      {'object': {'content': 'foo', 'url': 'http://a/1'}},
+      {'object': {'content': 'bar', 'url': 'http://a/2'}},
+    ]
+    chunks = list(microformats2.activities_to_html_iter(
+      activities, extra='<p>x</p>', body_class='h-feed'))
+    self.assertEqual(5, len(chunks))
+    self.assertIn('http://a/1', chunks[1])
+    self.assertIn('http://a/2', chunks[3])
+    self.assert_equals(microformats2.activities_to_html(
+      activities, extra='<p>x</p>', body_class='h-feed'), ''.join(chunks))
+
   def test_combined_reply_and_tag_of_error(self):
     """https://github.com/snarfed/bridgy/issues/832"""
     with self.assertRaises(NotImplementedError):
@@ -6,7 +6,7 @@ from oauth_dropins.webutil import testutil, util
 from oauth_dropins.webutil.util import json_dumps, json_loads
 
 from .. import mastodon, pixelfed
-from . import test_mastodon
+from . import stub_transport, test_mastodon
 
 
 ACCOUNT = copy.deepcopy(test_mastodon.ACCOUNT)
@@ -26,6 +26,7 @@ class PixelfedTest(testutil.TestCase):
 
   def setUp(self):
     super(PixelfedTest, self).setUp()
+    stub_transport(self)
     self.pixelfed = pixelfed.Pixelfed(
       test_mastodon.INSTANCE, user_id=ACCOUNT['id'], access_token='towkin')
 
@@ -326,6 +326,34 @@ class RedditTest(testutil.TestCase):
         self.reddit.get_activities(activity_id='ezv3f2', fetch_replies=True, cache=cache))
       self.assert_equals(num_comments, cache['ARR ezv3f2'])
 
+  def test_get_activities_fetch_replies_batch_info(self):
+    other = FakeSubmission(self.redditor)
+    other.id = 'abc123'
+    other.num_comments = 5
+    self.submission_selftext.num_comments = 1
+    comments = CommentForest(self.submission_selftext, comments=[self.comment])
+    self.submission_selftext.comments = comments
+
+    self.api.redditor('plfff').AndReturn(self.redditor)
+    self.redditor.submissions = self.mox.CreateMock(SubListing)
+    self.redditor.submissions.new(limit=None).AndReturn(
+      [self.submission_selftext, other])
+    # one batched lookup for both submissions' comment counts, no individual
+    # submission() calls
+    self.api.info(fullnames=['t3_ezv3f2', 't3_abc123']).AndReturn(
+      [self.submission_selftext, other])
+    # only the submission whose count changed gets its comments fetched
+    self.mox.StubOutWithMock(comments, 'replace_more')
+    comments.replace_more()
+    self.mox.ReplayAll()
+
+    cache = {'ARR abc123': 5}
+    activities = self.reddit.get_activities(user_id='plfff', fetch_replies=True,
+                                            cache=cache)
+    self.assert_equals(ACTIVITY_WITH_COMMENT, activities[0])
+    self.assertNotIn('replies', activities[1]['object'])
+    self.assertEqual(1, cache['ARR ezv3f2'])
+
   def test_get_comment(self):
     self.api.comment(id='xyz').AndReturn(self.comment)
     self.mox.ReplayAll()
@@ -2,10 +2,14 @@
 """Unit tests for source.py.
 """
 import copy
+import http.client
 import re
+import types
 
+from mox3 import mox
 from oauth_dropins.webutil import testutil
 from oauth_dropins.webutil import util
+import requests
 
 from .. import facebook
 from .. import instagram
@@ -353,3 +357,132 @@ Watching  \t waves
     orig = expected = 'trailing slash http://www.foo.co/'
     result = truncate(orig, 'http://www.foo.co/', OMIT_LINK)
     self.assertEqual(expected, result)
+
+  def test_transport_pooled(self):
+    transport = source.Transport(pool_connections=3, pool_maxsize=4, timeout=7)
+    adapter = transport.session.get_adapter('https://foo.com/')
+    self.assertEqual(3, adapter._pool_connections)
+    self.assertEqual(4, adapter._pool_maxsize)
+
+    self.mox.StubOutWithMock(transport.session, 'get')
+    for path in 'a', 'b':
+      transport.session.get(f'https://foo.com/{path}', timeout=7, stream=True,
+                            headers=mox.IgnoreArg()
+                            ).AndReturn(testutil.requests_response('x'))
+    transport.session.get('https://bar.com/', timeout=7, stream=True,
+                          headers=mox.IgnoreArg()
+                          ).AndReturn(testutil.requests_response('', status=503))
+    self.mox.ReplayAll()
+
+    transport.get('https://foo.com/a')
+    transport.get('https://foo.com/b')
+    transport.get('https://bar.com/')
+
+    metrics = transport.metrics()
+    self.assertEqual({'foo.com', 'bar.com'}, set(metrics.keys()))
+    self.assertEqual(2, metrics['foo.com']['requests'])
+    self.assertEqual(0, metrics['foo.com']['errors'])
+    self.assertEqual(1, metrics['bar.com']['requests'])
+    self.assertEqual(1, metrics['bar.com']['errors'])
+
+  def test_transport_not_pooled(self):
+    transport = source.Transport(pooled=False)
+    self.assertIsNone(transport.session)
+
+    self.expect_requests_post('https://foo.com/', 'x', data='y')
+    self.expect_urlopen('https://bar.com/', 'z')
+    self.mox.ReplayAll()
+
+    self.assertEqual('x', transport.post('https://foo.com/', data='y').text)
+    self.assertEqual('z', transport.urlopen('https://bar.com/').read())
+    self.assertEqual(['bar.com', 'foo.com'], sorted(transport.metrics().keys()))
+
+  def test_transport_error_metrics(self):
+    transport = source.Transport(pooled=False)
+    self.expect_requests_get('https://foo.com/').AndRaise(
+      requests.ConnectionError('foo'))
+    self.mox.ReplayAll()
+
+    with self.assertRaises(requests.ConnectionError):
+      transport.get('https://foo.com/')
+    self.assertEqual(1, transport.metrics()['foo.com']['errors'])
+
+  def test_transport_doesnt_store_cookies(self):
+    sent = []
+
+    class CookieAdapter(requests.adapters.BaseAdapter):
+      """Records each request's Cookie header and responds with Set-Cookie."""
+      def send(self, request, **kwargs):
+        sent.append(request.headers.get('Cookie'))
+        headers = http.client.HTTPMessage()
+        headers['Set-Cookie'] = 'session=secret; Path=/'
+        resp = requests.Response()
+        resp.status_code = 200
+        resp.url = request.url
+        resp.request = request
+        resp.headers = requests.structures.CaseInsensitiveDict(headers)
+        resp.raw = types.SimpleNamespace(
+          _original_response=types.SimpleNamespace(msg=headers))
+        resp._content = b''
+        return resp
+
+      def close(self):
+        pass
+
+    transport = source.Transport()
+    transport.session.mount('https://', CookieAdapter())
+
+    transport.get('https://foo.com/a')
+    transport.get('https://foo.com/b')
+    transport.get('https://bar.com/')
+    self.assertEqual([None, None, None], sent)
+    self.assertEqual(0, len(transport.session.cookies))
+
+  def test_transport_metrics_max_hosts(self):
+    self.mox.stubs.Set(source, 'METRICS_MAX_HOSTS', 2)
+    transport = source.Transport(pooled=False)
+    for host in 'a', 'b', 'a', 'c':
+      self.expect_requests_get(f'https://{host}/')
+    self.mox.ReplayAll()
+
+    for host in 'a', 'b', 'a', 'c':
+      transport.get(f'https://{host}/')
+
+    metrics = transport.metrics()
+    self.assertEqual(['a', 'c'], list(metrics.keys()))
+    self.assertEqual(2, metrics['a']['requests'])
+
+  def test_transport_upstream_stats(self):
+    transport = source.Transport(pooled=False)
+    self.expect_requests_get('https://foo.com/', 'xyz')
+    self.expect_requests_get('https://bar.com/', status_code=404,
+                             response_headers={'Content-Length': '10'})
+    self.mox.ReplayAll()
+
+    stats = source.UpstreamStats()
+    token = source.upstream_stats.set(stats)
+    try:
+      transport.get('https://foo.com/')
+      transport.get('https://bar.com/')
+    finally:
+      source.upstream_stats.reset(token)
+
+    self.assertEqual(2, stats.requests)
+    self.assertEqual(1, stats.errors)
+    self.assertEqual(13, stats.bytes)
+    self.assertGreater(stats.seconds, 0)
+
+  def test_concurrent_map_copies_context(self):
+    stats = source.UpstreamStats()
+    token = source.upstream_stats.set(stats)
+    try:
+      got = source.concurrent_map(lambda x: (x, source.upstream_stats.get()),
+                                  [1, 2, 3], max_workers=3)
+    finally:
+      source.upstream_stats.reset(token)
+
+    self.assertEqual([(1, stats), (2, stats), (3, stats)], got)
+
+  def test_source_transport_default(self):
+    self.assertIs(source.transport, Source.transport)
+    self.assertIs(source.transport, self.source.transport)
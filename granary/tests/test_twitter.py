@@ -5,6 +5,7 @@ from collections import OrderedDict
 import copy
 import http.client
 import socket
+import threading
 import urllib.parse
 
 from mox3 import mox
@@ -34,6 +35,7 @@ from ..twitter import (
   SCRAPE_LIKES_URL,
   Twitter,
 )
+from . import stub_transport
 
 # test data
 def tag_uri(name):
@@ -692,9 +694,12 @@ class TwitterTest(testutil.TestCase):
 
   def setUp(self):
     super(TwitterTest, self).setUp()
+    stub_transport(self)
     self.maxDiff = None
     twitter_auth.TWITTER_APP_KEY = 'fake'
     twitter_auth.TWITTER_APP_SECRET = 'fake'
+    # make HTTP requests serially so that mox sees them in a deterministic order
+    self.mox.stubs.Set(source.Source, 'MAX_CONCURRENCY', 1)
     self.twitter = twitter.Twitter('key', 'secret')
 
   def expect_urlopen(self, url, response=None, params=None, **kwargs):
@@ -861,6 +866,36 @@ class TwitterTest(testutil.TestCase):
     self.assert_equals([ACTIVITY_WITH_REPLIES],
                           self.twitter.get_activities(fetch_replies=True, min_id='567'))
 
+  def test_get_activities_fetch_replies_shares_searches(self):
+    other = {**copy.deepcopy(TWEET), 'id_str': '999'}
+    self.expect_urlopen(TIMELINE, [TWEET, other])
+
+    # each author should only be searched once, even across activities
+    search = API_SEARCH
+    self.expect_urlopen(search % {'q': '%40snarfed_org', 'count': 100},
+                        REPLIES_TO_SNARFED)
+    self.expect_urlopen(search % {'q': '%40alice', 'count': 100}, REPLIES_TO_ALICE)
+    self.expect_urlopen(search % {'q': '%40bob', 'count': 100}, REPLIES_TO_BOB)
+    self.mox.ReplayAll()
+
+    got = self.twitter.get_activities(fetch_replies=True)
+    self.assert_equals(ACTIVITY_WITH_REPLIES['object']['replies'],
+                       got[0]['object']['replies'])
+    self.assert_equals({'items': [], 'totalItems': 0}, got[1]['object']['replies'])
+
+  def test_get_activities_fetch_replies_search_limit(self):
+    self.mox.stubs.Set(twitter, 'REPLY_SEARCH_LIMIT', 2)
+    self.expect_urlopen(TIMELINE, [TWEET])
+    self.expect_urlopen(API_SEARCH % {'q': '%40snarfed_org', 'count': 100},
+                        REPLIES_TO_SNARFED)
+    self.expect_urlopen(API_SEARCH % {'q': '%40alice', 'count': 100},
+                        REPLIES_TO_ALICE)
+    # no search for @bob
+    self.mox.ReplayAll()
+
+    self.assert_equals([ACTIVITY_WITH_REPLIES],
+                       self.twitter.get_activities(fetch_replies=True))
+
   def test_get_activities_fetch_mentions(self):
     self.expect_urlopen(TIMELINE, [])
     self.expect_urlopen('account/verify_credentials.json',
@@ -1087,6 +1122,41 @@ class TwitterTest(testutil.TestCase):
     self.mox.ReplayAll()
     self.twitter.get_activities(fetch_shares=True)
 
+  def test_get_activities_fetch_shares_and_likes_concurrently(self):
+    tweets = [{**copy.deepcopy(TWEET), 'id_str': str(i), 'retweet_count': 1,
+               'favorite_count': 1} for i in (1, 2)]
+
+    # each fetch blocks until the other one is in flight too
+    retweets_barrier = threading.Barrier(2, timeout=5)
+    likes_barrier = threading.Barrier(2, timeout=5)
+
+    def urlopen(url, parse_response=True, **kwargs):
+      if not parse_response:
+        return testutil.UrlopenResult(200, json_dumps(tweets))
+      retweets_barrier.wait()
+      return RETWEETS
+
+    def requests_get(url, **kwargs):
+      likes_barrier.wait()
+      return testutil.requests_response(LIKES_SCRAPED)
+
+    self.twitter = twitter.Twitter('key', 'secret', scrape_headers={'x': 'y'})
+    self.twitter.MAX_CONCURRENCY = 2
+    self.mox.stubs.Set(self.twitter, 'urlopen', urlopen)
+    self.mox.stubs.Set(self.twitter.transport, 'get', requests_get)
+
+    cache = {}
+    activities = self.twitter.get_activities(
+      fetch_shares=True, fetch_likes=True, cache=cache)
+
+    self.assertEqual({'ATR 1': 1, 'ATR 2': 1, 'ATF 1': 1, 'ATF 2': 1}, cache)
+    for activity in activities:
+      tags = activity['object']['tags']
+      self.assertEqual(
+        ['share'] * len(RETWEETS) +
+        ['like'] * len(LIKES_SCRAPED['globalObjects']['users']),
+        [t['verb'] for t in tags if t.get('verb')])
+
   def test_get_activities_request_etag(self):
     self.expect_urlopen(TIMELINE, [], headers={'If-none-match': '"my etag"'})
     self.mox.ReplayAll()
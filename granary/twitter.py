@@ -66,6 +66,10 @@ HTTP_RATE_LIMIT_CODES = (429, 503)
 # TODO: sigh. figure out a better way. dammit twitter, give me a batch API!!!
 RETWEET_LIMIT = 15
 
+# Don't search for @-mentions more than this many times per fetch_replies() call.
+# https://developer.twitter.com/en/docs/twitter-api/v1/rate-limits
+REPLY_SEARCH_LIMIT = 50
+
 # Number of IDs to search for at a time
 QUOTE_SEARCH_BATCH_SIZE = 20
 
@@ -227,6 +231,9 @@ class Twitter(source.Source):
     Shares (ie retweets) are fetched with a separate API call per tweet:
     https://dev.twitter.com/docs/api/1.1/get/statuses/retweets/%3Aid
 
+    Likes and retweets are fetched concurrently, up to :attr:`MAX_CONCURRENCY`
+    requests at a time.
+
     However, retweets are only fetched for the first 15 tweets that have them,
     since that's Twitter's rate limit per 15 minute window. :(
     https://dev.twitter.com/docs/rate-limiting/1.1/limits
@@ -344,7 +351,9 @@ class Twitter(source.Source):
       cache = {}
 
     if fetch_shares:
-      retweet_calls = 0
+      # pick which tweets to fetch retweets for first, so that we stay within
+      # RETWEET_LIMIT, then fetch them all at once.
+      to_fetch = []
       for tweet in tweets:
         # don't fetch retweets if the tweet is itself a retweet or if the
         # author's account is protected. /statuses/retweets 403s with error
@@ -352,43 +361,44 @@ class Twitter(source.Source):
         # https://github.com/snarfed/bridgy/issues/688
         if tweet.get('retweeted') or tweet.get('user', {}).get('protected'):
           continue
-        elif retweet_calls >= RETWEET_LIMIT:
+        elif len(to_fetch) >= RETWEET_LIMIT:
           logger.warning(f"Hit Twitter's retweet rate limit ({RETWEET_LIMIT}) with more to fetch! Results will be incomplete!")
           break
 
-        # store retweets in the 'retweets' field, which is handled by
-        # tweet_to_activity().
-        # TODO: make these HTTP requests asynchronous. not easy since we don't
-        # (yet) require threading support or use a non-blocking HTTP library.
-        #
         # twitter limits this API endpoint to one call per minute per user,
         # which is easy to hit, so we stop before we hit that.
         # https://dev.twitter.com/docs/rate-limiting/1.1/limits
         #
         # can't use the statuses/retweets_of_me endpoint because it only
         # returns the original tweets, not the retweets or their authors.
-        id = tweet['id_str']
         count = tweet.get('retweet_count')
-        if count and count != cache.get('ATR ' + id):
-          url = API_RETWEETS % id
-          if min_id is not None:
-            url = util.add_query_params(url, {'since_id': min_id})
+        if count and count != cache.get('ATR ' + tweet['id_str']):
+          to_fetch.append(tweet)
+
+      def fetch_retweets(tweet):
+        # store retweets in the 'retweets' field, which is handled by
+        # tweet_to_activity().
+        id = tweet['id_str']
+        url = API_RETWEETS % id
+        if min_id is not None:
+          url = util.add_query_params(url, {'since_id': min_id})
 
+        try:
+          tweet['retweets'] = self.urlopen(url)
+        except urllib.error.URLError as e:
+          code, body = util.interpret_http_exception(e)
           try:
-            tweet['retweets'] = self.urlopen(url)
-          except urllib.error.URLError as e:
-            code, body = util.interpret_http_exception(e)
-            try:
-              # duplicates code in interpret_http_exception :(
-              error_code = json_loads(body).get('errors')[0].get('code')
-            except BaseException:
-              error_code = None
-            if not (code == '404' or  # tweet was deleted
-                    (code == '403' and error_code == 200)):  # tweet is protected?
-              raise
-
-          retweet_calls += 1
-          cache['ATR ' + id] = count
+            # duplicates code in interpret_http_exception :(
+            error_code = json_loads(body).get('errors')[0].get('code')
+          except BaseException:
+            error_code = None
+          if not (code == '404' or  # tweet was deleted
+                  (code == '403' and error_code == 200)):  # tweet is protected?
+            raise
+
+        cache['ATR ' + id] = tweet.get('retweet_count')
+
+      source.concurrent_map(fetch_retweets, to_fetch, self.MAX_CONCURRENCY)
 
     if not include_shares:
       tweets = [t for t in tweets if not t.get('retweeted_status')]
@@ -406,22 +416,27 @@ class Twitter(source.Source):
       tweet_activities += [self.tweet_to_activity(m) for m in mentions]
 
     if fetch_likes:
-      for tweet, activity in zip(tweets, tweet_activities):
+      def scrape_likes(tweet_and_activity):
+        tweet, activity = tweet_and_activity
         id = tweet['id_str']
-        count = tweet.get('favorite_count')
-        if as1.is_public(activity) and count and count != cache.get('ATF ' + id):
-          try:
-            resp = util.requests_get(SCRAPE_LIKES_URL % id,
-                                     headers=self.scrape_headers)
-            resp.raise_for_status()
-          except RequestException as e:
-            util.interpret_http_exception(e)  # just log it
-            continue
-
-          likes = [self._make_like(tweet, author) for author in
-                   resp.json().get('globalObjects', {}).get('users', {}).values()]
-          activity['object'].setdefault('tags', []).extend(likes)
-          cache['ATF ' + id] = count
+        try:
+          resp = self.transport.get(SCRAPE_LIKES_URL % id,
+                                    headers=self.scrape_headers)
+          resp.raise_for_status()
+        except RequestException as e:
+          util.interpret_http_exception(e)  # just log it
+          return
+
+        likes = [self._make_like(tweet, author) for author in
+                 resp.json().get('globalObjects', {}).get('users', {}).values()]
+        activity['object'].setdefault('tags', []).extend(likes)
+        cache['ATF ' + id] = tweet.get('favorite_count')
+
+      to_fetch = [
+        (tweet, activity) for tweet, activity in zip(tweets, tweet_activities)
+        if (as1.is_public(activity) and tweet.get('favorite_count') and
+            tweet.get('favorite_count') != cache.get('ATF ' + tweet['id_str']))]
+      source.concurrent_map(scrape_likes, to_fetch, self.MAX_CONCURRENCY)
 
     activities += tweet_activities
     response = self.make_activities_base_response(activities)
@@ -433,62 +448,89 @@ class Twitter(source.Source):
 
     Includes indirect replies ie reply chains, not just direct replies. Searches
     for @-mentions, matches them to the original tweets with
-    in_reply_to_status_id_str, and recurses until it's walked the entire tree.
+    in_reply_to_status_id_str, and walks the reply trees breadth first until
+    it's walked them all.
+
+    Each level of the walk searches for all of its new authors at once,
+    concurrently. Searches are shared across all activities, and limited to
+    :const:`REPLY_SEARCH_LIMIT` per call.
 
     Args:
       activities: list of activity dicts
+      min_id: only return replies with ids greater than this
 
     Returns:
       same activities list
     """
-
-    # cache searches for @-mentions for individual users. maps username to dict
-    # mapping tweet id to ActivityStreams reply object dict.
+    # cache searches for @-mentions for individual users. maps username to list
+    # of Twitter API tweet objects that mention them.
     mentions = {}
 
-    # find replies
+    # reply trees, one per activity. each has a list of ActivityStreams reply
+    # object dicts, a set of seen tweet ids, and the current level's frontier.
+    # seed with the original tweet; we'll filter it out later.
+    trees = []
     for activity in activities:
-      # list of ActivityStreams reply object dict and set of seen activity ids
-      # (tag URIs). seed with the original tweet; we'll filter it out later.
-      replies = [activity]
       _, id = util.parse_tag_uri(activity['id'])
-      seen_ids = set([id])
+      trees.append({
+        'replies': [activity],
+        'seen_ids': set([id]),
+        'frontier': [activity],
+      })
 
-      for reply in replies:
-        # get mentions of this tweet's author so we can search them for replies to
-        # this tweet. can't use statuses/mentions_timeline because i'd need to
-        # auth as the user being mentioned.
-        # https://dev.twitter.com/docs/api/1.1/get/statuses/mentions_timeline
-        #
-        # note that these HTTP requests are synchronous. you can make async
-        # requests by using urlfetch.fetch() directly, but not with urllib2.
-        # https://developers.google.com/appengine/docs/python/urlfetch/asynchronousrequests
-        author = reply['actor']['username']
-        if author not in mentions:
-          url = API_SEARCH % {
-            'q': urllib.parse.quote_plus('@' + author),
-            'count': 100,
-          }
-          if min_id is not None:
-            url = util.add_query_params(url, {'since_id': min_id})
-          mentions[author] = self.urlopen(url)['statuses']
-
-        # look for replies. add any we find to the end of replies. this makes us
-        # recursively follow reply chains to their end. (python supports
-        # appending to a sequence while you're iterating over it.)
-        for mention in mentions[author]:
-          id = mention['id_str']
-          if (mention.get('in_reply_to_status_id_str') in seen_ids and
-              id not in seen_ids):
-            replies.append(self.tweet_to_activity(mention))
-            seen_ids.add(id)
-
-      items = [r['object'] for r in replies[1:]]  # filter out seed activity
+    def search(author):
+      # get mentions of this author so we can search them for replies to their
+      # tweets. can't use statuses/mentions_timeline because i'd need to auth
+      # as the user being mentioned.
+      # https://dev.twitter.com/docs/api/1.1/get/statuses/mentions_timeline
+      url = API_SEARCH % {
+        'q': urllib.parse.quote_plus('@' + author),
+        'count': 100,
+      }
+      if min_id is not None:
+        url = util.add_query_params(url, {'since_id': min_id})
+      return self.urlopen(url)['statuses']
+
+    while any(tree['frontier'] for tree in trees):
+      # search for every author in this level that we haven't searched yet
+      authors = []
+      for tree in trees:
+        for reply in tree['frontier']:
+          author = reply['actor']['username']
+          if author not in mentions and author not in authors:
+            authors.append(author)
+
+      remaining = REPLY_SEARCH_LIMIT - len(mentions)
+      if len(authors) > remaining:
+        logger.warning(f"Hit reply search limit ({REPLY_SEARCH_LIMIT}) with more to fetch! Results will be incomplete!")
+        authors = authors[:remaining]
+
+      results = source.concurrent_map(search, authors, self.MAX_CONCURRENCY)
+      mentions.update(zip(authors, results))
+
+      # look for replies. they make up the next level's frontier.
+      for tree in trees:
+        seen_ids = tree['seen_ids']
+        next_frontier = []
+        for reply in tree['frontier']:
+          for mention in mentions.get(reply['actor']['username'], []):
+            id = mention['id_str']
+            if (mention.get('in_reply_to_status_id_str') in seen_ids and
+                id not in seen_ids):
+              next_frontier.append(self.tweet_to_activity(mention))
+              seen_ids.add(id)
+        tree['replies'].extend(next_frontier)
+        tree['frontier'] = next_frontier
+
+    for activity, tree in zip(activities, trees):
+      items = [r['object'] for r in tree['replies'][1:]]  # filter out seed
       activity['object']['replies'] = {
         'items': items,
         'totalItems': len(items),
       }
 
+    return activities
+
   def fetch_mentions(self, username, tweets, min_id=None):
     """Fetches a user's @-mentions and returns them as ActivityStreams.
 
@@ -909,7 +951,7 @@ class Twitter(source.Source):
       if not url:
         continue
 
-      image_resp = util.urlopen(url)
+      image_resp = self.transport.urlopen(url)
       error = self._check_media(url, image_resp, IMAGE_MIME_TYPES,
                                 'JPG, PNG, GIF, and WEBP images', MAX_IMAGE_SIZE)
       if error:
@@ -917,9 +959,9 @@ class Twitter(source.Source):
 
       headers = twitter_auth.auth_header(
         API_UPLOAD_MEDIA, self.access_token_key, self.access_token_secret, 'POST')
-      resp = util.requests_post(API_UPLOAD_MEDIA,
-                                files={'media': image_resp},
-                                headers=headers)
+      resp = self.transport.post(API_UPLOAD_MEDIA,
+                                 files={'media': image_resp},
+                                 headers=headers)
       resp.raise_for_status()
       logger.info(f'Got: {resp.text}')
       media_id = source.load_json(resp.text, API_UPLOAD_MEDIA)['media_id_string']
@@ -930,7 +972,7 @@ class Twitter(source.Source):
         alt = util.ellipsize(alt, words=1000, chars=MAX_ALT_LENGTH)
         headers = twitter_auth.auth_header(
           API_MEDIA_METADATA, self.access_token_key, self.access_token_secret, 'POST')
-        resp = util.requests_post(
+        resp = self.transport.post(
           API_MEDIA_METADATA,
           json={'media_id': media_id, 'alt_text': {'text': alt}},
           headers=headers)
@@ -956,7 +998,7 @@ class Twitter(source.Source):
     Returns:
       string media id or :class:`CreationResult` on error
     """
-    video_resp = util.urlopen(url)
+    video_resp = self.transport.urlopen(url)
     error = self._check_media(url, video_resp, VIDEO_MIME_TYPES, 'MP4 videos',
                               MAX_VIDEO_SIZE)
     if error:
@@ -984,8 +1026,8 @@ class Twitter(source.Source):
         'media_id': media_id,
         'segment_index': i,
       }
-      resp = util.requests_post(API_UPLOAD_MEDIA, data=data,
-                                files={'media': chunk}, headers=headers)
+      resp = self.transport.post(API_UPLOAD_MEDIA, data=data,
+                                 files={'media': chunk}, headers=headers)
       resp.raise_for_status()
 
       if chunk.ateof:
@@ -38,6 +38,7 @@ setup(name='granary',
       install_requires=[
           'beautifulsoup4>=4.8',
           'brevity>=0.2.17',
+          'cachetools>=3.1',
           'feedgen>=0.9',
           'feedparser',
           'html2text>=2019.8.11',
@@ -49,5 +50,13 @@ setup(name='granary',
           'python-dateutil>=2.8',
           'requests>=2.22',
       ],
+      extras_require={
+          # for microformats2.parse_mf2(backend='lxml'). mf2_lxml ports mf2py's
+          # parser and uses its internal modules, so it's tied to mf2py 1.1.x.
+          'lxml': [
+              'lxml>=4.9',
+              'mf2py>=1.1.2,<1.2',
+          ],
+      },
       tests_require=['mox3>=0.28'],
 )
@@ -78,6 +78,12 @@ class ApiTest(testutil.TestCase):
   def test_all_defaults(self):
     self.check_request('/')
 
+  def test_server_timing(self):
+    resp = self.get_response('/fake/@me/@all/', None, None)
+    self.assertEqual(200, resp.status_code)
+    self.assertRegex(resp.headers['Server-Timing'],
+                     r'^fetch;dur=[0-9.]+, render;dur=[0-9.]+, total;dur=[0-9.]+$')
+
   def test_me(self):
     self.check_request('/@me', None)
 
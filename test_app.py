@@ -1,19 +1,24 @@
 # coding=utf-8
 """Unit tests for app.py.
 """
+import collections
 import copy
+import gzip
 from io import BytesIO
 import os.path
 import socket
+import threading
+import time
 from urllib.parse import quote
 
-from granary import as2
-from granary.tests import test_instagram
+from granary import as2, jsonfeed, microformats2, source
+from granary.tests import stub_transport, test_instagram
 from mox3 import mox
 from oauth_dropins.webutil import testutil, util
 from oauth_dropins.webutil.util import json_dumps, json_loads
 import requests
 
+import app as app_module
 from app import app, cache
 
 client = app.test_client()
@@ -193,6 +198,7 @@ class AppTest(testutil.TestCase):
 
   def setUp(self):
     super(AppTest, self).setUp()
+    stub_transport(self)
     cache.clear()
 
   def expect_requests_get(self, *args, **kwargs):
@@ -693,6 +699,411 @@ not RSS!
     self.assert_equals(200, first.status_code)
     self.assert_equals(first.get_data(), second.get_data())
 
+  def test_url_batch(self):
+    self.mox.stubs.Set(app_module, 'BATCH_MAX_WORKERS', 1)
+    self.expect_requests_get('http://my/posts.json', AS1)
+    self.expect_requests_get('http://my/posts.html',
+                             HTML % {'body_class': '', 'extra': ''})
+    self.mox.ReplayAll()
+
+    resp = client.post('/url/batch?output=mf2-json', json=[
+      {'url': 'http://my/posts.json', 'input': 'as1'},
+      {'url': 'http://my/posts.html', 'input': 'html'},
+    ])
+    self.assert_equals(200, resp.status_code)
+    self.assert_equals('application/x-ndjson', resp.headers['Content-Type'])
+
+    from_html = copy.deepcopy(MF2)
+    for obj in from_html['items']:
+      obj['properties']['name'] = [obj['properties']['content'][0].strip()]
+
+    lines = [json_loads(line) for line in resp.get_data(as_text=True).splitlines()]
+    self.assert_equals([{
+      'url': 'http://my/posts.json',
+      'input': 'as1',
+      'status': 200,
+      'content_type': 'application/mf2+json',
+      'body': MF2,
+    }, {
+      'url': 'http://my/posts.html',
+      'input': 'html',
+      'status': 200,
+      'content_type': 'application/mf2+json',
+      'body': from_html,
+    }], lines)
+
+  def test_url_batch_atom_self_link(self):
+    self.mox.stubs.Set(app_module, 'BATCH_MAX_WORKERS', 1)
+    self.expect_requests_get('http://my/posts.json', AS1)
+    self.mox.ReplayAll()
+
+    resp = client.post('/url/batch?output=atom&hub=http://a/hub', json=[
+      {'url': 'http://my/posts.json', 'input': 'as1'},
+    ])
+    self.assert_equals(200, resp.status_code)
+    line = json_loads(resp.get_data(as_text=True))
+    self.assert_equals(200, line['status'])
+    self.assert_equals('application/atom+xml', line['content_type'])
+    self.assert_multiline_in(
+      '<link rel="self" href="http://localhost/url?url=http%3A%2F%2Fmy%2Fposts.json&amp;input=as1&amp;output=atom&amp;hub=http%3A%2F%2Fa%2Fhub" type="application/atom+xml" />',
+      line['body'])
+
+  def test_url_batch_errors(self):
+    self.mox.stubs.Set(app_module, 'BATCH_MAX_WORKERS', 1)
+    self.expect_requests_get('http://my/posts.json', 'not json')
+    self.expect_requests_get('http://my/down', status_code=503)
+    self.mox.ReplayAll()
+
+    resp = client.post('/url/batch?output=as1', json=[
+      {'url': 'http://my/posts.json', 'input': 'as1'},
+      {'url': 'http://my/posts.html', 'input': 'nope'},
+      {'input': 'html'},
+      {'url': 'http://my/down', 'input': 'html'},
+    ])
+    self.assert_equals(200, resp.status_code)
+    lines = [json_loads(line) for line in resp.get_data(as_text=True).splitlines()]
+    self.assert_equals([
+      ('http://my/posts.json', 400),
+      ('http://my/posts.html', 400),
+      (None, 400),
+      ('http://my/down', 502),
+    ], [(line['url'], line['status']) for line in lines])
+    self.assertIn('Could not decode', lines[0]['error'])
+    self.assertIn('Invalid input: nope', lines[1]['error'])
+    for line in lines:
+      self.assertNotIn('body', line)
+
+  def test_url_batch_bad_request(self):
+    for path, body in (
+        ('/url/batch', {'url': 'http://my/posts.json', 'input': 'as1'}),
+        ('/url/batch', ['http://my/posts.json']),
+        ('/url/batch?output=nope', []),
+    ):
+      resp = client.post(path, json=body)
+      self.assert_equals(400, resp.status_code, body)
+
+    self.mox.stubs.Set(app_module, 'BATCH_MAX_ITEMS', 1)
+    resp = client.post('/url/batch', json=[{}, {}])
+    self.assert_equals(400, resp.status_code)
+
+  def test_url_batch_concurrent(self):
+    barrier = threading.Barrier(2, timeout=5)
+
+    def fetch_as1(url, input, use_cache=True):
+      # both fetches have to be running at once to get past this
+      barrier.wait()
+      return {'activities': AS1, 'actor': None, 'title': None, 'hfeed': None,
+              'url': url}
+
+    self.mox.stubs.Set(app_module, 'fetch_as1', fetch_as1)
+    resp = client.post('/url/batch?output=as1', json=[
+      {'url': 'http://my/a', 'input': 'as1'},
+      {'url': 'http://my/b', 'input': 'as1'},
+    ])
+    self.assert_equals(200, resp.status_code)
+    lines = [json_loads(line) for line in resp.get_data(as_text=True).splitlines()]
+    self.assert_equals({'http://my/a', 'http://my/b'},
+                       {line['url'] for line in lines})
+    for line in lines:
+      self.assert_equals(200, line['status'])
+      self.assert_equals(AS1, line['body']['items'])
+
+  def test_url_batch_timing_and_render_cache(self):
+    caches = []
+    def activities_to_jsonfeed(activities, **kwargs):
+      caches.append(microformats2.render_cache.get())
+      return {}
+
+    self.mox.stubs.Set(jsonfeed, 'activities_to_jsonfeed', activities_to_jsonfeed)
+    self.expect_requests_get('http://my/posts.json', AS1)
+
+    timings = []
+    self.mox.stubs.Set(app_module, 'log_timing',
+                       lambda timer, status: timings.append(timer.to_json()))
+    self.mox.ReplayAll()
+
+    resp = client.post('/url/batch?output=jsonfeed', json=[
+      {'url': 'http://my/posts.json', 'input': 'as1'},
+    ])
+    self.assert_equals(200, resp.status_code)
+    self.assert_equals(200, json_loads(resp.get_data(as_text=True))['status'])
+    self.assertNotIn('Server-Timing', resp.headers)
+    self.assertEqual([{}], caches)
+
+    [timing] = timings
+    self.assertEqual(1, timing['upstream']['requests'])
+    self.assertIn('fetch', timing['phases_ms'])
+    self.assertIn('render', timing['phases_ms'])
+
+  def test_server_timing(self):
+    self.expect_requests_get('http://my/posts.html',
+                             HTML % {'body_class': '', 'extra': ''})
+    self.mox.ReplayAll()
+
+    resp = client.get('/url?url=http://my/posts.html&input=html&output=atom')
+    self.assert_equals(200, resp.status_code)
+
+    timing = resp.headers['Server-Timing']
+    self.assertRegex(timing, r'^fetch;dur=[0-9.]+, parse;dur=[0-9.]+, convert;dur=[0-9.]+, render;dur=[0-9.]+, upstream;dur=[0-9.]+;desc="1 requests, [0-9]+ bytes", total;dur=[0-9.]+$')
+
+  def test_server_timing_no_phases(self):
+    resp = client.get('/url?input=nope&url=http://my/posts.html')
+    self.assert_equals(400, resp.status_code)
+    self.assertRegex(resp.headers['Server-Timing'], r'^total;dur=[0-9.]+$')
+
+  def test_render_cache_per_request(self):
+    caches = []
+    def activities_to_jsonfeed(activities, **kwargs):
+      caches.append(microformats2.render_cache.get())
+      return {}
+
+    self.mox.stubs.Set(jsonfeed, 'activities_to_jsonfeed', activities_to_jsonfeed)
+    for _ in range(2):
+      self.expect_requests_get('http://my/posts.json', AS1)
+    self.mox.ReplayAll()
+
+    for _ in range(2):
+      resp = client.get('/url?url=http://my/posts.json&input=as1&output=jsonfeed&cache=false')
+      self.assert_equals(200, resp.status_code)
+
+    self.assertEqual([{}, {}], caches)
+    self.assertIsNot(caches[0], caches[1])
+    self.assertIsNone(microformats2.render_cache.get())
+
+  def test_log_payloads_override(self):
+    self.mox.stubs.Set(app_module, 'PAYLOAD_LOG_SAMPLE_RATE', 0)
+    self.mox.stubs.Set(app_module, 'recent_payloads', collections.deque(maxlen=3))
+    for _ in range(2):
+      self.expect_requests_get('http://my/posts.json', AS1)
+    self.mox.ReplayAll()
+
+    url = '/url?url=http://my/posts.json&input=as1&output=as2&log_payloads='
+    self.assert_equals(200, client.get(url + 'false').status_code)
+    self.assertEqual([], list(app_module.recent_payloads))
+
+    self.assert_equals(200, client.get(url + 'true').status_code)
+    [logged] = app_module.recent_payloads
+    self.assertEqual('Converted to AS1', logged['label'])
+    self.assertEqual(url + 'true', logged['path'])
+    self.assertEqual(AS1, json_loads(logged['payload']))
+
+  def test_log_payload_sampled_lazy_and_capped(self):
+    self.mox.stubs.Set(app_module, 'PAYLOAD_LOG_MAX_CHARS', 5)
+    self.mox.stubs.Set(app_module, 'recent_payloads', collections.deque(maxlen=2))
+
+    def fail():
+      raise AssertionError('should not be evaluated')
+
+    with app.test_request_context('/'):
+      self.mox.stubs.Set(app_module, 'PAYLOAD_LOG_SAMPLE_RATE', 0)
+      app_module.log_payload('foo', fail)
+
+    with app.test_request_context('/'):
+      self.mox.stubs.Set(app_module, 'PAYLOAD_LOG_SAMPLE_RATE', 1)
+      app_module.log_payload('a', lambda: 'xyz')
+      app_module.log_payload('b', {'abc': 'def'})
+      app_module.log_payload('c', 'abcdefghij')
+
+    # ring buffer keeps the last two
+    self.assertEqual([('b', '{"abc... (13 chars total)'),
+                      ('c', 'abcde... (10 chars total)')],
+                     [(p['label'], p['payload']) for p in app_module.recent_payloads])
+
+  def test_url_cache_false_streams(self):
+    html = HTML % {'body_class': '', 'extra': ''}
+    for output in 'as1', 'as2', 'atom', 'html', 'mf2-json', 'rss':
+      with self.subTest(output):
+        self.expect_requests_get('http://my/posts.html', html)
+        self.expect_requests_get('http://my/posts.html', html)
+        self.mox.ReplayAll()
+
+        url = f'/url?url=http://my/posts.html&input=html&output={output}'
+        built = client.get(url)
+        streamed = client.get(url + '&cache=false')
+        self.assert_equals(200, streamed.status_code)
+        self.assert_equals(built.headers['Content-Type'],
+                           streamed.headers['Content-Type'])
+        if output in ('as1', 'as2', 'mf2-json'):
+          self.assert_equals(built.json, streamed.json)
+        elif output != 'rss':  # has lastBuildDate
+          self.assert_multiline_equals(
+            built.get_data(as_text=True),
+            streamed.get_data(as_text=True).replace('&amp;cache=false', ''))
+
+        self.mox.VerifyAll()
+        self.mox.ResetAll()
+
+  def test_make_response_stream(self):
+    activities = [{'object': {'content': 'foo'}}, {'object': {'content': 'bar'}}]
+    for output in 'as1', 'as2', 'atom', 'html', 'mf2-json':
+      with self.subTest(output), \
+           app.test_request_context(f'/url?output={output}'):
+        resp = app_module.make_response(
+          source.Source.make_activities_base_response(copy.deepcopy(activities)),
+          stream=True)
+        self.assertTrue(resp.is_streamed)
+        self.assertIn('bar', resp.get_data(as_text=True))
+
+      with self.subTest(output), \
+           app.test_request_context(f'/url?output={output}'):
+        self.assertIsInstance(app_module.make_response(
+          source.Source.make_activities_base_response(copy.deepcopy(activities))),
+          tuple)
+
+  def test_coalesce(self):
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    @app_module.coalesce
+    def view():
+      calls.append(None)
+      started.set()
+      release.wait(5)
+      return 'done'
+
+    responses = []
+    def get():
+      with app.test_request_context('/url?url=http://my/posts.html&input=html'):
+        responses.append(view().get_data(as_text=True))
+
+    first = threading.Thread(target=get)
+    first.start()
+    self.assertTrue(started.wait(5))
+
+    second = threading.Thread(target=get)
+    second.start()
+    flight = app_module.flights['GET /url?url=http://my/posts.html&input=html']
+    for _ in range(500):
+      if flight.waiters:
+        break
+      time.sleep(.01)
+    self.assertEqual(1, flight.waiters)
+
+    release.set()
+    first.join(5)
+    second.join(5)
+    self.assertEqual(1, len(calls))
+    self.assertEqual(['done', 'done'], responses)
+    self.assertEqual({}, app_module.flights)
+
+  def test_coalesce_skips_cache_false(self):
+    calls = []
+
+    @app_module.coalesce
+    def view():
+      calls.append(None)
+      self.assertEqual({}, app_module.flights)
+      return 'done'
+
+    with app.test_request_context('/url?url=http://my/posts.html&cache=false'):
+      self.assertEqual('done', view())
+    self.assertEqual(1, len(calls))
+
+  def test_cache_skipped_only_query_param(self):
+    with app.test_request_context('/convert?cache=false', method='POST'):
+      self.assertTrue(app_module.cache_skipped())
+
+    # flask_util.cached ignores form params, so we do too
+    with app.test_request_context('/convert', method='POST',
+                                  data={'cache': 'false'}):
+      self.assertFalse(app_module.cache_skipped())
+
+  @testutil.enable_flask_caching(app, cache)
+  def test_gzip(self):
+    big = copy.deepcopy(AS1)
+    big[0]['object']['content'] = 'foo bar ' * 500
+    self.expect_requests_get('http://my/posts.json', big)
+    self.mox.ReplayAll()
+
+    url = '/url?url=http://my/posts.json&input=as1&output=as1'
+    resp = client.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+    self.assert_equals(200, resp.status_code)
+    self.assert_equals('gzip', resp.headers['Content-Encoding'])
+    self.assertIn('Accept-Encoding', resp.headers['Vary'])
+    compressed = resp.get_data()
+    self.assertLess(len(compressed), 1000)
+    got = json_loads(gzip.decompress(compressed))
+    self.assert_equals(big, got['items'])
+
+    # cached, compressed response, served to a client that doesn't accept gzip
+    resp = client.get(url)
+    self.assert_equals(200, resp.status_code)
+    self.assertNotIn('Content-Encoding', resp.headers)
+    self.assert_equals(got, resp.json)
+
+  def test_gzip_small_response(self):
+    self.expect_requests_get('http://my/posts.json', AS1)
+    self.mox.ReplayAll()
+
+    resp = client.get('/url?url=http://my/posts.json&input=as1&output=as1',
+                      headers={'Accept-Encoding': 'gzip'})
+    self.assert_equals(200, resp.status_code)
+    self.assertNotIn('Content-Encoding', resp.headers)
+    self.assert_equals(AS1, resp.json['items'])
+
+  @testutil.enable_flask_caching(app, cache)
+  def test_cache_as1_across_output_formats(self):
+    self.expect_requests_get('http://my/posts.json', AS1)
+    self.mox.ReplayAll()
+
+    # only the first fetch should hit the source; the rest should render from
+    # the cached AS1
+    url = '/url?url=http://my/posts.json&input=as1&output='
+    resp = client.get(url + 'mf2-json')
+    self.assert_equals(200, resp.status_code)
+    self.assert_equals(MF2, resp.json)
+
+    resp = client.get(url + 'as2')
+    self.assert_equals(200, resp.status_code)
+    self.assert_equals(AS2_RESPONSE, resp.json)
+
+    resp = client.get(url + 'jsonfeed')
+    self.assert_equals(200, resp.status_code)
+    self.assert_equals('foo ☕ bar', resp.json['items'][0]['content_html'])
+
+  @testutil.enable_flask_caching(app, cache)
+  def test_upstream_conditional_get_not_modified(self):
+    html = HTML % {'body_class': '', 'extra': ''}
+    self.expect_requests_get('http://my/posts.html', html, response_headers={
+      'ETag': '"abc"',
+      'Last-Modified': 'Tue, 15 Nov 1994 12:45:26 GMT',
+    })
+    self.expect_requests_get('http://my/posts.html', '', status_code=304,
+                             content_type=None, headers={
+      'If-None-Match': '"abc"',
+      'If-Modified-Since': 'Tue, 15 Nov 1994 12:45:26 GMT',
+    })
+    self.mox.ReplayAll()
+
+    # skip the response cache so that we fetch upstream both times
+    url = '/url?url=http://my/posts.html&input=html&output=as1&cache=false'
+    first = client.get(url)
+    self.assert_equals(200, first.status_code)
+
+    second = client.get(url)
+    self.assert_equals(200, second.status_code)
+    self.assert_equals(first.json, second.json)
+
+  @testutil.enable_flask_caching(app, cache)
+  def test_upstream_conditional_get_modified(self):
+    self.expect_requests_get('http://my/posts.json', AS1,
+                             response_headers={'ETag': '"abc"'})
+    changed = copy.deepcopy(AS1)
+    changed[0]['object']['content'] = 'changed'
+    self.expect_requests_get('http://my/posts.json', changed,
+                             headers={'If-None-Match': '"abc"'},
+                             response_headers={'ETag': '"def"'})
+    self.expect_requests_get('http://my/posts.json', '', status_code=304,
+                             content_type=None,
+                             headers={'If-None-Match': '"def"'})
+    self.mox.ReplayAll()
+
+    url = '/url?url=http://my/posts.json&input=as1&output=as1&cache=false'
+    self.assert_equals('foo ☕ bar', client.get(url).json['items'][0]['object']['content'])
+    self.assert_equals('changed', client.get(url).json['items'][0]['object']['content'])
+    self.assert_equals('changed', client.get(url).json['items'][0]['object']['content'])
+
   def test_hub(self):
     self.expect_requests_get('http://my/posts.html', HTML % {
       'body_class': '',
@@ -832,6 +1243,62 @@ not RSS!
     self.assert_equals('application/json', resp.headers['Content-Type'])
     self.assert_equals(expected, resp.json)
 
+  def test_convert_as2_to_as1(self):
+    resp = client.post('/convert?input=as2&output=as1', json=AS2)
+    self.assert_equals(200, resp.status_code)
+    self.assert_equals('application/stream+json', resp.headers['Content-Type'])
+    self.assert_equals(AS1_RESPONSE, resp.json)
+
+  def test_convert_jsonfeed_to_json_mf2(self):
+    resp = client.post('/convert?input=jsonfeed&output=json-mf2', json=JSONFEED)
+    self.assert_equals(200, resp.status_code)
+    self.assert_equals('application/mf2+json', resp.headers['Content-Type'])
+
+    expected = copy.deepcopy(MF2)
+    expected['items'][0]['properties']['uid'] = [JSONFEED['items'][0]['id']]
+    self.assert_equals(expected, resp.json)
+
+  def test_convert_html_to_as1_with_url_and_fragment(self):
+    html = HTML % {'body_class': '', 'extra': ''}
+    html = html.replace('<article class="h-entry">', '<article id="a" class="h-entry">', 1)
+    resp = client.post('/convert?input=html&output=mf2-json&url=http://my/posts.html%23a',
+                       data=html, content_type='text/html; charset=utf-8')
+    self.assert_equals(200, resp.status_code)
+
+    expected = copy.deepcopy(MF2['items'][0])
+    expected['properties']['name'] = [expected['properties']['content'][0].strip()]
+    self.assert_equals({'items': [expected]}, resp.json)
+
+  def test_convert_rss_to_as1_multipart(self):
+    resp = client.post('/convert', data={
+      'input': 'rss',
+      'output': 'as1',
+      'doc': (BytesIO(RSS_CONTENT.encode()), 'feed.xml'),
+    })
+    self.assert_equals(200, resp.status_code)
+    self.assert_equals(RSS_ACTIVITIES, [a['object'] for a in resp.json['items']])
+
+  def test_convert_html_to_atom(self):
+    resp = client.post('/convert?input=html&output=atom&url=http://my/posts.html',
+                       data=HTML % {'body_class': '', 'extra': ''},
+                       content_type='text/html')
+    self.assert_equals(200, resp.status_code)
+    self.assert_equals('application/atom+xml', resp.headers['Content-Type'])
+    self.assert_multiline_in(
+      '<link rel="alternate" href="http://my/posts.html" type="text/html" />',
+      resp.get_data(as_text=True))
+
+  def test_convert_errors(self):
+    for path, data in (
+        ('/convert?input=nope&output=as1', '[]'),
+        ('/convert?input=as1&output=as1', ''),
+        ('/convert?input=as1&output=as1', 'not json'),
+        ('/convert?input=atom&output=as1', 'not xml'),
+        ('/convert?input=as1&output=nope', '[]'),
+    ):
+      resp = client.post(path, data=data, content_type='application/json')
+      self.assert_equals(400, resp.status_code, path)
+
   def test_demo(self):
     resp = client.get('/demo?site=sayt&user_id=me&group_id=@groop&activity_id=123')
     self.assert_equals(302, resp.status_code, resp.get_data(as_text=True))
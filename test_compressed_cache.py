@@ -0,0 +1,102 @@
+# coding=utf-8
+"""Unit tests for compressed_cache.py.
+"""
+import pickle
+import zlib
+
+from flask import Flask
+from flask_caching import Cache
+from oauth_dropins.webutil import testutil
+
+from compressed_cache import CompressedRedisCache, CompressedSerializer
+
+
+class FakeRedis(object):
+  """Local stand-in for :class:`redis.Redis`. Stores values in a dict.
+
+  Method signatures match redis-py's, since cachelib versions differ in which
+  methods and kwargs they use.
+  """
+  def __init__(self):
+    self.data = {}
+
+  def get(self, name):
+    return self.data.get(name)
+
+  def set(self, name, value, ex=None, **kwargs):
+    self.data[name] = value
+    return True
+
+  def setex(self, name, time, value):
+    return self.set(name, value, ex=time)
+
+  def delete(self, *names):
+    return sum(1 for name in names if self.data.pop(name, None) is not None)
+
+  def exists(self, name):
+    return int(name in self.data)
+
+
+class CompressedCacheTest(testutil.TestCase):
+
+  def setUp(self):
+    super(CompressedCacheTest, self).setUp()
+    self.redis = FakeRedis()
+    self.cache = CompressedRedisCache(host=self.redis, key_prefix='x ')
+
+  def test_small_value_uncompressed(self):
+    self.assertTrue(self.cache.set('foo', {'a': 'b'}))
+    self.assertEqual(b'!' + pickle.dumps({'a': 'b'}, pickle.HIGHEST_PROTOCOL),
+                     self.redis.data['x foo'])
+    self.assertEqual({'a': 'b'}, self.cache.get('foo'))
+
+  def test_int_value_plain(self):
+    self.assertTrue(self.cache.set('foo', 5))
+    self.assertEqual(b'5', self.redis.data['x foo'])
+    self.assertEqual(5, self.cache.get('foo'))
+
+  def test_large_value_compressed(self):
+    value = {'content': 'foo bar ' * 1000}
+    self.assertTrue(self.cache.set('foo', value, timeout=60))
+
+    stored = self.redis.data['x foo']
+    self.assertTrue(stored.startswith(b'z'))
+    self.assertLess(len(stored), 1000)
+    self.assertEqual(value, pickle.loads(zlib.decompress(stored[1:])))
+    self.assertEqual(value, self.cache.get('foo'))
+
+  def test_incompressible_value_uncompressed(self):
+    value = bytes(range(256)) * 4
+    stored = CompressedSerializer().dumps(zlib.compress(value))
+    self.assertTrue(stored.startswith(b'!'))
+
+  def test_load_plain_redis_entries(self):
+    # entries written by the regular RedisCache are still readable
+    self.redis.data['x foo'] = b'!' + pickle.dumps(['a', 'b'])
+    self.redis.data['x bar'] = b'3'
+    self.assertEqual(['a', 'b'], self.cache.get('foo'))
+    self.assertEqual(3, self.cache.get('bar'))
+    self.assertIsNone(self.cache.get('baz'))
+
+  def test_load_corrupt_entry(self):
+    self.redis.data['x foo'] = b'zxyz'
+    self.assertIsNone(self.cache.get('foo'))
+
+  def test_delete_and_has(self):
+    self.cache.set('foo', 'bar')
+    self.assertTrue(self.cache.has('foo'))
+    self.assertTrue(self.cache.delete('foo'))
+    self.assertFalse(self.cache.has('foo'))
+
+  def test_flask_caching_config(self):
+    app = Flask(__name__)
+    cache = Cache(app, config={
+      'CACHE_TYPE': 'compressed_cache.CompressedRedisCache',
+      'CACHE_REDIS_URL': 'redis://localhost:6379',
+      'CACHE_KEY_PREFIX': 'granary ',
+    })
+    with app.app_context():
+      backend = cache.cache
+    self.assertIsInstance(backend, CompressedRedisCache)
+    self.assertIsInstance(backend.serializer, CompressedSerializer)
+    self.assertEqual('granary ', backend.key_prefix)